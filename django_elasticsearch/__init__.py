@@ -12,7 +12,8 @@ __author__ = 'jorgealegre'
 
 
 options.DEFAULT_NAMES = options.DEFAULT_NAMES + ('indices',
-                                                 'disable_default_index')
+                                                 'disable_default_index',
+                                                 'denormalize')
 
 ENGINE = 'django_elasticsearch'
 NUMBER_OF_REPLICAS = 1
@@ -22,6 +23,18 @@ OPERATION_DELETE_INDEX = 'delete_index'
 OPERATION_CREATE_INDEX = 'create_index'
 OPERATION_UPDATE_MAPPING = 'update_mapping'
 WRITE_QUEUE = 'write_queue'
+# write queue action replayed as update by query, like refresh of embedded copies
+UPDATE_BY_QUERY = 'update_by_query'
+REBUILD_STATUS = 'rebuild_status'
+WATERMARKS = 'watermarks'
+THROTTLE = 'throttle'
+MAPPING_FINGERPRINT = 'mapping_fingerprint'
+DATE_CHUNKS = 'date_chunks'
+# index name used to register index template fingerprints
+TEMPLATE_FINGERPRINT_INDEX = '_template'
+REBUILD_MODE_BUILDING = 'building'
+REBUILD_MODE_SYNCING = 'syncing'
+REBUILD_MODE_NONE = 'none'
 
 
 def get_installed_apps():
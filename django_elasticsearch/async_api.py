@@ -0,0 +1,191 @@
+# python
+import logging
+import threading
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+
+# django
+from django.db import connections, DEFAULT_DB_ALIAS
+
+# djes
+from django_elasticsearch.identity import identity_scope
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+# workers in shared pool when ASYNC_WORKERS option is not defined
+ASYNC_WORKERS = 50
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """
+    Worker pool shared by all async calls. Workers use their own Django connection and the node pool
+    shared by all connections, so calls in flight are only limited by ASYNC_WORKERS. With gevent
+    patched threading workers are greenlets.
+
+    :return: ThreadPool
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            options = connections.databases.get(DEFAULT_DB_ALIAS, {}).get('OPTIONS', {})
+            _POOL = ThreadPool(options.get('ASYNC_WORKERS', ASYNC_WORKERS))
+        return _POOL
+
+
+def _call(func, args, kwargs):
+    """
+    Run func in worker like in a request: documents are kept in an identity map only while func runs, and
+    worker connections are closed when it finishes
+    """
+    try:
+        with identity_scope():
+            return func(*args, **kwargs)
+    finally:
+        for connection in connections.all():
+            connection.close()
+
+
+def submit(func, *args, **kwargs):
+    """
+    Run func in worker pool
+
+    :return: AsyncResult, with get(timeout=None), ready() and wait(timeout=None)
+    """
+    return get_pool().apply_async(_call, (func, args, kwargs))
+
+
+class Pages(object):
+    """
+    Pages of queryset results, each one fetched in worker pool. Next page is requested as soon as
+    current one is returned, so next scroll page is in flight while caller handles current one.
+
+        for page in pages(queryset):
+            # page is list of model instances
+            ...
+
+    Iteration keeps the scroll context of queryset open until last page, pages are requested one at a
+    time in order.
+    """
+
+    def __init__(self, queryset, page_size=None, timeout=None):
+        using = queryset.db
+        self.page_size = page_size or connections[using].ops.SCROLL_SIZE
+        self.timeout = timeout
+        self._results = queryset.iterator()
+        self._next = None
+
+    def _fetch(self):
+        return list(islice(self._results, self.page_size))
+
+    def next_page(self):
+        """
+        Future for next page, requested once
+
+        :return: AsyncResult with list of model instances, empty after last page
+        """
+        if self._next is None:
+            self._next = submit(self._fetch)
+        return self._next
+
+    def __iter__(self):
+        while True:
+            page = self.next_page().get(self.timeout)
+            self._next = None
+            if len(page) == self.page_size:
+                # next page is fetched while caller handles this one
+                self.next_page()
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+
+
+def pages(queryset, page_size=None, timeout=None):
+    """
+    Iterate queryset results by pages fetched in worker pool, see Pages
+
+    :param queryset: QuerySet
+    :param page_size: instances per page, SCROLL_SIZE by default
+    :param timeout: seconds to wait for each page
+    :return: Pages
+    """
+    return Pages(queryset, page_size=page_size, timeout=timeout)
+
+
+def wait(results, timeout=None):
+    """
+    Wait for async results
+
+    :param results: list of AsyncResult
+    :param timeout: seconds to wait for each result
+    :return: list of values, in same order as results
+    """
+    return [result.get(timeout) for result in results]
+
+
+def fetch(queryset):
+    """
+    Evaluate queryset in worker pool. Large querysets are better iterated with pages(), which does not
+    keep all results in one future.
+
+    :param queryset: QuerySet
+    :return: AsyncResult with list of model instances
+    """
+    return submit(list, queryset)
+
+
+def count(queryset):
+    """
+    Count queryset in worker pool
+
+    :param queryset: QuerySet
+    :return: AsyncResult with number of documents
+    """
+    return submit(queryset.count)
+
+
+def bulk_create(model, objs, using=DEFAULT_DB_ALIAS):
+    """
+    Insert model instances with bulk requests in worker pool
+
+    :param model: Model class
+    :param objs: list of model instances
+    :param using: database alias
+    :return: AsyncResult with list of instances
+    """
+    return submit(model.objects.using(using).bulk_create, objs)
+
+
+def _get_mappings(using, index_name, doc_type):
+    return connections[using].ops.get_mappings(index_name, doc_type)
+
+
+def get_mappings(index_name, doc_type, using=DEFAULT_DB_ALIAS):
+    """
+    Get mappings for index and doc type in worker pool
+
+    :return: AsyncResult with mapping dictionary
+    """
+    return submit(_get_mappings, using, index_name, doc_type)
+
+
+def _search(using, index, body, params):
+    es_connection = connections[using].connection
+    return es_connection._send_request('POST', u'/{}/_search'.format(index), body, params=params or {})
+
+
+def search(index, body, params=None, using=DEFAULT_DB_ALIAS):
+    """
+    Raw search request in worker pool
+
+    :param index: Index, alias or comma separated indices
+    :param body: Search body
+    :param params: Search parameters
+    :return: AsyncResult with ElasticSearch response
+    """
+    return submit(_search, using, index, body, params)
@@ -3,13 +3,19 @@ from itertools import chain
 import logging
 import traceback
 import pprint
-from datetime import datetime
+from datetime import datetime, date, time as time_type, timedelta
 import json
 import pickle
+import time
+import base64
+import hashlib
+import threading
+from collections import deque
 
 # django
 from django.db.backends import connection_created
 from django.db import connections, router, transaction, models as dj_models, DEFAULT_DB_ALIAS
+from django.db.utils import DatabaseError
 from django.utils.datastructures import SortedDict
 from django.conf import settings
 from django.utils.translation import ugettext as _
@@ -31,8 +37,8 @@ from djangotoolbox.db.base import (
 
 # pyes
 from pyes import ES
+from pyes.models import ListBulker
 from pyes.exceptions import IndexAlreadyExistsException, IndexMissingException, ElasticSearchException
-from pyes.query import Search, QueryStringQuery
 import pyes.mappings
 from pyes.helpers import SettingsBuilder
 
@@ -40,8 +46,16 @@ from pyes.helpers import SettingsBuilder
 from creation import DatabaseCreation
 from schema import DatabaseSchemaEditor
 from . import ENGINE, NUMBER_OF_REPLICAS, NUMBER_OF_SHARDS, INTERNAL_INDEX, \
-    OPERATION_CREATE_INDEX, OPERATION_DELETE_INDEX, OPERATION_UPDATE_MAPPING
+    OPERATION_CREATE_INDEX, OPERATION_DELETE_INDEX, OPERATION_UPDATE_MAPPING, WRITE_QUEUE, \
+    REBUILD_STATUS, REBUILD_MODE_BUILDING, REBUILD_MODE_SYNCING, REBUILD_MODE_NONE, WATERMARKS, THROTTLE, \
+    MAPPING_FINGERPRINT, TEMPLATE_FINGERPRINT_INDEX, DATE_CHUNKS, UPDATE_BY_QUERY
 from mapping import model_to_mapping
+from throttle import Throttle, ReindexStats
+from identity import get_identity_map
+from cursors import KeepAlive
+from dates import encode_datetime, encode_date, encode_time, decode_datetime, decode_date, decode_time
+import denormalize
+from connection import get_node_pool, SELECTOR_ROUND_ROBIN
 import exceptions
 
 logger = logging.getLogger(__name__)
@@ -53,6 +67,8 @@ __author__ = 'jorgealegre'
 class DatabaseFeatures(NonrelDatabaseFeatures):
 
     string_based_auto_field = True
+    # related objects are loaded with one _mget per related model, see SQLCompiler.results_iter
+    supports_select_related = True
 
 
 class DatabaseOperations(NonrelDatabaseOperations):
@@ -60,6 +76,55 @@ class DatabaseOperations(NonrelDatabaseOperations):
     compiler_module = 'django_elasticsearch.compiler'
     SCROLL_TIME = '10m'
     ADD_BULK_SIZE = 1000
+    # write queue replay
+    REPLAY_BATCH_SIZE = 5000
+    REPLAY_TAIL_SIZE = 500
+    # seconds writers may keep a cached rebuild status
+    REBUILD_STATUS_TTL = 1.0
+    # seconds queries may keep a cached date chunk catalogue
+    DATE_CHUNK_CATALOGUE_TTL = 60.0
+    # seconds queries may keep a cached date chunk catalogue without chunk for today
+    DATE_CHUNK_MISSING_TTL = 5.0
+    # documents per page for queries without limit
+    SCROLL_SIZE = 1000
+    # value types stored without conversion
+    STORED_TYPES = frozenset([int, long, float, bool, unicode, str])
+    # part of scroll keep alive a consumer of a consistent iteration may take for a page before next page
+    # is requested ahead
+    KEEP_ALIVE_FRACTION = 0.5
+    # pages requested ahead for a consistent iteration before its scroll context is let expire
+    KEEP_ALIVE_MAX_PAGES = 2
+    # slices from this offset are paged with search_after cursors instead of from/size
+    SEARCH_AFTER_OFFSET = 1000
+    # documents per page for values() queries without limit, documents only have selected fields
+    VALUES_SCROLL_SIZE = 5000
+    # seconds before high-water mark read again by delta reindex, for writes searchable after last run
+    DELTA_REINDEX_OVERLAP = 300
+    # rebuild rate used to estimate rebuild time when no throttle is configured
+    REBUILD_ESTIMATE_DOCS_PER_SEC = 2000
+    # mapping attributes with default values, not returned by ES
+    MAPPING_DEFAULTS = {
+        'index': ('analyzed', True),
+        'store': ('no', False),
+        'term_vector': ('no',),
+    }
+    # mapping attributes that can not change without reindex
+    MAPPING_REINDEX_ATTRIBUTES = ('type', 'index', 'analyzer', 'index_analyzer', 'format', 'store',
+                                  'term_vector', 'path')
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseOperations, self).__init__(*args, **kwargs)
+        self._rebuild_status_cache = {}
+        # alias -> ReindexStats for running and last rebuilds
+        self.reindex_stats = {}
+        # (index_name, doc_type) -> last registered mapping fingerprint, loaded on first use
+        self._mapping_fingerprints = None
+        # template name -> [(doc_type, fingerprint)] for mappings in index template
+        self._template_mappings = {}
+        # date chunk indices known to exist
+        self._date_chunks = set()
+        # alias -> (expires, [(index_name, date_from, date_to)]) date chunk catalogue
+        self._date_chunk_catalogue = {}
 
     def value_for_db(self, value, field, lookup=None):
         """
@@ -74,25 +139,77 @@ class DatabaseOperations(NonrelDatabaseOperations):
         In the end, it calls `_value_for_db` to do the real work; you
         should typically extend that method, but only call this one.
 
+        Conversion is done by converter for field and lookup, see get_converter.
+
         :param value: A value to be passed to the database driver
         :param field: A field the value comes from
         :param lookup: None if the value is being prepared for storage;
                        lookup type name, when its going to be used as a
                        filter argument
         """
+        return self.get_converter(field, lookup)(value)
+
+    def get_converter(self, field, lookup=None):
+        """
+        Function converting values of field for database, resolved once for field, connection and lookup
+        and cached on field
+
+        :param field: A field the value comes from
+        :param lookup: None for storage, lookup type name for filter arguments
+        :return: function value -> database value
+        """
+        converters = field.__dict__.get('_es_converters')
+        if converters is None:
+            converters = field._es_converters = {}
+        key = (self.connection.alias, lookup)
+        converter = converters.get(key)
+        if converter is None:
+            converter = converters[key] = self._build_converter(field, lookup)
+        return converter
+
+    def _build_converter(self, field, lookup):
+        """
+        Build converter for field and lookup. Dates and values of types stored as they are have their own
+        converters, other values go through _value_for_db.
+        """
         field, field_kind, db_type = self._convert_as(field, lookup)
 
-        # Argument to the "isnull" lookup is just a boolean, while some
-        # other lookups take a list of values.
+        # Argument to the "isnull" lookup is just a boolean
         if lookup == 'isnull':
-            return value
-        elif lookup in ('in', 'range', 'year'):
-            return [self._value_for_db(subvalue, field,
-                                       field_kind, db_type, lookup)
-                    for subvalue in value]
+            return lambda value: value
+
+        # converters are shared by connections in all threads, only conversions needing _value_for_db use
+        # connection of current thread
+        alias = self.connection.alias
+        stored_types = self.STORED_TYPES
+
+        def convert_value(value):
+            return connections[alias].ops._value_for_db(value, field, field_kind, db_type, lookup)
+
+        if field_kind in ('ListField', 'SetField', 'DictField'):
+            convert = convert_value
+        elif field_kind in ('DateTimeField', 'DateField', 'TimeField'):
+            encode, value_type = {
+                'DateTimeField': (encode_datetime, datetime),
+                'DateField': (encode_date, date),
+                'TimeField': (encode_time, time_type),
+            }[field_kind]
+
+            def convert(value):
+                if isinstance(value, value_type):
+                    return encode(value)
+                return convert_value(value)
         else:
-            return self._value_for_db(value, field,
-                                      field_kind, db_type, lookup)
+            def convert(value):
+                # exact types, subclasses like SafeString are converted
+                if value is None or type(value) in stored_types:
+                    return value
+                return convert_value(value)
+
+        # Some lookups take a list of values
+        if lookup in ('in', 'range', 'year'):
+            return lambda values: [convert(value) for value in values]
+        return convert
 
     def _value_for_db(self, value, field, field_kind, db_type, lookup):
         """
@@ -164,12 +281,35 @@ class DatabaseOperations(NonrelDatabaseOperations):
             value = self._value_for_db_collection(value, field,
                                                   field_kind, db_type, lookup)
 
-        if field_kind in ['DateTimeField', 'TimeField']:
-            value = value.strftime("%Y-%m-%dT%H:%M:%S")
+        if field_kind == 'DateTimeField' and isinstance(value, datetime):
+            value = encode_datetime(value)
+        elif field_kind == 'DateField' and isinstance(value, date):
+            value = encode_date(value)
+        elif field_kind == 'TimeField' and isinstance(value, time_type):
+            value = encode_time(value)
 
-        if field_kind == 'DateField':
-            value = value.strftime("%Y-%m-%d")
+        return value
+
+    def _value_from_db(self, value, field, field_kind, db_type):
+        """
+        Converts a database type to a type acceptable by the field. Dates, datetimes and times are decoded
+        from ISO 8601.
 
+        :param value: A value received from the database client
+        :param field: A field having the same properties as the field
+                      the value comes from
+        :param field_kind: Equal to field.get_internal_type()
+        :param db_type: Same as creation.db_type(field)
+        """
+        value = super(DatabaseOperations, self)._value_from_db(value, field, field_kind, db_type)
+        if value is None:
+            return None
+        if field_kind == 'DateTimeField':
+            return decode_datetime(value, use_tz=settings.USE_TZ)
+        elif field_kind == 'DateField':
+            return decode_date(value)
+        elif field_kind == 'TimeField':
+            return decode_time(value)
         return value
 
     def to_dict(self, instance):
@@ -279,37 +419,54 @@ class DatabaseOperations(NonrelDatabaseOperations):
         pass
 
     def create_index(self, index_name, options=None, has_alias=True, model=None,
-                     skip_register=False, index_settings=None):
+                     skip_register=False, index_settings=None, use_template=False):
         """
         Creates index with options as settings
 
         index_name should contain time created:
         myindex-mm-dd-yyyyTHH:MM:SS with alias myindex
 
+        When use_template is True settings and mappings come from index template for index_name (see
+        put_index_template), and index is created with its alias in one request.
+
         :param index_name:
         :param options:
+        :param use_template: Create index from index template
         :return:
         :raises IndexAlreadyExistsException when can't create index.
         """
         # "logstash-%{+YYYY.MM.dd}"
         import random
         alias = index_name if has_alias is True else None
+        template_name = index_name
         index_name = u'{}-{}_{}'.format(
             index_name,
             datetime.now().strftime("%Y.%m.%d"),
             random.randint(1, 999)
         )
         es_connection = self.connection.connection
-        if index_settings is None and options is not None:
-            index_settings = {
-                'analysis': options.get('ANALYSIS', {}),
-                'number_of_replicas': options.get('NUMBER_OF_REPLICAS', NUMBER_OF_REPLICAS),
-                'number_of_shards': options.get('NUMBER_OF_SHARDS', NUMBER_OF_SHARDS),
-            }
-        es_connection.indices.create_index(index_name, settings=index_settings)
-        # alias
-        if has_alias:
-            es_connection.indices.add_alias(alias, index_name)
+        if use_template:
+            body = {}
+            if has_alias:
+                body['aliases'] = {alias: {}}
+            es_connection._send_request('PUT', u'/{}'.format(index_name), body or None)
+        else:
+            if index_settings is None and options is not None:
+                index_settings = {
+                    'analysis': options.get('ANALYSIS', {}),
+                    'number_of_replicas': options.get('NUMBER_OF_REPLICAS', NUMBER_OF_REPLICAS),
+                    'number_of_shards': options.get('NUMBER_OF_SHARDS', NUMBER_OF_SHARDS),
+                }
+            es_connection.indices.create_index(index_name, settings=index_settings)
+            # alias
+            if has_alias:
+                es_connection.indices.add_alias(alias, index_name)
+        if has_alias and alias != INTERNAL_INDEX:
+            self.delete_mapping_fingerprints(alias)
+            # mappings from template are already in index
+            if use_template:
+                for doc_type, fingerprint in self._template_mappings.get(template_name, []):
+                    self.set_mapping_fingerprint(alias, doc_type, fingerprint)
         if not skip_register:
             self.register_index_operation(index_name, OPERATION_CREATE_INDEX, index_settings, model=model)
         if has_alias:
@@ -318,6 +475,40 @@ class DatabaseOperations(NonrelDatabaseOperations):
             logger.info(u'index "{}" created'.format(index_name))
         return index_name, alias
 
+    def put_index_template(self, name, pattern, index_settings=None, mappings=None, aliases=None, order=0):
+        """
+        Register index template, so indices matching pattern are created with settings, mappings and
+        aliases in one request, and never get dynamic mappings. Unchanged templates are not sent.
+
+        :param name: Template name, model index alias
+        :param pattern: Index name pattern, like "mytable__by_user-*"
+        :param index_settings: Index settings
+        :param mappings: list of DocumentObjectField mappings
+        :param aliases: list of aliases for every index created from template
+        :param order: Template order
+        :return: True when template was sent
+        """
+        es_connection = self.connection.connection
+        body = {
+            'template': pattern,
+            'order': order,
+        }
+        if index_settings:
+            body['settings'] = index_settings
+        if mappings:
+            body['mappings'] = dict((mapping.name, mapping.as_dict()) for mapping in mappings)
+            self._template_mappings[name] = [(mapping.name, mapping.fingerprint()) for mapping in mappings]
+        if aliases:
+            body['aliases'] = dict((alias, {}) for alias in aliases)
+        fingerprint = hashlib.sha1(json.dumps(body, sort_keys=True)).hexdigest()
+        if self.get_mapping_fingerprint(TEMPLATE_FINGERPRINT_INDEX, name) == fingerprint:
+            logger.debug(u'put_index_template :: template "{}" unchanged'.format(name))
+            return False
+        es_connection._send_request('PUT', u'/_template/{}'.format(name), body)
+        self.set_mapping_fingerprint(TEMPLATE_FINGERPRINT_INDEX, name, fingerprint)
+        logger.info(u'put_index_template :: template "{}" pattern "{}"'.format(name, pattern))
+        return True
+
     def has_alias(self, alias):
         """
         Check if alias exists
@@ -377,13 +568,14 @@ class DatabaseOperations(NonrelDatabaseOperations):
             index_name,
         ))
 
-    def register_mapping_update(self, index_name, mapping, mapping_old=''):
+    def register_mapping_update(self, index_name, mapping, mapping_old='', fingerprint=None):
         """
         Register mapping update, writing sent mapping, current mapping at ES, and ES
         processed mapping after sent (returned by ES)
 
         :param index_name:
         :param mapping:
+        :param fingerprint: mapping fingerprint, saved so unchanged mappings are not sent again
         :return:
         """
         import base64
@@ -408,14 +600,102 @@ class DatabaseOperations(NonrelDatabaseOperations):
             'mapping': base64.encodestring(json.dumps(mapping_dict)),
             'mapping_old': mapping_old,
             'mapping_server': base64.encodestring(json.dumps(mapping_server)),
+            'fingerprint': fingerprint or '',
             'created_on': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
             'updated_on': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
         }, INTERNAL_INDEX, 'mapping_migration')
+        if fingerprint:
+            self.set_mapping_fingerprint(mapping.index_name, mapping.name, fingerprint)
         logger.info(u'register_mapping_update :: index: {} doc_type: {}'.format(
             index_name,
             mapping.name,
         ))
 
+    def _load_mapping_fingerprints(self):
+        """
+        Load all registered mapping fingerprints with one search
+
+        :return: dictionary (index_name, doc_type) -> fingerprint
+        """
+        if self._mapping_fingerprints is not None:
+            return self._mapping_fingerprints
+        fingerprints = {}
+        body = {
+            'size': self.ADD_BULK_SIZE,
+        }
+        try:
+            for hits in self.scroll(INTERNAL_INDEX, body, doc_type=MAPPING_FINGERPRINT):
+                for hit in hits:
+                    fingerprints[(hit['_source']['index_name'], hit['_source']['doc_type'])] = \
+                        hit['_source']['fingerprint']
+        except (IndexMissingException, ElasticSearchException):
+            logger.debug(u'_load_mapping_fingerprints :: no fingerprints registered')
+        self._mapping_fingerprints = fingerprints
+        return fingerprints
+
+    def get_mapping_fingerprints(self):
+        """
+        Registered mapping fingerprints, loaded once for connection
+
+        :return: dictionary (index_name, doc_type) -> fingerprint
+        """
+        return self._load_mapping_fingerprints()
+
+    def use_mapping_fingerprints(self, fingerprints):
+        """
+        Use fingerprints loaded by another connection, like connections of worker threads. Dictionary is
+        shared, so fingerprints registered through any of the connections are seen by all.
+
+        :param fingerprints: dictionary from get_mapping_fingerprints
+        :return:
+        """
+        self._mapping_fingerprints = fingerprints
+
+    def get_mapping_fingerprint(self, index_name, doc_type):
+        """
+        Get last registered mapping fingerprint for index and doc type
+
+        :param index_name:
+        :param doc_type:
+        :return: fingerprint or None
+        """
+        return self._load_mapping_fingerprints().get((index_name, doc_type))
+
+    def set_mapping_fingerprint(self, index_name, doc_type, fingerprint):
+        """
+        Register mapping fingerprint for index and doc type
+
+        :param index_name:
+        :param doc_type:
+        :param fingerprint:
+        :return:
+        """
+        es_connection = self.connection.connection
+        es_connection.index({
+            'index_name': index_name,
+            'doc_type': doc_type,
+            'fingerprint': fingerprint,
+            'updated_on': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        }, INTERNAL_INDEX, MAPPING_FINGERPRINT, id=u'{}|{}'.format(index_name, doc_type))
+        self._load_mapping_fingerprints()[(index_name, doc_type)] = fingerprint
+
+    def delete_mapping_fingerprints(self, index_name):
+        """
+        Delete mapping fingerprints for index, when index is created mappings need to be sent again
+
+        :param index_name:
+        :return:
+        """
+        fingerprints = self._load_mapping_fingerprints()
+        # dictionary can be shared with other threads, see use_mapping_fingerprints
+        keys = [key for key in list(fingerprints) if key[0] == index_name]
+        self.send_bulk([json.dumps({'delete': {'_index': INTERNAL_INDEX,
+                                               '_type': MAPPING_FINGERPRINT,
+                                               '_id': u'{}|{}'.format(*key)}})
+                        for key in keys])
+        for key in keys:
+            fingerprints.pop(key, None)
+
     def get_mappings(self, index_name, doc_type):
         """
         Get mappings for index and doc_type in dict form
@@ -433,7 +713,965 @@ class DatabaseOperations(NonrelDatabaseOperations):
             mapping_dict = {}
         return mapping_dict
 
-    def rebuild_index(self, alias):
+    def scroll(self, index, body, doc_type=None, scroll=None, params=None):
+        """
+        Iterates pages of raw hits for search body using a scroll context
+
+        :param index: Index or alias to search
+        :param body: Search body
+        :param doc_type: Optional doc type
+        :param scroll: Scroll keep alive time, SCROLL_TIME by default
+        :param params: Additional search parameters
+        :return: generator of hit lists
+        """
+        es_connection = self.connection.connection
+        scroll = scroll or self.SCROLL_TIME
+        if doc_type:
+            path = u'/{}/{}/_search'.format(index, doc_type)
+        else:
+            path = u'/{}/_search'.format(index)
+        params = dict(params or {}, scroll=scroll)
+        result = es_connection._send_request('POST', path, body, params=params)
+        scroll_id = result.get('_scroll_id')
+        try:
+            while result['hits']['hits']:
+                yield result['hits']['hits']
+                result = es_connection._send_request('POST', '/_search/scroll', {
+                    'scroll': scroll,
+                    'scroll_id': scroll_id,
+                })
+                scroll_id = result.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                try:
+                    es_connection._send_request('DELETE', '/_search/scroll', {'scroll_id': [scroll_id]})
+                except ElasticSearchException:
+                    logger.debug(u'scroll :: could not clear scroll {}'.format(scroll_id))
+
+    def get_seconds(self, value):
+        """
+        Seconds for ElasticSearch time value, like "10m", "30s" or "1h"
+
+        :param value: time value
+        :return: seconds
+        """
+        units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+        value = unicode(value).strip()
+        for unit in ('ms', 's', 'm', 'h', 'd'):
+            if value.endswith(unit):
+                return float(value[:-len(unit)]) * units[unit]
+        return float(value) / 1000.0
+
+    def scroll_snapshot(self, index, body, doc_type=None, keep_alive=None, params=None):
+        """
+        Iterates pages of raw hits for search body over a scroll context, a snapshot of index not changed
+        by writes. ElasticSearch 5 has no point in time API, and a scroll context expires keep_alive after
+        last page was requested, so while consumer takes longer than KEEP_ALIVE_FRACTION of keep_alive for a
+        page, next pages are requested ahead from a keep alive thread and buffered. After
+        KEEP_ALIVE_MAX_PAGES pages are buffered context is no longer renewed, and consumer gets an error
+        when it expires. Context is cleared when iteration ends or is abandoned.
+
+        :param index: Index or alias to search
+        :param body: Search body, with page size
+        :param doc_type: Optional doc type
+        :param keep_alive: Scroll keep alive time, SCROLL_TIME by default
+        :param params: Additional search parameters
+        :return: generator of hit lists
+        :raises DatabaseError when scroll context expired
+        """
+        keep_alive = keep_alive or self.SCROLL_TIME
+        interval = self.get_seconds(keep_alive) * self.KEEP_ALIVE_FRACTION
+        pages = self.scroll(index, body, doc_type=doc_type, scroll=keep_alive, params=params)
+        lock = threading.Lock()
+        # pages requested ahead by keep alive thread
+        buffered = deque()
+        state = {
+            'requested': time.time(),
+            'done': False,
+            'error': None,
+        }
+
+        def next_page():
+            try:
+                hits = next(pages)
+            except StopIteration:
+                hits = None
+            except ElasticSearchException as e:
+                if 'SearchContextMissing' not in unicode(e) and 'No search context' not in unicode(e):
+                    raise
+                raise DatabaseError(u'Scroll context for "{}" expired, results were not consumed within '
+                                    u'keep alive'.format(index))
+            state['requested'] = time.time()
+            if hits is None:
+                state['done'] = True
+            return hits
+
+        def keep_alive_page():
+            with lock:
+                if state['done'] or time.time() - state['requested'] < interval:
+                    return
+                if len(buffered) >= self.KEEP_ALIVE_MAX_PAGES:
+                    # consumer stalled, context is let expire instead of holding whole snapshot
+                    heartbeat.stop()
+                    return
+                try:
+                    hits = next_page()
+                except Exception as e:
+                    state['done'], state['error'] = True, e
+                    return
+                if hits is not None:
+                    buffered.append(hits)
+
+        heartbeat = KeepAlive(interval, keep_alive_page)
+        heartbeat.start()
+        try:
+            while True:
+                with lock:
+                    if buffered:
+                        hits = buffered.popleft()
+                    elif state['error'] is not None:
+                        raise state['error']
+                    elif state['done']:
+                        return
+                    else:
+                        hits = next_page()
+                        if hits is None:
+                            return
+                yield hits
+        finally:
+            heartbeat.stop()
+            with lock:
+                pages.close()
+
+    def send_bulk(self, lines):
+        """
+        Send bulk lines in one request
+
+        :param lines: list of NDJSON lines, actions and sources
+        :return: ES bulk response
+        """
+        if not lines:
+            return {}
+        es_connection = self.connection.connection
+        result = es_connection._send_request('POST', '/_bulk', '\n'.join(lines) + '\n')
+        if result.get('errors'):
+            logger.error(u'send_bulk :: errors: {}'.format(self.get_bulk_failures(result)[:10]))
+        return result
+
+    def get_bulk_failures(self, result):
+        """
+        Failed items of bulk response
+
+        :param result: ES bulk response
+        :return: list of (position, item) for items with error status, in request order
+        """
+        if not result.get('errors'):
+            return []
+        return [(position, item) for position, item in enumerate(result.get('items', []))
+                if item.values()[0].get('status', 200) >= 300 or 'error' in item.values()[0]]
+
+    def send_bulk_throttled(self, lines, docs, throttle=None, stats=None):
+        """
+        Send bulk lines waiting for throttle, and add request to stats
+
+        :param lines: list of NDJSON lines
+        :param docs: number of documents in lines
+        :param throttle: Throttle
+        :param stats: ReindexStats
+        :return: ES bulk response
+        """
+        size = sum(len(line) + 1 for line in lines)
+        throttled = throttle.wait(docs, size) if throttle else 0.0
+        started = time.time()
+        result = self.send_bulk(lines)
+        if stats:
+            stats.add_bulk(docs, size, time.time() - started, throttled)
+        return result
+
+    def count_documents(self, index, query=None, doc_type=None):
+        """
+        Count documents for query
+
+        :param index: Index or alias
+        :param query: Query, all documents by default
+        :param doc_type: Optional doc type
+        :return: number of documents
+        """
+        es_connection = self.connection.connection
+        if doc_type:
+            path = u'/{}/{}/_count'.format(index, doc_type)
+        else:
+            path = u'/{}/_count'.format(index)
+        result = es_connection._send_request('POST', path, {'query': query} if query else None)
+        return result.get('count', 0)
+
+    def set_throttle(self, alias, docs_per_sec=None, bytes_per_sec=None):
+        """
+        Set rebuild and reindex limits for alias. Running rebuilds pick them up within
+        Throttle.POLL_INTERVAL seconds.
+
+        :param alias: Index alias
+        :param docs_per_sec: Documents per second, None for no limit
+        :param bytes_per_sec: Bytes per second, None for no limit
+        :return:
+        """
+        es_connection = self.connection.connection
+        es_connection.index({
+            'alias': alias,
+            'docs_per_sec': docs_per_sec,
+            'bytes_per_sec': bytes_per_sec,
+            'updated_on': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        }, INTERNAL_INDEX, THROTTLE, id=alias)
+        logger.info(u'set_throttle :: alias: {} docs_per_sec: {} bytes_per_sec: {}'.format(
+            alias,
+            docs_per_sec,
+            bytes_per_sec,
+        ))
+
+    def _get_throttle(self, alias, docs_per_sec=None, bytes_per_sec=None):
+        """
+        Get throttle for alias, with REBUILD_DOCS_PER_SEC and REBUILD_BYTES_PER_SEC options as defaults
+        """
+        options = self.connection.settings_dict.get('OPTIONS', {})
+        return Throttle(self.connection, alias,
+                        docs_per_sec=docs_per_sec or options.get('REBUILD_DOCS_PER_SEC'),
+                        bytes_per_sec=bytes_per_sec or options.get('REBUILD_BYTES_PER_SEC'))
+
+    def get_rebuild_status(self, aliases, use_cache=True):
+        """
+        Get rebuild status for aliases from internal index. Status is cached REBUILD_STATUS_TTL seconds
+        since it is checked for every write.
+
+        :param aliases: list of aliases
+        :param use_cache: Use cached status
+        :return: dictionary alias -> {'rebuild_mode', 'index_name', 'is_blocked'}
+        """
+        now = time.time()
+        status = {}
+        missing = []
+        for alias in aliases:
+            cached = self._rebuild_status_cache.get(alias)
+            if use_cache and cached and cached[0] > now:
+                status[alias] = cached[1]
+            else:
+                missing.append(alias)
+        if not missing:
+            return status
+        es_connection = self.connection.connection
+        try:
+            result = es_connection._send_request('POST', u'/{}/{}/_mget'.format(INTERNAL_INDEX, REBUILD_STATUS),
+                                                 {'ids': missing})
+            docs = result.get('docs', [])
+        except (IndexMissingException, ElasticSearchException):
+            docs = []
+        found = dict((doc['_id'], doc['_source']) for doc in docs if doc.get('found'))
+        for alias in missing:
+            alias_status = found.get(alias, {
+                'rebuild_mode': REBUILD_MODE_NONE,
+                'index_name': None,
+                'is_blocked': False,
+            })
+            self._rebuild_status_cache[alias] = (now + self.REBUILD_STATUS_TTL, alias_status)
+            status[alias] = alias_status
+        return status
+
+    def set_rebuild_status(self, alias, rebuild_mode, index_name=None, is_blocked=False, lag=0):
+        """
+        Set rebuild status for alias in internal index
+
+        :param alias: Index alias
+        :param rebuild_mode: building, syncing or none
+        :param index_name: New physical index being built
+        :param is_blocked: Block writes to alias
+        :param lag: Replay lag in seconds
+        :return:
+        """
+        es_connection = self.connection.connection
+        es_connection.index({
+            'alias': alias,
+            'index_name': index_name or '',
+            'rebuild_mode': rebuild_mode,
+            'is_blocked': is_blocked,
+            'lag': lag,
+            'updated_on': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        }, INTERNAL_INDEX, REBUILD_STATUS, id=alias)
+        self._rebuild_status_cache.pop(alias, None)
+        logger.info(u'set_rebuild_status :: alias: {} rebuild_mode: {} is_blocked: {}'.format(
+            alias,
+            rebuild_mode,
+            is_blocked,
+        ))
+
+    def _decode_queue_item(self, source):
+        """
+        Decode write queue document into list of (action, meta, source line) writes. Queue documents
+        hold structured writes, a compressed payload of writes or, for older queues, base64 bulk data.
+
+        :param source: write queue document source
+        :return: list of writes
+        """
+        import zlib
+        if 'writes' in source:
+            items = source['writes']
+        elif 'payload' in source:
+            items = json.loads(zlib.decompress(base64.b64decode(source['payload'])))
+        else:
+            writes = []
+            lines = base64.decodestring(source['data']).splitlines()
+            for action_line, source_line in zip(lines[0::2], lines[1::2]):
+                action_data = json.loads(action_line)
+                action = action_data.keys()[0]
+                writes.append((action, action_data[action], source_line))
+            return writes
+        return [(item['action'], item['meta'], json.dumps(item['source'])) for item in items]
+
+    def replay_write_queue(self, alias, index_name_physical):
+        """
+        Replays writes queued for alias while rebuilding into new physical index.
+
+        Queue is drained in sequence order in REPLAY_BATCH_SIZE batches. Inside each batch writes are
+        deduplicated by (_index, _type, _id), keeping latest write. Creates are replayed as index, since
+        the copy may already hold the document. Queued updates by query run against new index after writes
+        queued before them. Queue documents are removed only when all their writes were applied, failed
+        ones are kept and counted.
+
+        :param alias: Index alias being rebuilt
+        :param index_name_physical: New physical index
+        :return: dictionary with queued, applied, deduplicated, failed and lag (seconds behind last queued
+        write)
+        """
+        es_connection = self.connection.connection
+        queue_index = self.connection.default_indices[0]
+        es_connection.indices.refresh(queue_index)
+        stats = {
+            'queued': 0,
+            'applied': 0,
+            'deduplicated': 0,
+            'failed': 0,
+            'lag': 0.0,
+        }
+        body = {
+            'query': {
+                'bool': {
+                    'filter': {'term': {'alias': alias}}
+                }
+            },
+            'sort': [{'sequence': 'asc'}],
+            'size': self.REPLAY_BATCH_SIZE,
+        }
+        last_sequence = None
+        for hits in self.scroll(queue_index, body, doc_type=WRITE_QUEUE):
+            latest = SortedDict()
+            # key -> queue document ids holding writes for key, latest and deduplicated ones
+            sources = {}
+            for hit in hits:
+                for action, meta, source_line in self._decode_queue_item(hit['_source']):
+                    stats['queued'] += 1
+                    if meta.get('_id') is None:
+                        key = (hit['_id'], stats['queued'])
+                    else:
+                        key = (meta['_index'], meta['_type'], meta['_id'])
+                    if key in latest:
+                        stats['deduplicated'] += 1
+                        del latest[key]
+                    latest[key] = (action, meta, source_line)
+                    sources.setdefault(key, set()).add(hit['_id'])
+                last_sequence = hit['_source']['sequence']
+            failed_keys = []
+            lines = []
+            keys = []
+            for key, (action, meta, source_line) in latest.items():
+                if action == UPDATE_BY_QUERY:
+                    # writes queued before update are applied first
+                    failed_keys.extend(self._replay_bulk(lines, keys))
+                    lines, keys = [], []
+                    if not self._replay_update_by_query(index_name_physical, meta, source_line):
+                        failed_keys.append(key)
+                    continue
+                if action == 'create':
+                    action = 'index'
+                meta = dict(meta, _index=index_name_physical)
+                lines.append(json.dumps({action: meta}))
+                lines.append(source_line)
+                keys.append(key)
+            failed_keys.extend(self._replay_bulk(lines, keys))
+            failed_ids = set()
+            for key in failed_keys:
+                failed_ids.update(sources[key])
+            stats['applied'] += len(latest) - len(failed_keys)
+            stats['failed'] += len(failed_keys)
+            self.send_bulk([json.dumps({'delete': {'_index': hit['_index'],
+                                                   '_type': WRITE_QUEUE,
+                                                   '_id': hit['_id']}})
+                            for hit in hits if hit['_id'] not in failed_ids])
+            stats['lag'] = time.time() - last_sequence / 1000000.0
+            logger.info(u'replay_write_queue :: alias: {} applied: {} deduplicated: {} failed: {} '
+                        u'lag: {:.2f}s'.format(
+                            alias,
+                            stats['applied'],
+                            stats['deduplicated'],
+                            stats['failed'],
+                            stats['lag'],
+                        ))
+        return stats
+
+    def _replay_bulk(self, lines, keys):
+        """
+        Send replayed writes
+
+        :param lines: bulk lines, action and source for each write
+        :param keys: write keys, in same order
+        :return: keys of failed writes
+        """
+        return [keys[position] for position, item in self.get_bulk_failures(self.send_bulk(lines))]
+
+    def _replay_update_by_query(self, index_name_physical, meta, source_line):
+        """
+        Run queued update by query, like refresh of embedded copies, against rebuilt index
+
+        :return: True when all matching documents were updated
+        """
+        es_connection = self.connection.connection
+        try:
+            result = es_connection._send_request('POST', u'/{}/{}/_update_by_query'.format(
+                index_name_physical, meta['_type']), json.loads(source_line), params={'conflicts': 'proceed'})
+        except ElasticSearchException:
+            logger.error(traceback.format_exc())
+            return False
+        if result.get('failures'):
+            logger.error(u'_replay_update_by_query :: failures: {}'.format(result['failures'][:10]))
+            return False
+        return True
+
+    def queue_update_by_query(self, alias, doc_type, body):
+        """
+        Queue update by query for alias being rebuilt, so it is run again against rebuilt index when queue
+        is replayed
+
+        :param alias: Index alias being rebuilt
+        :param doc_type: Doc type
+        :param body: Update by query body
+        :return:
+        """
+        es_connection = self.connection.connection
+        es_connection.index({
+            'alias': alias,
+            'sequence': int(time.time() * 1000000),
+            'count': 1,
+            'created_on': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+            'writes': [{
+                'action': UPDATE_BY_QUERY,
+                'meta': {'_index': alias, '_type': doc_type},
+                'source': body,
+            }],
+        }, self.connection.default_indices[0], WRITE_QUEUE)
+
+    def _replay_write_queue_checked(self, alias, index_name_physical):
+        """
+        Replay write queue, aborting rebuild when writes could not be applied. Failed writes are kept in
+        queue.
+
+        :raises RebuildIndexException when queued writes failed
+        """
+        stats = self.replay_write_queue(alias, index_name_physical)
+        if stats['failed']:
+            raise exceptions.RebuildIndexException(_(
+                u'Rebuild of "{}" aborted, {} queued writes could not be applied into "{}"'.format(
+                    alias, stats['failed'], index_name_physical)))
+        return stats
+
+    def get_routing(self, index_data, document):
+        """
+        Get routing for index from routing_field path, like "user.id", or fixed routing
+
+        :param index_data: model index data
+        :param document: document
+        :return: routing value or None
+        """
+        if 'routing_field' in index_data:
+            value = document
+            for key in index_data['routing_field'].split('.'):
+                if not isinstance(value, dict):
+                    return None
+                value = value.get(key)
+            return value
+        return index_data.get('routing')
+
+    def get_model_index(self, alias):
+        """
+        Get model and model index data for model index alias with format {model}__{model_index_name}
+
+        :param alias: Model index alias
+        :return: (model, index_data)
+        :raises RebuildIndexException when alias is not a model index
+        """
+        if '__' not in alias:
+            raise exceptions.RebuildIndexException(_(u'Invalid model index format "{}"'.format(alias)))
+        db_table, model_index_name = alias.split('__', 1)
+        for app_name, app_models in self.connection.introspection.models.iteritems():
+            for model in app_models:
+                if model._meta.db_table != db_table:
+                    continue
+                for model_index in getattr(model._meta, 'indices', None) or []:
+                    if model_index.keys()[0] == model_index_name:
+                        return model, model_index[model_index_name]
+        raise exceptions.RebuildIndexException(_(u'Model index "{}" not found'.format(alias)))
+
+    def get_denormalized_snapshot(self, instance, field_names):
+        """
+        Fields of related object embedded into documents, as stored
+
+        :param instance: related model instance
+        :param field_names: names of embedded fields
+        :return: dictionary column -> value
+        """
+        opts = instance._meta
+        snapshot = {}
+        for field_name in field_names:
+            field = opts.get_field(field_name)
+            value = field.get_db_prep_save(getattr(instance, field.attname), connection=self.connection)
+            snapshot[field.column] = self.value_for_db(value, field)
+        return snapshot
+
+    def update_denormalized(self, model, field, snapshots):
+        """
+        Refresh embedded copies of related objects in model documents, one _update_by_query for each index
+        model is written to
+
+        :param model: Model class with denormalize option
+        :param field: related field embedded
+        :param snapshots: dictionary related pk -> snapshot
+        :return:
+        """
+        opts = model._meta
+        es_connection = self.connection.connection
+        indices = []
+        if not getattr(opts, 'disable_default_index', False):
+            indices.append(self.connection.default_indices[0])
+        for model_index in getattr(opts, 'indices', None) or []:
+            indices.append(u'{}__{}'.format(opts.db_table, model_index.keys()[0]))
+        body = {
+            'query': {
+                'terms': {
+                    field.column: snapshots.keys(),
+                }
+            },
+            'script': {
+                'lang': 'painless',
+                'inline': 'ctx._source[params.field] = params.snapshots[String.valueOf(ctx._source[params.column])]',
+                'params': {
+                    'field': field.name,
+                    'column': field.column,
+                    'snapshots': snapshots,
+                }
+            }
+        }
+        # indices being rebuilt get the update again after copy, replaying write queue
+        for alias, status in self.get_rebuild_status(indices).iteritems():
+            if status['rebuild_mode'] in (REBUILD_MODE_BUILDING, REBUILD_MODE_SYNCING):
+                self.queue_update_by_query(alias, opts.db_table, body)
+        for index_name in indices:
+            result = es_connection._send_request('POST', u'/{}/{}/_update_by_query'.format(index_name, opts.db_table),
+                                                 body, params={'conflicts': 'proceed'})
+            logger.debug(u'update_denormalized :: index: {} field: {} related: {} updated: {}'.format(
+                index_name, field.name, len(snapshots), result.get('updated')))
+        # updated documents are not known by pk, loaded ones for model are stale
+        get_identity_map().discard_model(model)
+
+    def get_model_read_index(self, model):
+        """
+        Index model documents are read from: global index, or first model index when model disables
+        default index
+
+        :param model: Model class
+        :return: (index_name, index_data) with index_data None for global index
+        """
+        opts = model._meta
+        if not getattr(opts, 'disable_default_index', False) or not getattr(opts, 'indices', None):
+            return self.connection.default_indices[0], None
+        model_index_name = opts.indices[0].keys()[0]
+        return u'{}__{}'.format(opts.db_table, model_index_name), opts.indices[0][model_index_name]
+
+    def get_documents(self, model, ids):
+        """
+        Entities for model by primary keys, from identity map for current request and one _mget request for
+        documents not loaded yet. Date chunked indices, whose alias has many indices, and indices routed
+        by routing_field, whose routing is not known from pk, are searched by ids.
+
+        :param model: Model class
+        :param ids: primary keys
+        :return: dictionary pk -> entity, for documents found
+        """
+        identity_map = get_identity_map()
+        opts = model._meta
+        entities = {}
+        missing = []
+        for pk in set(unicode(pk) for pk in ids if pk is not None):
+            entity = identity_map.get(model, pk)
+            if entity is None:
+                missing.append(pk)
+            else:
+                entities[pk] = entity
+        if not missing:
+            return entities
+        es_connection = self.connection.connection
+        index_name, index_data = self.get_model_read_index(model)
+        index_data = index_data or {}
+        if index_data.get('date_chunks') or 'routing_field' in index_data:
+            result = es_connection._send_request('POST', u'/{}/{}/_search'.format(index_name, opts.db_table), {
+                'query': {'ids': {'values': missing}},
+                'size': len(missing),
+            })
+            hits = result['hits']['hits']
+        else:
+            if index_data.get('routing') is not None:
+                body = {'docs': [{'_id': pk, '_routing': index_data['routing']} for pk in missing]}
+            else:
+                body = {'ids': missing}
+            result = es_connection._send_request('POST', u'/{}/{}/_mget'.format(index_name, opts.db_table),
+                                                 body)
+            hits = [doc for doc in result['docs'] if doc.get('found')]
+        logger.debug(u'get_documents :: {} requested: {} found: {}'.format(opts.db_table, len(missing), len(hits)))
+        for hit in hits:
+            entity = dict(hit.get('_source', {}))
+            entity[opts.pk.column] = hit['_id']
+            identity_map.add(model, hit['_id'], entity)
+            entities[hit['_id']] = entity
+        return entities
+
+    def get_date_chunk(self, index_data, value):
+        """
+        Get date chunk for model index with date_chunks option, like "2015.01.17" per day or "2015.01"
+        per month
+
+        :param index_data: model index data
+        :param value: date value for chunk field, as stored (ISO format) or date
+        :return: (chunk, date_from, date_to) with dates as YYYY-MM-DD, date_to not included
+        """
+        from django_elasticsearch.models import DATE_CHUNKS_PER_DAY, DATE_CHUNKS_PER_MONTH
+        if value is None:
+            value = datetime.now()
+        if not isinstance(value, basestring):
+            value = value.strftime("%Y-%m-%d")
+        year, month, day = int(value[0:4]), int(value[5:7]), int(value[8:10])
+        if index_data['date_chunks'] == DATE_CHUNKS_PER_DAY:
+            date_from = datetime(year, month, day)
+            date_to = date_from + timedelta(days=1)
+            chunk = date_from.strftime("%Y.%m.%d")
+        elif index_data['date_chunks'] == DATE_CHUNKS_PER_MONTH:
+            date_from = datetime(year, month, 1)
+            date_to = datetime(year + month / 12, month % 12 + 1, 1)
+            chunk = date_from.strftime("%Y.%m")
+        else:
+            raise exceptions.DateChunkException(_(u'Invalid date_chunks "{}"'.format(index_data['date_chunks'])))
+        return chunk, date_from.strftime("%Y-%m-%d"), date_to.strftime("%Y-%m-%d")
+
+    def get_date_chunk_index(self, alias, index_data, document):
+        """
+        Get physical index for document in model index with date_chunks option, creating it when needed.
+        Index gets settings, mapping and read alias from model index template.
+
+        :param alias: Model index alias
+        :param index_data: model index data
+        :param document: document
+        :return: index name, like "mytable__by_day-2015.01.17"
+        """
+        chunk, date_from, date_to = self.get_date_chunk(index_data,
+                                                        document.get(index_data.get('date_field', 'created_on')))
+        index_name = u'{}-{}'.format(alias, chunk)
+        if index_name not in self._date_chunks:
+            self.create_date_chunk(alias, index_name, index_data['date_chunks'], date_from, date_to)
+        return index_name
+
+    def create_date_chunk(self, alias, index_name, date_chunks, date_from, date_to):
+        """
+        Create date chunk index from template, and register it in chunk catalogue at internal index
+
+        :param alias: Model index alias
+        :param index_name: Chunk index
+        :param date_chunks: per_day or per_month
+        :param date_from: First date in chunk, YYYY-MM-DD
+        :param date_to: First date after chunk, YYYY-MM-DD
+        :return:
+        """
+        es_connection = self.connection.connection
+        try:
+            es_connection._send_request('PUT', u'/{}'.format(index_name))
+            logger.info(u'create_date_chunk :: index "{}" aliased "{}" created'.format(index_name, alias))
+        except IndexAlreadyExistsException:
+            pass
+        es_connection.index({
+            'alias': alias,
+            'index_name': index_name,
+            'date_chunks': date_chunks,
+            'date_from': date_from,
+            'date_to': date_to,
+            'created_on': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        }, INTERNAL_INDEX, DATE_CHUNKS, id=index_name)
+        self._date_chunks.add(index_name)
+        self._date_chunk_catalogue.pop(alias, None)
+
+    def get_date_chunk_catalogue(self, alias, refresh=False):
+        """
+        Get date chunk indices for model index from catalogue at internal index, cached
+        DATE_CHUNK_CATALOGUE_TTL seconds
+
+        :param alias: Model index alias
+        :param refresh: Reload catalogue
+        :return: list of (index_name, date_from, date_to) sorted by date, dates as YYYY-MM-DD
+        """
+        now = time.time()
+        cached = self._date_chunk_catalogue.get(alias)
+        if cached and cached[0] > now and not refresh:
+            return cached[1]
+        body = {
+            'query': {
+                'bool': {
+                    'filter': {'term': {'alias': alias}}
+                }
+            },
+            'size': self.ADD_BULK_SIZE,
+        }
+        chunks = []
+        try:
+            for hits in self.scroll(INTERNAL_INDEX, body, doc_type=DATE_CHUNKS):
+                for hit in hits:
+                    chunks.append((hit['_source']['index_name'],
+                                   hit['_source']['date_from'][:10],
+                                   hit['_source']['date_to'][:10]))
+        except (IndexMissingException, ElasticSearchException):
+            logger.debug(u'get_date_chunk_catalogue :: no catalogue for "{}"'.format(alias))
+        chunks.sort(key=lambda chunk: chunk[1])
+        self._date_chunk_catalogue[alias] = (now + self.DATE_CHUNK_CATALOGUE_TTL, chunks)
+        return chunks
+
+    def prune_date_chunks(self, alias, date_from=None, date_to=None):
+        """
+        Get date chunk indices for model index overlapping date range
+
+        :param alias: Model index alias
+        :param date_from: First date in range, YYYY-MM-DD, None for no lower bound
+        :param date_to: Last date in range, YYYY-MM-DD, None for no upper bound
+        :return: list of index names
+        """
+        chunks = self.get_date_chunk_catalogue(alias)
+        today = datetime.now().strftime("%Y-%m-%d")
+        loaded = self._date_chunk_catalogue[alias][0] - self.DATE_CHUNK_CATALOGUE_TTL
+        if (date_to is None or date_to >= today) and time.time() - loaded >= self.DATE_CHUNK_MISSING_TTL and \
+                not any(chunk_from <= today < chunk_to for index_name, chunk_from, chunk_to in chunks):
+            # chunk for today could have been created by another process after catalogue was loaded,
+            # older chunks are seen when cached catalogue expires
+            chunks = self.get_date_chunk_catalogue(alias, refresh=True)
+        return [index_name for index_name, chunk_from, chunk_to in chunks
+                if (date_from is None or chunk_to > date_from) and (date_to is None or chunk_from <= date_to)]
+
+    def purge_date_chunks(self, alias, retention):
+        """
+        Delete whole date chunk indices older than retention chunks for model index
+
+        :param alias: Model index alias
+        :param retention: Number of chunks to keep, days or months
+        :return: list of deleted indices
+        """
+        from django_elasticsearch.models import DATE_CHUNKS_PER_DAY
+        model, index_data = self.get_model_index(alias)
+        if index_data['date_chunks'] == DATE_CHUNKS_PER_DAY:
+            oldest = (datetime.now() - timedelta(days=retention - 1)).strftime("%Y.%m.%d")
+        else:
+            now = datetime.now()
+            months = now.year * 12 + now.month - 1 - (retention - 1)
+            oldest = datetime(months / 12, months % 12 + 1, 1).strftime("%Y.%m")
+        es_connection = self.connection.connection
+        try:
+            indices = es_connection.indices.get_alias(alias)
+        except IndexMissingException:
+            indices = []
+        deleted = []
+        for index_name in sorted(indices):
+            chunk = index_name[len(alias) + 1:]
+            if not index_name.startswith(alias + '-') or chunk >= oldest:
+                continue
+            self.delete_index(index_name)
+            try:
+                es_connection.delete(INTERNAL_INDEX, DATE_CHUNKS, index_name)
+            except ElasticSearchException:
+                pass
+            self._date_chunks.discard(index_name)
+            deleted.append(index_name)
+        self._date_chunk_catalogue.pop(alias, None)
+        return deleted
+
+    def get_watermark(self, alias):
+        """
+        Get updated_on high-water mark for alias from internal index
+
+        :param alias: Index alias
+        :return: watermark as epoch milliseconds, None when alias never was reindexed
+        """
+        es_connection = self.connection.connection
+        try:
+            result = es_connection._send_request('GET', u'/{}/{}/{}'.format(INTERNAL_INDEX, WATERMARKS, alias))
+        except (IndexMissingException, ElasticSearchException):
+            return None
+        if not result.get('found'):
+            return None
+        return result['_source']['watermark']
+
+    def set_watermark(self, alias, watermark, count=0):
+        """
+        Set updated_on high-water mark for alias in internal index
+
+        :param alias: Index alias
+        :param watermark: epoch milliseconds
+        :param count: documents copied in last run
+        :return:
+        """
+        es_connection = self.connection.connection
+        es_connection.index({
+            'alias': alias,
+            'watermark': watermark,
+            'count': count,
+            'updated_on': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        }, INTERNAL_INDEX, WATERMARKS, id=alias)
+
+    def delta_reindex(self, alias, source_index=None, field_name='updated_on', docs_per_sec=None,
+                      bytes_per_sec=None):
+        """
+        Incremental reindex for model index. Copies documents from source index with updated_on past the
+        high-water mark stored for alias in internal index, and stores new high-water mark.
+
+        Documents from DELTA_REINDEX_OVERLAP seconds before the high-water mark are copied again, since
+        writes with older updated_on could become searchable after last run. Writes are idempotent, so
+        this only costs a few documents. High-water mark only advances over pages copied without errors,
+        a failed page aborts the run. Date chunked indices get each document in its chunk.
+
+        :param alias: Model index alias, {model}__{model_index_name}
+        :param source_index: Index to copy from, global index by default
+        :param field_name: Watermark field
+        :param docs_per_sec: Documents per second limit
+        :param bytes_per_sec: Bytes per second limit
+        :return: number of documents copied
+        :raises RebuildIndexException when documents could not be copied
+        """
+        es_connection = self.connection.connection
+        model, index_data = self.get_model_index(alias)
+        if field_name not in [field.name for field in model._meta.fields]:
+            raise exceptions.RebuildIndexException(_(u'Model "{}" has no field "{}" for delta reindex'.format(
+                model._meta.db_table, field_name)))
+        source_index = source_index or self.connection.default_indices[0]
+        watermark = self.get_watermark(alias)
+        logger.info(u'delta_reindex :: alias: {} source: {} watermark: {}'.format(alias, source_index, watermark))
+        es_connection.indices.refresh(source_index)
+        body = {
+            'sort': [{field_name: 'asc'}],
+            'size': self.ADD_BULK_SIZE,
+        }
+        if watermark is not None:
+            body['query'] = {
+                'bool': {
+                    'filter': {'range': {field_name: {'gte': watermark - self.DELTA_REINDEX_OVERLAP * 1000}}}
+                }
+            }
+        throttle = self._get_throttle(alias, docs_per_sec, bytes_per_sec)
+        stats = ReindexStats(alias, total=self.count_documents(source_index, body.get('query'),
+                                                               doc_type=model._meta.db_table))
+        self.reindex_stats[alias] = stats
+        count = 0
+        failures = []
+        for hits in self.scroll(source_index, body, doc_type=model._meta.db_table):
+            lines = []
+            for hit in hits:
+                if index_data.get('date_chunks'):
+                    index_name = self.get_date_chunk_index(alias, index_data, hit['_source'])
+                else:
+                    index_name = alias
+                meta = {
+                    '_index': index_name,
+                    '_type': hit['_type'],
+                    '_id': hit['_id'],
+                }
+                routing = self.get_routing(index_data, hit['_source'])
+                if routing is not None:
+                    meta['_routing'] = routing
+                lines.append(json.dumps({'index': meta}))
+                lines.append(json.dumps(hit['_source']))
+            failures = self.get_bulk_failures(self.send_bulk_throttled(lines, len(hits), throttle, stats))
+            if failures:
+                break
+            count += len(hits)
+            if hits[-1].get('sort') and hits[-1]['sort'][0] is not None:
+                watermark = hits[-1]['sort'][0]
+            logger.debug(u'delta_reindex :: alias: {} copied: {}'.format(alias, count))
+        stats.finish()
+        if watermark is not None:
+            self.set_watermark(alias, watermark, count)
+        if failures:
+            raise exceptions.RebuildIndexException(_(
+                u'Delta reindex of "{}" aborted at watermark {}, {} documents could not be copied: {}'.format(
+                    alias, watermark, len(failures), failures[0][1])))
+        logger.info(u'delta_reindex :: alias: {} copied: {} watermark: {}'.format(alias, count, watermark))
+        return count
+
+    def diff_mapping(self, mapping, mapping_server, path=''):
+        """
+        Compare generated mapping with mapping at ES, classifying each change as additive, when ES can
+        merge it, or reindex, when index needs to be rebuilt.
+
+        :param mapping: generated mapping as dict
+        :param mapping_server: mapping at ES as dict, empty when doc type has no mapping
+        :param path: field path for nested properties
+        :return: list of (path, change, detail) with change "add" or "reindex"
+        """
+        changes = []
+        for name in self.MAPPING_REINDEX_ATTRIBUTES:
+            if path == '' and name in ('type', 'index', 'path'):
+                # document level keys are not field attributes
+                continue
+            value = mapping.get(name)
+            value_server = mapping_server.get(name)
+            if value is None or value == value_server:
+                continue
+            if value_server is None and value in self.MAPPING_DEFAULTS.get(name, ()):
+                continue
+            changes.append((path or '_doc', 'reindex', u'{}: {} -> {}'.format(name, value_server, value)))
+        for key in ('_routing', '_parent', '_source', '_all'):
+            if path == '' and key in mapping and mapping_server and mapping[key] != mapping_server.get(key):
+                changes.append((key, 'reindex', u'{} -> {}'.format(mapping_server.get(key), mapping[key])))
+        for properties_key in ('properties', 'fields'):
+            properties = mapping.get(properties_key) or {}
+            properties_server = mapping_server.get(properties_key) or {}
+            for name, field_mapping in properties.iteritems():
+                field_path = u'{}.{}'.format(path, name) if path else name
+                if name not in properties_server:
+                    changes.append((field_path, 'add', field_mapping.get('type', 'object')))
+                    continue
+                changes.extend(self.diff_mapping(field_mapping, properties_server[name], field_path))
+        return changes
+
+    def estimate_rebuild(self, alias):
+        """
+        Estimate rebuild cost for alias from primary documents and store size, with throttle limits or
+        REBUILD_ESTIMATE_DOCS_PER_SEC as rate.
+
+        :param alias: Index alias
+        :return: dictionary with docs, size (bytes) and seconds
+        """
+        es_connection = self.connection.connection
+        result = es_connection._send_request('GET', u'/{}/_stats/docs,store'.format(alias))
+        primaries = result.get('_all', {}).get('primaries', {})
+        docs = primaries.get('docs', {}).get('count', 0)
+        size = primaries.get('store', {}).get('size_in_bytes', 0)
+        options = self.connection.settings_dict.get('OPTIONS', {})
+        seconds = float(docs) / (options.get('REBUILD_DOCS_PER_SEC') or self.REBUILD_ESTIMATE_DOCS_PER_SEC)
+        if options.get('REBUILD_BYTES_PER_SEC'):
+            seconds = max(seconds, float(size) / options['REBUILD_BYTES_PER_SEC'])
+        return {
+            'docs': docs,
+            'size': size,
+            'seconds': seconds,
+        }
+
+    def rebuild_index(self, alias, docs_per_sec=None, bytes_per_sec=None):
         """
         Rebuilds index in the background
 
@@ -444,13 +1682,18 @@ class DatabaseOperations(NonrelDatabaseOperations):
         =========================
         1. Starts rebuild index, we mark index at internal db with rebuild_mode: building
         2. Add inserts and updated from time rebuild index starts to queue
-        3. End rebuild, mark rebuild_mode: syncing. This will block other save requests from a little while
-        4. Rebuild process gets requests from queue, mark indices as synced (no more data sent to queue).
-           At this time saving operations would save into new index.
-           After done, makes changes for alias to new index, delete old index. Mark index rebuild_mode: none.
-        5. Saving operations would go to new index
+        3. End rebuild, mark rebuild_mode: syncing. Queue is replayed into new index while writes go on
+        4. When queue tail is small enough, block save requests, drain the tail into new index,
+           makes changes for alias to new index and mark index rebuild_mode: none. Writes are blocked
+           only during the tail drain.
+        5. Saving operations would go to new index, old index is deleted
+
+        Copy is limited by docs_per_sec and bytes_per_sec, which can be changed while rebuild runs
+        with set_throttle. Progress is logged and kept in reindex_stats[alias].
 
         :param alias: Index alias
+        :param docs_per_sec: Documents per second limit
+        :param bytes_per_sec: Bytes per second limit
 
         :return:
         """
@@ -458,58 +1701,103 @@ class DatabaseOperations(NonrelDatabaseOperations):
         options = settings.DATABASES.get(DEFAULT_DB_ALIAS, {}).get('OPTIONS', {})
         # 1. create alt index
         logger.debug(u'rebuild_index :: alias: {}'.format(alias))
-        index_data = self.create_index(alias, options, has_alias=False)
-        index_name_physical = index_data[0]
-        # 2. Inspect all models: create mappings for alt index: mapping.save()
         if alias in map(lambda x: x['NAME'], settings.DATABASES.values()):
+            index_data = self.create_index(alias, options, has_alias=False)
+            index_name_physical = index_data[0]
+            # 2. Inspect all models: create mappings for alt index: mapping.save()
             # global index
             for app_name, app_models in self.connection.introspection.models.iteritems():
                 for model in app_models:
                     mapping = model_to_mapping(model, es_connection, index_name_physical)
                     mapping.save()
+            # write queue keeps its mapping after alias is switched
+            self.build_write_queue_mapping(index_name_physical)
         else:
             # get model by index
             # {model}__{model_index_name}
-            if '__' not in alias:
-                raise exceptions.RebuildIndexException(_(u'Invalid model index format "{}"'.format(alias)))
-            alias_fields = alias.split('__')
-            for app_name, app_models in self.connection.introspection.models.iteritems():
-                for model in app_models:
-                    if model._meta.db_table == alias_fields[0]:
-                        mapping = model_to_mapping(alias_fields[0], es_connection, index_name_physical)
-                        mapping.save()
+            from django_elasticsearch.models import get_settings_by_meta
+            model, model_index_data = self.get_model_index(alias)
+            if model_index_data.get('date_chunks'):
+                raise exceptions.RebuildIndexException(_(u'Date chunked index "{}" can not be rebuilt'.format(
+                    alias)))
+            if options.get('INDEX_TEMPLATES', False):
+                # 2. new index gets settings and mappings from template when created
+                mapping = model_to_mapping(model, es_connection, alias)
+                self.put_index_template(alias, alias + '-*', get_settings_by_meta(model_index_data), [mapping])
+                index_data = self.create_index(alias, has_alias=False, use_template=True)
+                index_name_physical = index_data[0]
+            else:
+                index_data = self.create_index(alias, has_alias=False,
+                                               index_settings=get_settings_by_meta(model_index_data))
+                index_name_physical = index_data[0]
+                # 2. create mapping for alt index
+                mapping = model_to_mapping(model, es_connection, index_name_physical)
+                mapping.save()
         logger.debug(u'rebuild_index :: Updated mappings!!')
-        # 2. export/import data to new index
-        # bulk operations
-        results = es_connection.search(Search(QueryStringQuery('*:*')),
-                                       indices=es_connection.indices.get_alias(alias),
-                                       scroll=self.SCROLL_TIME)
-        scroll_id = results.scroller_id
-        es_connection.bulk_size = self.ADD_BULK_SIZE
-        bulk = es_connection.create_bulker()
-        while results:
-            logger.debug(u'rebuild_index :: results: {}'.format(results))
-            for result in results:
-                # add to bulk for index
-                # content = json.dumps(result.get_meta()) + '\n'
-                meta = result.get_meta()
-                content = '{ "index" : { "_index" : "{index_name}", "_type" : "{doc_type}", ' \
-                          '"_id" : "{id}" } }\n'\
-                    .format(index_name_physical,
-                            meta['type'],
-                            meta['id'])
-                content += json.dumps(result) + '\n'
+        self.set_rebuild_status(alias, REBUILD_MODE_BUILDING, index_name_physical)
+        try:
+            # writers keep status cached, wait so that every write after the copy snapshot is queued
+            time.sleep(self.REBUILD_STATUS_TTL)
+            # 2. export/import data to new index
+            # bulk operations
+            body = {
+                'query': {
+                    'bool': {
+                        'must_not': {'type': {'value': WRITE_QUEUE}}
+                    }
+                },
+                'size': self.ADD_BULK_SIZE,
+            }
+            throttle = self._get_throttle(alias, docs_per_sec, bytes_per_sec)
+            stats = ReindexStats(alias, total=self.count_documents(alias, body['query']))
+            self.reindex_stats[alias] = stats
+            for hits in self.scroll(alias, body):
+                logger.debug(u'rebuild_index :: results: {}'.format(len(hits)))
+                lines = []
+                for hit in hits:
+                    meta = {
+                        '_index': index_name_physical,
+                        '_type': hit['_type'],
+                        '_id': hit['_id'],
+                    }
+                    if '_routing' in hit:
+                        meta['_routing'] = hit['_routing']
+                    lines.append(json.dumps({'index': meta}))
+                    lines.append(json.dumps(hit['_source']))
                 # make bulk add to new index "index_name_physical"
-                bulk.add(content)
-            results = es_connection.search_scroll(scroll_id, scroll=self.SCROLL_TIME)
-        bulk.flush_bulk()
-        # 3. assign alias to new index
-        indices = es_connection.indices.get_alias(alias)
-        es_connection.indices.change_aliases([
-            ('remove', indices[0], alias, {}),
-            ('add', index_name_physical, alias, {}),
-        ])
-        # 4. delete old index
+                failures = self.get_bulk_failures(self.send_bulk_throttled(lines, len(hits), throttle, stats))
+                if failures:
+                    raise exceptions.RebuildIndexException(_(
+                        u'Rebuild of "{}" aborted, {} documents could not be copied into "{}": {}'.format(
+                            alias, len(failures), index_name_physical, failures[0][1])))
+            stats.finish()
+            # 3. replay queued writes without blocking writers until tail is small
+            self.set_rebuild_status(alias, REBUILD_MODE_SYNCING, index_name_physical)
+            while True:
+                stats = self._replay_write_queue_checked(alias, index_name_physical)
+                if stats['queued'] <= self.REPLAY_TAIL_SIZE:
+                    break
+            # 4. block writers only while draining the tail and switching alias
+            self.set_rebuild_status(alias, REBUILD_MODE_SYNCING, index_name_physical, is_blocked=True,
+                                    lag=stats['lag'])
+            time.sleep(self.REBUILD_STATUS_TTL)
+            self._replay_write_queue_checked(alias, index_name_physical)
+            indices = es_connection.indices.get_alias(alias)
+            es_connection.indices.change_aliases([
+                ('remove', indices[0], alias, {}),
+                ('add', index_name_physical, alias, {}),
+            ])
+        except Exception:
+            # alias was not switched, half built index is dropped
+            logger.error(u'rebuild_index :: alias: {} aborted, deleting "{}"'.format(alias, index_name_physical))
+            try:
+                self.delete_index(index_name_physical)
+            except ElasticSearchException:
+                logger.error(traceback.format_exc())
+            raise
+        finally:
+            self.set_rebuild_status(alias, REBUILD_MODE_NONE)
+        # 5. delete old index
         self.delete_index(indices[0])
 
     def build_es_settings_from_django(self, options):
@@ -528,6 +1816,35 @@ class DatabaseOperations(NonrelDatabaseOperations):
             es_settings['analysis'] = options.get('ANALYSIS', '')
         return es_settings
 
+    def build_write_queue_mapping(self, index_name):
+        """
+        Build write_queue mapping into global index, queue is replayed in sequence order for an alias
+
+        :param index_name: Global index
+        :return:
+        """
+        from django_elasticsearch.fields import DocumentObjectField, DateField, StringField, LongField, \
+            IntegerField, ObjectField
+        es_connection = self.connection.connection
+        mapping_write_queue = DocumentObjectField(
+            name=WRITE_QUEUE,
+            connection=self.connection,
+            index_name=index_name,
+            properties={
+                'alias': StringField(index='not_analyzed'),
+                'sequence': LongField(),
+                'count': IntegerField(),
+                'writes': ObjectField(enabled=False),
+                'payload': pyes.mappings.BinaryField(),
+                'data': StringField(index='no'),
+                'created_on': DateField(),
+            })
+        result = es_connection.indices.put_mapping(doc_type=WRITE_QUEUE,
+                                                   mapping=mapping_write_queue,
+                                                   indices=index_name)
+        logger.info(u'{} result: {}'.format(index_name + '/' + WRITE_QUEUE,
+                                            pprint.PrettyPrinter(indent=4).pformat(result)))
+
     def build_django_engine_structure(self):
         """
         Build and save .django_engine mappings for document types
@@ -535,7 +1852,7 @@ class DatabaseOperations(NonrelDatabaseOperations):
         :return:
         """
         from django_elasticsearch.fields import DocumentObjectField, DateField, StringField, ObjectField, \
-            IntegerField
+            IntegerField, BooleanField, FloatField, LongField
         es_connection = self.connection.connection
         # create .django_engine index
         try:
@@ -579,6 +1896,7 @@ class DatabaseOperations(NonrelDatabaseOperations):
                     'mapping': StringField(index='not_analyzed'),
                     'mapping_server': StringField(index='not_analyzed'),
                     'mapping_old': StringField(index='not_analyzed'),
+                    'fingerprint': StringField(index='not_analyzed'),
                     'created_on': DateField(),
                     'updated_on': DateField(),
                 })
@@ -587,11 +1905,100 @@ class DatabaseOperations(NonrelDatabaseOperations):
                                                        indices=INTERNAL_INDEX)
             logger.info(u'{} result: {}'.format('.django_engine/mapping_migration',
                                                 pprint.PrettyPrinter(indent=4).pformat(result)))
+            # rebuild_status
+            mapping_rebuild_status = DocumentObjectField(
+                name=REBUILD_STATUS,
+                connection=self.connection,
+                index_name=INTERNAL_INDEX,
+                properties={
+                    'alias': StringField(index='not_analyzed'),
+                    'index_name': StringField(index='not_analyzed'),
+                    'rebuild_mode': StringField(index='not_analyzed'),
+                    'is_blocked': BooleanField(),
+                    'lag': FloatField(),
+                    'updated_on': DateField(),
+                })
+            result = es_connection.indices.put_mapping(doc_type=REBUILD_STATUS,
+                                                       mapping=mapping_rebuild_status,
+                                                       indices=INTERNAL_INDEX)
+            logger.info(u'{} result: {}'.format('.django_engine/' + REBUILD_STATUS,
+                                                pprint.PrettyPrinter(indent=4).pformat(result)))
+            # watermarks
+            mapping_watermarks = DocumentObjectField(
+                name=WATERMARKS,
+                connection=self.connection,
+                index_name=INTERNAL_INDEX,
+                properties={
+                    'alias': StringField(index='not_analyzed'),
+                    'watermark': LongField(),
+                    'count': LongField(),
+                    'updated_on': DateField(),
+                })
+            result = es_connection.indices.put_mapping(doc_type=WATERMARKS,
+                                                       mapping=mapping_watermarks,
+                                                       indices=INTERNAL_INDEX)
+            logger.info(u'{} result: {}'.format('.django_engine/' + WATERMARKS,
+                                                pprint.PrettyPrinter(indent=4).pformat(result)))
+            # throttle
+            mapping_throttle = DocumentObjectField(
+                name=THROTTLE,
+                connection=self.connection,
+                index_name=INTERNAL_INDEX,
+                properties={
+                    'alias': StringField(index='not_analyzed'),
+                    'docs_per_sec': FloatField(),
+                    'bytes_per_sec': FloatField(),
+                    'updated_on': DateField(),
+                })
+            result = es_connection.indices.put_mapping(doc_type=THROTTLE,
+                                                       mapping=mapping_throttle,
+                                                       indices=INTERNAL_INDEX)
+            logger.info(u'{} result: {}'.format('.django_engine/' + THROTTLE,
+                                                pprint.PrettyPrinter(indent=4).pformat(result)))
+            # mapping_fingerprint
+            mapping_fingerprint = DocumentObjectField(
+                name=MAPPING_FINGERPRINT,
+                connection=self.connection,
+                index_name=INTERNAL_INDEX,
+                properties={
+                    'index_name': StringField(index='not_analyzed'),
+                    'doc_type': StringField(index='not_analyzed'),
+                    'fingerprint': StringField(index='not_analyzed'),
+                    'updated_on': DateField(),
+                })
+            result = es_connection.indices.put_mapping(doc_type=MAPPING_FINGERPRINT,
+                                                       mapping=mapping_fingerprint,
+                                                       indices=INTERNAL_INDEX)
+            logger.info(u'{} result: {}'.format('.django_engine/' + MAPPING_FINGERPRINT,
+                                                pprint.PrettyPrinter(indent=4).pformat(result)))
+            # date_chunks
+            mapping_date_chunks = DocumentObjectField(
+                name=DATE_CHUNKS,
+                connection=self.connection,
+                index_name=INTERNAL_INDEX,
+                properties={
+                    'alias': StringField(index='not_analyzed'),
+                    'index_name': StringField(index='not_analyzed'),
+                    'date_chunks': StringField(index='not_analyzed'),
+                    'date_from': DateField(),
+                    'date_to': DateField(),
+                    'created_on': DateField(),
+                })
+            result = es_connection.indices.put_mapping(doc_type=DATE_CHUNKS,
+                                                       mapping=mapping_date_chunks,
+                                                       indices=INTERNAL_INDEX)
+            logger.info(u'{} result: {}'.format('.django_engine/' + DATE_CHUNKS,
+                                                pprint.PrettyPrinter(indent=4).pformat(result)))
             # register index operation
             self.register_index_operation(INTERNAL_INDEX, OPERATION_CREATE_INDEX, options)
             # register mapping update
             self.register_mapping_update(INTERNAL_INDEX, mapping_indices)
             self.register_mapping_update(INTERNAL_INDEX, mapping_migration)
+            self.register_mapping_update(INTERNAL_INDEX, mapping_rebuild_status)
+            self.register_mapping_update(INTERNAL_INDEX, mapping_watermarks)
+            self.register_mapping_update(INTERNAL_INDEX, mapping_throttle)
+            self.register_mapping_update(INTERNAL_INDEX, mapping_fingerprint)
+            self.register_mapping_update(INTERNAL_INDEX, mapping_date_chunks)
         except (IndexAlreadyExistsException, ElasticSearchException):
             traceback.print_exc()
             logger.info(u'Could not create index')
@@ -702,20 +2109,54 @@ class DatabaseWrapper(NonrelDatabaseWrapper):
         self.commit_on_exit = False
         self.connected = False
         self.autocommit = True
-        self.es_url = '{}:{}'.format(self.settings_dict['HOST'], self.settings_dict['PORT'])
+        self.es_urls = self.get_node_urls()
+        self.es_url = self.es_urls[0]
         self.default_indices = []
+        # refresh embedded copies of related objects when they are saved
+        denormalize.connect_signals()
+        # bulk buffers by thread (by greenlet with gevent patched threading)
+        self._local = threading.local()
 
         del self.connection
 
+    def get_node_urls(self):
+        """
+        Node urls from HOST, a host or list of hosts. Hosts without port use PORT.
+
+        :return: list of urls like http://localhost:9200
+        """
+        hosts = self.settings_dict['HOST'] or 'localhost'
+        if isinstance(hosts, basestring):
+            hosts = [hosts]
+        urls = []
+        for host in hosts:
+            if '://' not in host:
+                host = u'http://{}'.format(host)
+            if host.count(':') < 2 and self.settings_dict.get('PORT'):
+                host = u'{}:{}'.format(host, self.settings_dict['PORT'])
+            urls.append(host)
+        return urls
+
     def connect(self):
         import pprint
-        logger.debug(u'connect... es_url: {} options: {}'.format(self.es_url,
-                                                                 pprint.PrettyPrinter(indent=4)
-                                                                 .pformat(self.settings_dict)))
+        logger.debug(u'connect... es_urls: {} options: {}'.format(self.es_urls,
+                                                                  pprint.PrettyPrinter(indent=4)
+                                                                  .pformat(self.settings_dict)))
         if not self.connected or self.connection is None:
-            self.connection = ES(self.es_url,
+            options = self.settings_dict.get('OPTIONS', {})
+            self.connection = ES(self.es_urls,
                                  default_indices=[self.settings_dict['NAME']],
-                                 bulk_size=1000)
+                                 bulk_size=self.ops.ADD_BULK_SIZE)
+            # requests are sent through pool of nodes with keep-alive connections and failover, shared
+            # by connections in all threads
+            self.connection.connection = get_node_pool(self.es_urls,
+                                                       selector=options.get('SELECTOR', SELECTOR_ROUND_ROBIN),
+                                                       timeout=options.get('TIMEOUT', 30.0),
+                                                       max_retries=options.get('MAX_RETRIES', 3),
+                                                       maxsize=options.get('MAX_CONNECTIONS', 10),
+                                                       dead_timeout=options.get('DEAD_TIMEOUT'),
+                                                       sniff_on_start=options.get('SNIFF_ON_START', False),
+                                                       sniff_interval=options.get('SNIFF_INTERVAL'))
             connection_created.send(sender=self.__class__, connection=self)
             self.connected = True
             self.default_indices = [self.settings_dict['NAME']]
@@ -727,6 +2168,20 @@ class DatabaseWrapper(NonrelDatabaseWrapper):
             return getattr(self, attr)
         raise AttributeError(attr)
 
+    @property
+    def bulker(self):
+        """
+        Bulk buffer for current thread. Connection is shared by thread pools, like migrate workers, and
+        writes from one thread must not be mixed or flushed with writes from others.
+
+        :return: pyes ListBulker
+        """
+        bulker = getattr(self._local, 'bulker', None)
+        if bulker is None or bulker.conn is not self.connection:
+            bulker = ListBulker(self.connection, bulk_size=self.ops.ADD_BULK_SIZE)
+            self._local.bulker = bulker
+        return bulker
+
     def reconnect(self):
         if self.connected:
             del self.connection
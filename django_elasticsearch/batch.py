@@ -0,0 +1,104 @@
+# python
+import logging
+import json
+from contextlib import contextmanager
+
+# django
+from django.db import connections
+
+# pyes
+from pyes.exceptions import ElasticSearchException
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class SearchBatch(object):
+    """
+    Querysets added to batch are searched with one _msearch request when first of them is evaluated, or
+    when batch is closed. Querysets are then evaluated from batch results, without requests.
+
+    with batch() as search_batch:
+        latest = search_batch.add(Article.objects.order_by('-created_on')[:5])
+        top = search_batch.add(Article.objects.order_by('-visits')[:5])
+    """
+
+    def __init__(self):
+        # id(query) -> (query, using)
+        self._pending = {}
+        # id(query) -> (query, db_query, response)
+        self._results = {}
+
+    def add(self, queryset):
+        """
+        Add queryset to batch
+
+        :param queryset: QuerySet, evaluated after added with results from batch
+        :return: queryset
+        """
+        self._pending[id(queryset.query)] = (queryset.query, queryset.db)
+        # compiler looks up batch in query, clones of queryset are not batched
+        queryset.query.search_batch = self
+        return queryset
+
+    def has(self, query):
+        key = id(query)
+        return key in self._pending or key in self._results
+
+    def execute(self):
+        """
+        Send pending queries, one _msearch request for each database
+        """
+        from compiler import EmptyResultSet
+        pending = self._pending
+        self._pending = {}
+        by_using = {}
+        for key, (query, using) in pending.iteritems():
+            compiler = query.get_compiler(using=using)
+            try:
+                db_query = compiler.build_query(compiler.get_fields())
+            except EmptyResultSet:
+                db_query = None
+            if db_query is None or not db_query.indices:
+                self._results[key] = (query, None, None)
+                continue
+            by_using.setdefault(using, []).append((key, query, db_query))
+        for using, items in by_using.iteritems():
+            lines = []
+            for key, query, db_query in items:
+                lines.append(json.dumps(db_query.get_multi_search_header()))
+                lines.append(json.dumps(db_query.get_page_request(query.low_mark, query.high_mark)))
+            es_connection = connections[using].connection
+            result = es_connection._send_request('POST', '/_msearch', '\n'.join(lines) + '\n')
+            logger.debug(u'SearchBatch.execute :: {} queries in one request'.format(len(items)))
+            for (key, query, db_query), response in zip(items, result['responses']):
+                self._results[key] = (query, db_query, response)
+
+    def fetch(self, query):
+        """
+        Entities for query from batch results, pending queries are sent when needed. Result is used once,
+        query evaluated again searches ElasticSearch.
+
+        :param query: Django sql query
+        :return: iterator over entities
+        """
+        if id(query) in self._pending:
+            self.execute()
+        query, db_query, response = self._results.pop(id(query))
+        if db_query is None:
+            return iter([])
+        if 'error' in response:
+            raise ElasticSearchException(response['error'])
+        return db_query.fetch_response(response, query.low_mark, query.high_mark)
+
+
+@contextmanager
+def batch():
+    """
+    Context manager for search batch. Queries still pending when context exits are sent.
+    """
+    search_batch = SearchBatch()
+    yield search_batch
+    if search_batch._pending:
+        search_batch.execute()
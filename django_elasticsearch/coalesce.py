@@ -0,0 +1,97 @@
+# python
+import logging
+import threading
+import time
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+# single flights shared by all threads, by database alias
+_SINGLE_FLIGHTS = {}
+_SINGLE_FLIGHTS_LOCK = threading.Lock()
+
+
+class Flight(object):
+    """
+    Request in flight, followers wait for leader result
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.started = time.time()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Identical requests in flight at same time are sent once. Requests for a key while the first one is in
+    flight, or until window seconds after it was sent, get its result.
+    """
+
+    def __init__(self, window=0.0):
+        self.window = window
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call func, or wait for result of call in flight with same key
+
+        :param key: hashable request key
+        :param func: request function
+        :return: func result
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.event.is_set() and time.time() - flight.started > self.window:
+                flight = None
+            is_leader = flight is None
+            if is_leader:
+                flight = Flight()
+                self._flights[key] = flight
+        if not is_leader:
+            logger.debug(u'SingleFlight :: coalesced request {}'.format(key))
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = func(*args, **kwargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.event.set()
+            with self._lock:
+                # failed requests are not shared after they finish, results while window is open
+                if flight.error is not None or time.time() - flight.started > self.window:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+            self._purge()
+        return flight.result
+
+    def _purge(self):
+        """
+        Remove finished flights with window closed
+        """
+        now = time.time()
+        with self._lock:
+            for key, flight in self._flights.items():
+                if flight.event.is_set() and now - flight.started > self.window:
+                    del self._flights[key]
+
+
+def get_single_flight(name, window=0.0):
+    """
+    Single flight shared by all threads for name, like database alias
+
+    :param name: name
+    :param window: seconds finished results are shared
+    :return: SingleFlight
+    """
+    with _SINGLE_FLIGHTS_LOCK:
+        if name not in _SINGLE_FLIGHTS:
+            _SINGLE_FLIGHTS[name] = SingleFlight(window)
+        return _SINGLE_FLIGHTS[name]
@@ -8,11 +8,13 @@ from djangotoolbox.db.basecompiler import NonrelQuery, NonrelCompiler, \
 from django.db.models.fields import AutoField
 
 import datetime
+import copy
+from itertools import islice
 
 import django
 from django.conf import settings
 from django.db.models.fields import NOT_PROVIDED
-from django.db.models.query import QuerySet
+from django.db.models.query import QuerySet, get_klass_info
 from django.db.models.sql import aggregates as sqlaggregates
 from django.db.models.sql.constants import MULTI, SINGLE
 from django.db.models.sql.where import AND, OR
@@ -52,30 +54,182 @@ else:
             return query.model._meta.fields
 
 
-from django_elasticsearch import WRITE_QUEUE
+from django_elasticsearch import WRITE_QUEUE, REBUILD_MODE_BUILDING, REBUILD_MODE_SYNCING
+from django_elasticsearch.coalesce import get_single_flight
+from django_elasticsearch.identity import get_identity_map
+from django_elasticsearch.cursors import get_cursor_cache
 
 __author__ = 'jorgealegre'
 
 logger = logging.getLogger(__name__)
 
 
+class Entity(object):
+    """
+    Compact document for query results, values by position with column positions shared by all entities
+    of query. Missing values are NOT_PROVIDED.
+    """
+    __slots__ = ('columns', 'values')
+
+    def __init__(self, columns, values):
+        self.columns = columns
+        self.values = values
+
+    def __repr__(self):
+        return u'<Entity {}>'.format(dict((column, self.values[index]) for column, index in self.columns.iteritems()))
+
+    def get(self, column, default=None):
+        index = self.columns.get(column)
+        if index is None:
+            return default
+        value = self.values[index]
+        return default if value is NOT_PROVIDED else value
+
+    def __getitem__(self, column):
+        value = self.get(column, NOT_PROVIDED)
+        if value is NOT_PROVIDED:
+            raise KeyError(column)
+        return value
+
+    def __contains__(self, column):
+        return self.get(column, NOT_PROVIDED) is not NOT_PROVIDED
+
+
 class DBQuery(NonrelQuery):
 
+    # characters escaped in regexp queries
+    REGEXP_RESERVED = frozenset('.?+*|{}[]()"\\#@&<>~')
+
     def __init__(self, compiler, fields):
         super(DBQuery, self).__init__(compiler, fields)
+        self.db_table = self.query.get_meta().db_table
+        self.pk_column = self.query.get_meta().pk.column
+        self._filters = []
+        self._excludes = []
+        self._ordering = []
+        # primary keys for pk exact / in filter, fetched from identity map and _mget when only filter
+        self._ids = None
+        # iterate over snapshot of index, see QuerySet.iterator(consistent=True)
+        self.consistent = getattr(self.query, 'consistent', False)
+        # hit meta data kept in entities, like _score or _index
+        self.meta_fields = ()
+        # columns read for values() queries, None for whole documents
+        self.source_fields = None
+        # columns of source_fields read from doc values instead of source
+        self.docvalue_fields = ()
+        self.scroll_size = self.ops.SCROLL_SIZE
+        # indices to search, set by compiler, pruned for date chunked model indices
+        self.indices = [self.connection.default_indices[0]]
+        # (date_from, date_to) bounds for fields in filters, dates as YYYY-MM-DD
+        self.date_bounds = {}
+
+    def __repr__(self):
+        return u'<DBQuery: {} {}>'.format(','.join(self.indices), json.dumps(self._build_request()))
 
     def fetch(self, low_mark=0, high_mark=None):
         """
         Returns an iterator over some part of query results.
         """
-        raise NotImplementedError
+        if not self.indices:
+            return
+        self._set_columns()
+        if self._ids is not None and len(self._filters) == 1 and not self._excludes and low_mark == 0 and \
+                high_mark is None:
+            for entity in self._fetch_ids():
+                yield entity
+            return
+        if high_mark is not None and not self.consistent:
+            if high_mark <= low_mark:
+                return
+            if low_mark >= self.ops.SEARCH_AFTER_OFFSET:
+                for entity in self._fetch_search_after(low_mark, high_mark):
+                    yield entity
+                return
+            result = self._search(self.get_page_request(low_mark, high_mark))
+            for entity in self.fetch_response(result, low_mark, high_mark):
+                yield entity
+            return
+        # no limit, iterate all results with scroll, kept alive for consistent iteration
+        body = self._build_request()
+        body['size'] = self.scroll_size
+        skip = low_mark
+        if self.consistent:
+            pages = self.ops.scroll_snapshot(u','.join(self.indices), body, doc_type=self.db_table,
+                                             params=self._get_params())
+        else:
+            pages = self.ops.scroll(u','.join(self.indices), body, doc_type=self.db_table,
+                                    params=self._get_params())
+        # consistent iteration of slices stops at high mark
+        remaining = high_mark - low_mark if high_mark is not None else None
+        try:
+            for hits in pages:
+                if remaining is not None and remaining <= 0:
+                    return
+                if skip >= len(hits):
+                    skip -= len(hits)
+                    continue
+                # page is converted into compact entities, releasing decoded hits before results are used
+                entities = [self._make_entity(hit) for hit in hits[skip:]]
+                del hits[:]
+                skip = 0
+                if remaining is not None:
+                    entities = entities[:remaining]
+                    remaining -= len(entities)
+                for entity in entities:
+                    yield entity
+        finally:
+            # search context is released when results are not fully iterated
+            pages.close()
+
+    def get_page_request(self, low_mark=0, high_mark=None):
+        """
+        Search body for one page of results. Queries without limit get a first page of SCROLL_SIZE
+        documents.
+        """
+        body = self._build_request()
+        body['from'] = low_mark
+        body['size'] = high_mark - low_mark if high_mark is not None else self.scroll_size
+        return body
+
+    def get_multi_search_header(self):
+        """
+        Header line for query in multi search request
+        """
+        header = {
+            'index': u','.join(self.indices),
+            'type': self.db_table,
+        }
+        if len(self.indices) > 1:
+            header['ignore_unavailable'] = True
+        return header
+
+    def fetch_response(self, result, low_mark=0, high_mark=None):
+        """
+        Iterator over entities in search response for page request. For queries without limit having more
+        documents than first page, results are fetched again with scroll.
+        """
+        hits = result['hits']['hits']
+        if high_mark is None and result['hits']['total'] > low_mark + len(hits):
+            for entity in self.fetch(low_mark, high_mark):
+                yield entity
+            return
+        self._set_columns()
+        for hit in hits:
+            yield self._make_entity(hit)
 
     def count(self, limit=None):
         """
         Returns the number of objects that would be returned, if
         this query was executed, up to `limit`.
         """
-        raise NotImplementedError
+        if not self.indices:
+            return 0
+        path = u'/{}/{}/_count'.format(u','.join(self.indices), self.db_table)
+        result = self._send_request(path, {'query': self._build_query()})
+        count = result.get('count', 0)
+        if limit is not None:
+            return min(count, limit)
+        return count
 
     def delete(self):
         """
@@ -92,7 +246,11 @@ class DBQuery(NonrelQuery):
                          boolean -- use natural ordering, if any, when
                          the argument is True and its reverse otherwise
         """
-        raise NotImplementedError
+        if isinstance(ordering, bool):
+            self._ordering = []
+            return
+        self._ordering = [{self._get_column(field, raw=True): 'asc' if ascending else 'desc'}
+                          for field, ascending in ordering]
 
     def add_filter(self, field, lookup_type, negated, value):
         """
@@ -106,7 +264,46 @@ class DBQuery(NonrelQuery):
         :param value: Lookup argument, such as a value to compare with;
                       already prepared for the database
         """
-        raise NotImplementedError
+        column = self._get_column(field)
+        if field.primary_key and lookup_type in ('exact', 'in'):
+            es_filter = {'ids': {'values': value if lookup_type == 'in' else [value]}}
+            if not negated:
+                self._ids = es_filter['ids']['values']
+        elif lookup_type == 'exact':
+            if value is None:
+                es_filter = {'bool': {'must_not': {'exists': {'field': column}}}}
+            else:
+                es_filter = {'term': {self._get_column(field, raw=True): value}}
+        elif lookup_type in ('iexact', 'istartswith', 'icontains', 'iendswith'):
+            es_filter = {'regexp': {self._get_insensitive_column(field, lookup_type): u'{}{}{}'.format(
+                '.*' if lookup_type in ('icontains', 'iendswith') else '',
+                self._get_insensitive_pattern(value),
+                '.*' if lookup_type in ('icontains', 'istartswith') else '')}}
+        elif lookup_type in ('gt', 'gte', 'lt', 'lte'):
+            es_filter = {'range': {column: {lookup_type: value}}}
+        elif lookup_type == 'range':
+            es_filter = {'range': {column: {'gte': value[0], 'lte': value[1]}}}
+        elif lookup_type == 'year':
+            es_filter = {'range': {column: {'gte': value[0], 'lte': value[1]}}}
+        elif lookup_type == 'in':
+            es_filter = {'terms': {self._get_column(field, raw=True): value}}
+        elif lookup_type == 'isnull':
+            es_filter = {'exists': {'field': column}}
+            negated = not negated if value else negated
+        elif lookup_type == 'startswith':
+            es_filter = {'prefix': {self._get_column(field, raw=True): value}}
+        elif lookup_type in ('contains', 'endswith'):
+            es_filter = {'wildcard': {self._get_column(field, raw=True): u'*{}{}'.format(
+                value, '*' if lookup_type == 'contains' else '')}}
+        elif lookup_type in ('regex', 'iregex'):
+            es_filter = {'regexp': {self._get_column(field, raw=True): value}}
+        else:
+            raise DatabaseError("Lookup type %s is not supported." % lookup_type)
+        if negated:
+            self._excludes.append(es_filter)
+        else:
+            self._filters.append(es_filter)
+            self._add_date_bounds(field, lookup_type, value)
 
     def add_filters(self, filters):
         """
@@ -153,6 +350,214 @@ class DBQuery(NonrelQuery):
     # Internal API for reuse by subclasses
     # ----------------------------------------------
 
+    def _get_column(self, field, raw=False):
+        """
+        Document key for field. String fields are mapped as multi fields, terms and sorting use the
+        not analyzed "raw" field.
+        """
+        if raw and field.get_internal_type() in ('CharField', 'SlugField', 'EmailField', 'URLField'):
+            return u'{}.raw'.format(field.column)
+        return field.column
+
+    def _get_insensitive_column(self, field, lookup_type):
+        """
+        Not analyzed column for case insensitive lookups, matched on whole value. Analyzed only fields, like
+        TextField, have no such column.
+
+        :raises DatabaseError when field has no not analyzed column
+        """
+        if field.get_internal_type() == 'TextField':
+            raise DatabaseError("Lookup type %s is not supported for analyzed field %s." % (lookup_type,
+                                                                                          field.name))
+        return self._get_column(field, raw=True)
+
+    def _get_insensitive_pattern(self, value):
+        """
+        Regular expression matching value in any case, like "[bB][oO][bB]" for "bob"
+        """
+        pattern = []
+        for char in unicode(value):
+            if char.lower() != char.upper():
+                pattern.append(u'[{}{}]'.format(char.lower(), char.upper()))
+            elif char in self.REGEXP_RESERVED:
+                pattern.append(u'\\' + char)
+            else:
+                pattern.append(char)
+        return u''.join(pattern)
+
+    def _add_date_bounds(self, field, lookup_type, value):
+        """
+        Narrow date bounds for field with filter. Filters are connected with AND, so bounds only shrink.
+        Datetimes are chunked by date as stored, with their UTC offset, so datetime bounds are widened by
+        a day to cover chunks of values stored with other offsets.
+        """
+        internal_type = field.get_internal_type()
+        if internal_type not in ('DateTimeField', 'DateField'):
+            return
+        if lookup_type in ('gt', 'gte'):
+            bounds = (value, None)
+        elif lookup_type in ('lt', 'lte'):
+            bounds = (None, value)
+        elif lookup_type == 'exact' and value is not None:
+            bounds = (value, value)
+        elif lookup_type in ('range', 'year'):
+            bounds = (value[0], value[1])
+        else:
+            return
+        bounds = tuple(self._get_date_bound(bound, internal_type, shift)
+                       for bound, shift in zip(bounds, (-1, 1)))
+        date_from, date_to = self.date_bounds.get(field.column, (None, None))
+        if bounds[0] is not None and (date_from is None or bounds[0] > date_from):
+            date_from = bounds[0]
+        if bounds[1] is not None and (date_to is None or bounds[1] < date_to):
+            date_to = bounds[1]
+        self.date_bounds[field.column] = (date_from, date_to)
+
+    def _get_date_bound(self, value, internal_type, shift):
+        """
+        Date of stored value, YYYY-MM-DD, shifted shift days for datetimes
+        """
+        if value is None:
+            return None
+        if internal_type == 'DateField':
+            return value[:10]
+        bound = datetime.date(int(value[0:4]), int(value[5:7]), int(value[8:10])) + datetime.timedelta(days=shift)
+        return bound.strftime('%Y-%m-%d')
+
+    def _build_query(self):
+        """
+        Query for filters
+        """
+        if not self._filters and not self._excludes:
+            return {'match_all': {}}
+        query = {}
+        if self._filters:
+            query['filter'] = self._filters
+        if self._excludes:
+            query['must_not'] = self._excludes
+        return {'bool': query}
+
+    def _build_request(self):
+        """
+        Search request body, without pagination
+        """
+        body = {
+            'query': self._build_query(),
+        }
+        if self._ordering:
+            body['sort'] = self._ordering
+        if self.source_fields is not None:
+            # primary key comes from _id, not from source
+            columns = [column for column in self.source_fields
+                       if column != self.pk_column and column not in self.docvalue_fields]
+            if columns:
+                body['_source'] = columns
+            else:
+                body['stored_fields'] = []
+            if self.docvalue_fields:
+                body['docvalue_fields'] = list(self.docvalue_fields)
+        return body
+
+    def _get_params(self):
+        """
+        Search parameters, pruned date chunk indices can be purged at any time
+        """
+        if len(self.indices) > 1:
+            return {'ignore_unavailable': 'true'}
+        return {}
+
+    def _search(self, body):
+        """
+        Search request
+        """
+        path = u'/{}/{}/_search'.format(u','.join(self.indices), self.db_table)
+        return self._send_request(path, body)
+
+    def _send_request(self, path, body):
+        """
+        Send query request. With COALESCE_QUERIES option, identical requests in flight from other threads,
+        or sent in last COALESCE_WINDOW seconds, share one response.
+        """
+        es_connection = self.connection.connection
+        params = self._get_params()
+        options = self.connection.settings_dict.get('OPTIONS', {})
+        if not options.get('COALESCE_QUERIES', False):
+            return es_connection._send_request('POST', path, body, params=params)
+        single_flight = get_single_flight(self.connection.alias, options.get('COALESCE_WINDOW', 0.0))
+        key = (path, json.dumps(body, sort_keys=True), tuple(sorted(params.items())))
+        return single_flight.do(key, es_connection._send_request, 'POST', path, body, params=params)
+
+    def _fetch_search_after(self, low_mark, high_mark):
+        """
+        Page for deep offsets with search_after, sorted with _uid as tie-breaker. Query walks from nearest
+        cached cursor to low_mark reading only sort values, and cursor at end of page is cached, so next
+        page starts right away.
+        """
+        body = self._build_request()
+        body['sort'] = list(body.get('sort') or []) + [{'_uid': 'asc'}]
+        key = (u','.join(self.indices), self.db_table, json.dumps(body, sort_keys=True))
+        cursors = get_cursor_cache()
+        position, sort_values = cursors.get_nearest(key, low_mark)
+        while position < low_mark:
+            size = min(self.ops.SCROLL_SIZE, low_mark - position)
+            page_body = dict(body, size=size, _source=False)
+            if sort_values is not None:
+                page_body['search_after'] = sort_values
+            hits = self._search(page_body)['hits']['hits']
+            if not hits:
+                return []
+            position += len(hits)
+            sort_values = hits[-1]['sort']
+            cursors.set(key, position, sort_values)
+            if len(hits) < size:
+                return []
+        body['size'] = high_mark - low_mark
+        if sort_values is not None:
+            body['search_after'] = sort_values
+        hits = self._search(body)['hits']['hits']
+        if hits:
+            cursors.set(key, low_mark + len(hits), hits[-1]['sort'])
+        return [self._make_entity(hit) for hit in hits]
+
+    def _fetch_ids(self):
+        """
+        Entities for primary keys, like prefetch_related queries, from identity map and one _mget request
+        """
+        entities = self.ops.get_documents(self.query.model, self._ids)
+        results = []
+        for pk in self._ids:
+            entity = entities.pop(unicode(pk), None)
+            if entity is not None:
+                results.append(entity)
+        if self._ordering:
+            results.sort(self._order_in_memory)
+        return results
+
+    def _set_columns(self):
+        """
+        Column positions for entities: source columns for query fields, primary key and meta fields
+        """
+        self._source_columns = [field.column for field in self.fields if field.column != self.pk_column]
+        columns = self._source_columns + [self.pk_column] + list(self.meta_fields)
+        self._columns = dict((column, index) for index, column in enumerate(columns))
+
+    def _make_entity(self, hit):
+        """
+        Entity for hit, query fields from source with primary key from _id. Other source keys and hit meta
+        data not in meta_fields are dropped.
+        """
+        source = hit.get('_source') or {}
+        values = [source.get(column, NOT_PROVIDED) for column in self._source_columns]
+        if self.docvalue_fields:
+            docvalues = hit.get('fields') or {}
+            for index, column in enumerate(self._source_columns):
+                if column in self.docvalue_fields:
+                    values[index] = docvalues[column][0] if docvalues.get(column) else NOT_PROVIDED
+        values.append(hit['_id'])
+        for name in self.meta_fields:
+            values.append(hit.get(name, NOT_PROVIDED))
+        return Entity(self._columns, tuple(values))
+
     def _decode_child(self, child):
         """
         Produces arguments suitable for add_filter from a WHERE tree
@@ -168,8 +573,16 @@ class DBQuery(NonrelQuery):
 
         opts = self.query.model._meta
         if alias and alias != opts.db_table:
-            raise DatabaseError("This database doesn't support JOINs "
-                                "and multi-table inheritance.")
+            # filters on fields of related objects embedded with denormalize option, like customer__country
+            join_field = self.compiler.get_denormalized_join(alias)
+            if join_field is None or field.name not in opts.denormalize[join_field.name]:
+                raise DatabaseError("This database doesn't support JOINs "
+                                    "and multi-table inheritance.")
+            field = copy.copy(field)
+            field.column = u'{}.{}'.format(join_field.name, column)
+            value = self._normalize_lookup_value(
+                lookup_type, value, field, annotation)
+            return field, lookup_type, value
 
         # For parent.child_set queries the field held by the constraint
         # is the parent's primary key, while the field the filter
@@ -319,6 +732,10 @@ class SQLCompiler(NonrelCompiler):
     A simple query: no joins, no distinct, etc.
     """
     query_class = DBQuery
+    # fields read from doc values by values() queries: integers and related primary keys, not analyzed,
+    # come back from doc values as stored
+    DOCVALUE_TYPES = frozenset(['IntegerField', 'SmallIntegerField', 'PositiveIntegerField',
+                                'PositiveSmallIntegerField', 'BigIntegerField', 'ForeignKey', 'OneToOneField'])
 
     def results_iter(self):
         """
@@ -326,14 +743,34 @@ class SQLCompiler(NonrelCompiler):
         to this compiler. Called by QuerySet methods.
         """
         fields = self.get_fields()
-        try:
-            results = self.build_query(fields).fetch(
-                self.query.low_mark, self.query.high_mark)
-        except EmptyResultSet:
-            results = []
-
-        for entity in results:
-            yield self._make_result(entity, fields)
+        search_batch = getattr(self.query, 'search_batch', None)
+        if search_batch is not None and search_batch.has(self.query):
+            results = search_batch.fetch(self.query)
+        else:
+            try:
+                results = self.build_query(fields).fetch(
+                    self.query.low_mark, self.query.high_mark)
+            except EmptyResultSet:
+                results = []
+
+        converters = self._get_converters(fields)
+        klass_info = self._get_klass_info()
+        if klass_info is None:
+            for entity in results:
+                yield self._make_row(entity, converters)
+            return
+        # select_related: related entities loaded for each page of results, with rows having related
+        # fields after model fields in the layout expected by get_cached_row
+        results = iter(results)
+        related_fields = klass_info[3]
+        while True:
+            entities = list(islice(results, self.ops.SCROLL_SIZE))
+            if not entities:
+                break
+            loaded = self._load_related(entities, related_fields)
+            for entity in entities:
+                yield self._make_row(entity, converters) + self._make_related_result(entity, related_fields,
+                                                                                     loaded)
 
     def has_results(self):
         return self.get_count(check_exists=True)
@@ -392,6 +829,105 @@ class SQLCompiler(NonrelCompiler):
             result.append(value)
         return result
 
+    def _get_converters(self, fields):
+        """
+        Field conversion data computed once for query, instead of for each value
+
+        :return: list of (column, field, db field, field kind, db type)
+        """
+        converters = []
+        for field in fields:
+            db_field, field_kind, db_type = self.ops.convert_as(field)
+            converters.append((field.column, field, db_field, field_kind, db_type))
+        return converters
+
+    def _make_row(self, entity, converters):
+        """
+        Same as _make_result with conversion data from _get_converters
+        """
+        value_from_db = self.ops._value_from_db
+        convert_values = self.ops.convert_values
+        result = []
+        for column, field, db_field, field_kind, db_type in converters:
+            value = entity.get(column, NOT_PROVIDED)
+            if value is NOT_PROVIDED:
+                value = field.get_default()
+            else:
+                value = convert_values(value_from_db(value, db_field, field_kind, db_type), field)
+            if value is None and not field.null:
+                raise IntegrityError("Non-nullable field %s can't be None!" %
+                                     field.name)
+            result.append(value)
+        return result
+
+    def _get_klass_info(self):
+        """
+        Django klass info for select_related, None when query has no select_related
+        """
+        if not self.query.select_related:
+            return None
+        requested = self.query.select_related if isinstance(self.query.select_related, dict) else None
+        klass_info = get_klass_info(self.query.model, max_depth=self.query.max_depth, requested=requested,
+                                    only_load=self.query.get_loaded_field_names())
+        pending = [klass_info]
+        while pending:
+            klass_info = pending.pop()
+            if klass_info[4]:
+                raise DatabaseError("select_related() on reverse one to one relations is not supported "
+                                    "by the backend.")
+            pending.extend(item for field, item in klass_info[3])
+        return klass_info
+
+    def _load_related(self, entities, related_fields, loaded=None):
+        """
+        Load related entities, one request for each related model and depth
+
+        :param entities: entities of page
+        :param related_fields: (field, klass_info) for select_related
+        :param loaded: dictionary model -> {pk: entity} of related entities loaded for page, filled
+        :return: loaded
+        """
+        if loaded is None:
+            loaded = {}
+        ids = {}
+        for field, klass_info in related_fields:
+            model_ids = ids.setdefault(field.rel.to, set())
+            for entity in entities:
+                pk = entity.get(field.column)
+                if pk is not None and unicode(pk) not in loaded.get(field.rel.to, {}):
+                    model_ids.add(pk)
+        for model, model_ids in ids.items():
+            if model_ids:
+                loaded.setdefault(model, {}).update(self.ops.get_documents(model, model_ids))
+        for field, klass_info in related_fields:
+            if not klass_info[3]:
+                continue
+            related_entities = [loaded.get(field.rel.to, {}).get(unicode(entity.get(field.column)))
+                                for entity in entities]
+            self._load_related([entity for entity in related_entities if entity is not None], klass_info[3],
+                               loaded)
+        return loaded
+
+    def _make_related_result(self, entity, related_fields, loaded):
+        """
+        Values for related fields of entity, from related entities loaded for page. Missing related objects
+        have all values None, including objects related to them.
+        """
+        result = []
+        for field, klass_info in related_fields:
+            model, field_names, field_count = field.rel.to, klass_info[1], klass_info[2]
+            related = None
+            if entity is not None and entity.get(field.column) is not None:
+                related = loaded.get(model, {}).get(unicode(entity[field.column]))
+            if related is None:
+                result.extend([None] * field_count)
+            else:
+                related_fields_load = [item for item in model._meta.concrete_fields
+                                       if not field_names or item.attname in field_names]
+                result.extend(self._make_result(related, related_fields_load))
+            result.extend(self._make_related_result(related, klass_info[3], loaded))
+        return result
+
     def check_query(self):
         """
         Checks if the current query is supported by the database.
@@ -405,10 +941,25 @@ class SQLCompiler(NonrelCompiler):
         if hasattr(self.query, 'is_empty') and self.query.is_empty():
             raise EmptyResultSet()
         if (len([a for a in self.query.alias_map if
-                 self.query.alias_refcount[a]]) > 1 or
+                 self.query.alias_refcount[a] and self.get_denormalized_join(a) is None]) > 1 or
             self.query.distinct or self.query.extra or self.query.having):
             raise DatabaseError("This query is not supported by the database.")
 
+    def get_denormalized_join(self, alias):
+        """
+        Related field for join from model to related object embedded with denormalize option
+
+        :param alias: join alias
+        :return: related field, None when join is not to embedded object
+        """
+        opts = self.query.get_meta()
+        join = self.query.alias_map.get(alias)
+        if join is None or join.lhs_alias != opts.db_table or join.join_field is None:
+            return None
+        if join.join_field.name not in (getattr(opts, 'denormalize', None) or {}):
+            return None
+        return join.join_field
+
     def get_count(self, check_exists=False):
         """
         Counts objects matching the current filters / constraints.
@@ -435,6 +986,13 @@ class SQLCompiler(NonrelCompiler):
         query = self.query_class(self, fields)
         query.add_filters(self.query.where)
         query.order_by(self._get_ordering())
+        query.indices = self._get_search_indices(query)
+        if self.query.select:
+            # values() and values_list() only read selected fields, exact ones from doc values
+            query.source_fields = [field.column for field in fields]
+            query.docvalue_fields = frozenset(field.column for field in fields
+                                              if field.get_internal_type() in self.DOCVALUE_TYPES)
+            query.scroll_size = self.ops.VALUES_SCROLL_SIZE
 
         # This at least satisfies the most basic unit tests.
         if connections[self.using].use_debug_cursor or (connections[self.using].use_debug_cursor is None and
@@ -442,6 +1000,21 @@ class SQLCompiler(NonrelCompiler):
             self.connection.queries.append({'sql': repr(query)})
         return query
 
+    def _get_search_indices(self, query):
+        """
+        Indices to search: global index, or first model index when model disables default index.
+        Date chunked model indices are pruned to chunks overlapping filters on chunk date field.
+        """
+        opts = self.query.get_meta()
+        alias, index_data = self.ops.get_model_read_index(self.query.model)
+        if not index_data or not index_data.get('date_chunks'):
+            return [alias]
+        date_field = opts.get_field(index_data.get('date_field', 'created_on'))
+        date_from, date_to = query.date_bounds.get(date_field.column, (None, None))
+        if date_from is None and date_to is None:
+            return [alias]
+        return self.ops.prune_date_chunks(alias, date_from, date_to)
+
     def get_fields(self):
         """
         Returns fields which should get loaded from the back-end by the
@@ -518,6 +1091,7 @@ class SQLInsertCompiler(SQLCompiler):
     def __init__(self, *args, **kwargs):
         super(SQLInsertCompiler, self).__init__(*args, **kwargs)
         self.opts = self.query.get_meta()
+        self._queue_writes = {}
 
     def _get_pk(self, data):
         """
@@ -536,40 +1110,51 @@ class SQLInsertCompiler(SQLCompiler):
 
     def _get_internal_data(self):
         """
-        Get internal data for insert operation
+        Get internal data for insert operation: indices model is written to, with their rebuild status
 
         :return:
         """
-        # TODO: make one query to ES for internal data for model and default indices
         from mapping import model_to_mapping
+        default_indices = []
+        if not getattr(self.opts, 'disable_default_index', False):
+            default_indices.append({
+                'index': self.connection.default_indices[0],
+                'has_mapping': True,
+            })
+        model_indices = []
+        for model_index in getattr(self.opts, 'indices', None) or []:
+            model_index_name = model_index.keys()[0]
+            index_data = dict(model_index[model_index_name])
+            index_data.update({
+                'name': model_index_name,
+                'index': u'{}__{}'.format(self.opts.db_table, model_index_name),
+                'has_mapping': True,
+            })
+            model_indices.append(index_data)
         data = {
             'indices': {
-                'default': [
-                    {}
-                ],
+                'default': default_indices,
                 'model': {
-                    'main': [
-                        {}
-                    ],
-                    'index': [
-                        {}
-                    ]
+                    'main': [],
+                    'index': model_indices,
                 },
             },
             'is_blocked': False,
         }
-        # model = self.opts.db_table
-        # default_indices = self.connection.default_indices
-        # index_data = self.opts.indices[0]
-        # indices = ["{}__{}".format(self.opts.db_table, index_data.keys()[0])]
-        # also save mapping in case needs to
         indices = data['indices']['default'] + \
             data['indices']['model']['main'] + \
             data['indices']['model']['index']
+        # one query to internal index for rebuild status of all indices
+        status = self.connection.ops.get_rebuild_status([item['index'] for item in indices])
+        for index_data in indices:
+            index_data['rebuild_mode'] = status[index_data['index']]['rebuild_mode']
+            if status[index_data['index']]['is_blocked']:
+                data['is_blocked'] = True
+        # also save mapping in case needs to
         for index_data in indices:
             if index_data['has_mapping'] is False:
                 try:
-                    mapping = model_to_mapping(self.opts.db_table,
+                    mapping = model_to_mapping(self.query.model,
                                                self.connection.connection,
                                                index_data['index'])
                     mapping.save()
@@ -577,22 +1162,86 @@ class SQLInsertCompiler(SQLCompiler):
                     pass
         return data
 
-    def _send_queue(self, bulk_data):
+    def _queue_write(self, action, meta, source_json, alias):
         """
-        Send data to queue, adding to bulk
+        Add write to queue buffer for its alias. Source is kept already encoded, so queue documents are
+        built without encoding document again.
+
+        :param action: bulk action
+        :param meta: bulk action meta data
+        :param source_json: encoded document
+        :param alias: index alias being rebuilt
+        :return:
+        """
+        write = u'{{"action": {}, "meta": {}, "source": {}}}'.format(
+            json.dumps(action),
+            json.dumps(meta),
+            source_json,
+        )
+        self._queue_writes.setdefault(alias, []).append(write)
+
+    def _send_queue(self):
+        """
+        Send queued writes to write queue, adding to bulk. All writes for an alias go into one queue
+        document as structured writes, or compressed binary payload when WRITE_QUEUE_COMPRESSION option
+        is enabled. Queue is replayed for alias into rebuilt index in sequence order.
 
-        :param bulk_data: bulk data to write to queue
         :return:
         """
         import base64
-        bulk_data_encoded = base64.encodestring(bulk_data)
-        queue_bulk_data = json.dumps({
-            u'create': {
-                u'_index': self.connection.default_indices[0],
-                u'_type': WRITE_QUEUE,
-            }
-        }) + '\n' + json.dumps({'data': bulk_data_encoded}) + '\n'
-        self.connection.connection.bulker.add(queue_bulk_data)
+        import time
+        import zlib
+        options = self.connection.settings_dict.get('OPTIONS', {})
+        for alias, writes in self._queue_writes.iteritems():
+            writes_json = u'[' + u', '.join(writes) + u']'
+            if options.get('WRITE_QUEUE_COMPRESSION', False):
+                payload = u'"payload": {}'.format(json.dumps(
+                    base64.b64encode(zlib.compress(writes_json.encode('utf-8'),
+                                                   options.get('WRITE_QUEUE_COMPRESSION_LEVEL', 6)))))
+            else:
+                payload = u'"writes": {}'.format(writes_json)
+            queue_bulk_data = json.dumps({
+                u'create': {
+                    u'_index': self.connection.default_indices[0],
+                    u'_type': WRITE_QUEUE,
+                }
+            }) + '\n' + u'{{"alias": {}, "sequence": {}, "count": {}, "created_on": {}, {}}}'.format(
+                json.dumps(alias),
+                int(time.time() * 1000000),
+                len(writes),
+                json.dumps(datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")),
+                payload,
+            ) + '\n'
+            self.connection.bulker.add(queue_bulk_data)
+        self._queue_writes = {}
+
+    def _add_write(self, action, index_data, field_values):
+        """
+        Add write for index to bulk. While index is rebuilt, write is also buffered for write queue.
+        Model indices with date_chunks option get write into date chunk index for document.
+
+        :param action: bulk action, create or index
+        :param index_data: index data from internal data
+        :param field_values: document
+        :return:
+        """
+        index_name = index_data['index']
+        if index_data.get('date_chunks'):
+            index_name = self.ops.get_date_chunk_index(index_data['index'], index_data, field_values)
+        meta = {
+            u'_index': index_name,
+            u'_type': self.opts.db_table,
+            u'_id': self._get_pk(field_values),
+        }
+        routing = self.ops.get_routing(index_data, field_values)
+        if routing is not None:
+            meta[u'_routing'] = routing
+        source_json = json.dumps(field_values)
+        bulk_data = json.dumps({action: meta}) + '\n' + source_json + '\n'
+        logger.debug(u'SQLInsertCompiler.execute_sql :: bulk obj: {}'.format(bulk_data))
+        self.connection.bulker.add(bulk_data)
+        if index_data['rebuild_mode'] in (REBUILD_MODE_BUILDING, REBUILD_MODE_SYNCING):
+            self._queue_write(action, meta, source_json, index_data['index'])
 
     def execute_sql(self, return_id=False):
         """
@@ -612,101 +1261,41 @@ class SQLInsertCompiler(SQLCompiler):
             time.sleep(0.2)
             internal_data = self._get_internal_data()
         pk_field = self.opts.pk
+        # converters resolved once for insert, not for each value
+        converters = [(field, self.ops.get_converter(field)) for field in self.query.fields]
         for obj in self.query.objs:
             field_values = {}
-            for field in self.query.fields:
-                field, field_kind, db_type = self.ops.convert_as(field)
-                # check field_kind if is related field or many to many
-                if field_kind in ['ForeignKey', 'GenericRelation', 'GenericForeignKey']:
-                    # we need the model associated with field
-                    logger.debug(u'SQLInsertCompiler.execute_sql :: field_kind: {} field: {} rel: {}'.format(
-                        field_kind,
-                        field.name,
-                        field.rel.to
-                    ))
-                    value = self.ops.to_dict(field.rel.to)
-                    logger.debug(u'SQLInsertCompiler.execute_sql :: object :: value: {}'.format(value))
-                else:
-                    value = field.get_db_prep_save(
-                        getattr(obj, field.attname) if self.query.raw else field.pre_save(obj, obj._state.adding),
-                        connection=self.connection
-                    )
-                    if value is None and not field.null and not field.primary_key:
-                        raise IntegrityError(u"You can't set {} (a non-nullable field) to None!".format(field.name))
-
-                logger.debug(u'SQLInsertCompiler.execute_sql :: before value_for_db :: field: {} '
-                             u'value: {}'.format(field, value))
-                value = self.ops.value_for_db(value, field)
-                logger.debug(u'SQLInsertCompiler.execute_sql :: after value_for_db :: value: {}'.format(value))
-                field_values[field.column] = value
-            if not hasattr(self.opts, 'disable_default_index') or \
-                    (hasattr(self.opts, 'disable_default_index') and self.opts.disable_default_index is False):
-                # default index
-                logger.debug(u'SQLInsertCompiler.execute_sql :: default index')
-                for index_data in internal_data['indices']['default']:
-                    bulk_data = json.dumps({
-                        u'create': {
-                            u'_index': index,
-                            u'_type': self.opts.db_table,
-                            u'_id': self._get_pk(field_values),
-                        }
-                    }) + '\n' + json.dumps(field_values) + '\n'
-                    logger.debug(u'SQLInsertCompiler.execute_sql :: default index index: {}'.format(
-                        index
-                    ))
-                    logger.debug(u'SQLInsertCompiler.execute_sql :: bulk obj: {}'.format(bulk_data))
-                    if index_data['rebuild_mode'] == 'building':
-                        self._send_queue(bulk_data)
-                    else:
-                        self.connection.connection.bulker.add(bulk_data)
-            if hasattr(self.opts, 'indices') and self.opts.indices:
-                # custom general index
-                logger.debug(u'SQLInsertCompiler.execute_sql :: disable default index')
-                index_data = self.opts.indices[0]
-                for index in internal_data['indices']['model']['main']:
-                    index_conf = {
-                        u'create': {
-                            u'_index': index,
-                            u'_type': self.opts.db_table,
-                            u'_id': self._get_pk(field_values),
-                        }
-                    }
-                    if 'routing' in index_data:
-                        index_conf.update({
-                            u'_routing': index_data['routing']
-                        })
-                    bulk_data = json.dumps(index_conf) + '\n' + \
-                        json.dumps(field_values) + '\n'
-                    logger.debug(u'SQLInsertCompiler.execute_sql :: bulk obj: {}'.format(bulk_data))
-                    if index_data['rebuild_mode'] == 'building':
-                        self._send_queue(bulk_data)
-                    else:
-                        self.connection.connection.bulker.add(bulk_data)
+            for field, convert in converters:
+                # related fields keep primary key of related object at field column, related objects are
+                # loaded with _mget by select_related and prefetch_related
+                value = field.get_db_prep_save(
+                    getattr(obj, field.attname) if self.query.raw else field.pre_save(obj, obj._state.adding),
+                    connection=self.connection
+                )
+                if value is None and not field.null and not field.primary_key:
+                    raise IntegrityError(u"You can't set {} (a non-nullable field) to None!".format(field.name))
+
+                field_values[field.column] = convert(value)
+            # related objects embedded with denormalize option
+            for field_name, field_names in (getattr(self.opts, 'denormalize', None) or {}).iteritems():
+                field = self.opts.get_field(field_name)
+                related = getattr(obj, field.name)
+                field_values[field.name] = self.ops.get_denormalized_snapshot(related, field_names) \
+                    if related is not None else None
+            pk = self._get_pk(field_values)
+            if pk is not None:
+                get_identity_map().discard(self.query.model, pk)
+            # default index
+            logger.debug(u'SQLInsertCompiler.execute_sql :: default index')
+            for index_data in internal_data['indices']['default']:
+                self._add_write(u'create', index_data, field_values)
             # model indices
-            if hasattr(self.opts, 'indices') and len(self.opts.indices) > 1:
-                for index_data in internal_data['indices']['model']['index']:
-                    logger.debug(u'SQLInsertCompiler.execute_sql :: index: {}'.format(index_data.keys()[0]))
-                    index = "{}__{}".format(self.opts.db_table, index_data.keys()[0])
-                    index_conf = {
-                        u'index': {
-                            u'_index': index,
-                            u'_type': self.opts.db_table,
-                            u'_id': self._get_pk(field_values),
-                        }
-                    }
-                    if 'routing' in index_data:
-                        index_conf.update({
-                            u'_routing': index_data['routing']
-                        })
-                    bulk_data = json.dumps(index_conf) + '\n' + \
-                        json.dumps(field_values) + '\n'
-                    logger.debug(u'SQLInsertCompiler.execute_sql :: bulk obj: {}'.format(bulk_data))
-                    if index_data['rebuild_mode'] == 'building':
-                        self._send_queue(bulk_data)
-                    else:
-                        self.connection.connection.bulker.add(bulk_data)
+            for index_data in internal_data['indices']['model']['index']:
+                logger.debug(u'SQLInsertCompiler.execute_sql :: index: {}'.format(index_data['name']))
+                self._add_write(u'index', index_data, field_values)
+        self._send_queue()
         # Writes real inserts into indices as well as dumps into queue (write_queue)
-        res = self.connection.connection.bulker.flush_bulk(forced=True)
+        res = self.connection.bulker.flush_bulk(forced=True)
         # Pass the key value through normal database de-conversion.
         logger.debug(u'SQLInsertCompiler.execute_sql :: response: {} type: {}'.format(res, type(res)))
         if return_id is False:
@@ -0,0 +1,214 @@
+# python
+import logging
+import threading
+import time
+import re
+from urllib import urlencode
+import json
+
+# pyes
+import urllib3
+from pyes.exceptions import NoServerAvailable
+from pyes.fakettypes import Method, RestResponse
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+SELECTOR_ROUND_ROBIN = 'round_robin'
+SELECTOR_LEAST_LOADED = 'least_loaded'
+
+# node pools shared by connections in all threads, by urls and options
+_NODE_POOLS = {}
+_NODE_POOLS_LOCK = threading.Lock()
+
+
+class Node(object):
+    """
+    Cluster node with keep-alive HTTP connection pool. Node is dead after a failed request until
+    dead_until, with timeout doubling for consecutive failures.
+    """
+
+    def __init__(self, url, timeout=None, maxsize=10, headers=None):
+        self.url = url.rstrip('/')
+        self.pool = urllib3.connection_from_url(self.url, maxsize=maxsize, block=False, timeout=timeout,
+                                                headers=headers)
+        self.in_flight = 0
+        self.failures = 0
+        self.dead_until = None
+
+    def __repr__(self):
+        return u'<Node {} in_flight:{} failures:{}>'.format(self.url, self.in_flight, self.failures)
+
+    @property
+    def is_dead(self):
+        return self.dead_until is not None
+
+
+class NodePool(object):
+    """
+    Connection to a list of nodes, compatible with pyes connection interface execute(request).
+
+    Nodes are selected round robin or by least requests in flight. Nodes failing requests are marked
+    dead and requests are retried on other nodes, dead nodes are tried again after dead_timeout.
+    Nodes can be discovered from cluster with sniff.
+    """
+
+    # seconds dead nodes wait before a new try, doubled for consecutive failures up to MAX_DEAD_TIMEOUT
+    DEAD_TIMEOUT = 60
+    MAX_DEAD_TIMEOUT = 1800
+
+    def __init__(self, urls, selector=SELECTOR_ROUND_ROBIN, timeout=30.0, max_retries=3, maxsize=10,
+                 dead_timeout=None, sniff_on_start=False, sniff_interval=None, headers=None):
+        """
+        Connection to nodes
+
+        :param urls: list of node urls, like http://localhost:9200
+        :param selector: round_robin or least_loaded
+        :param timeout: request timeout in seconds
+        :param max_retries: Retries on other nodes for failed requests
+        :param maxsize: Keep-alive connections per node
+        :param dead_timeout: Seconds before dead node is tried again
+        :param sniff_on_start: Discover cluster nodes when connection is created
+        :param sniff_interval: Seconds between node discovery, None to disable
+        :param headers: HTTP headers for all requests, like authorization
+        :return:
+        """
+        if selector not in (SELECTOR_ROUND_ROBIN, SELECTOR_LEAST_LOADED):
+            raise ValueError(u'Invalid node selector "{}"'.format(selector))
+        self.selector = selector
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.maxsize = maxsize
+        self.dead_timeout = dead_timeout or self.DEAD_TIMEOUT
+        self.sniff_interval = sniff_interval
+        self.headers = headers or {}
+        self._lock = threading.Lock()
+        self._index = 0
+        self._sniffed = time.time()
+        self.nodes = [self._create_node(url) for url in urls]
+        if sniff_on_start:
+            self.sniff()
+
+    def _create_node(self, url):
+        return Node(url, timeout=self.timeout, maxsize=self.maxsize, headers=self.headers)
+
+    def get_node(self):
+        """
+        Select node for request, resurrecting dead nodes with dead timeout expired. When all nodes are
+        dead, node to be resurrected first is tried.
+
+        :return: Node
+        """
+        with self._lock:
+            now = time.time()
+            for node in self.nodes:
+                if node.is_dead and node.dead_until <= now:
+                    logger.info(u'NodePool :: resurrect node {}'.format(node.url))
+                    node.dead_until = None
+            nodes = [node for node in self.nodes if not node.is_dead]
+            if not nodes:
+                return min(self.nodes, key=lambda item: item.dead_until)
+            if self.selector == SELECTOR_LEAST_LOADED:
+                node = min(nodes, key=lambda item: item.in_flight)
+            else:
+                self._index = (self._index + 1) % len(nodes)
+                node = nodes[self._index]
+            node.in_flight += 1
+            return node
+
+    def mark_dead(self, node):
+        with self._lock:
+            node.in_flight = max(node.in_flight - 1, 0)
+            node.failures += 1
+            timeout = min(self.dead_timeout * 2 ** (node.failures - 1), self.MAX_DEAD_TIMEOUT)
+            node.dead_until = time.time() + timeout
+        logger.warning(u'NodePool :: node {} dead for {} seconds'.format(node.url, timeout))
+
+    def mark_live(self, node):
+        with self._lock:
+            node.in_flight = max(node.in_flight - 1, 0)
+            node.failures = 0
+            node.dead_until = None
+
+    def sniff(self):
+        """
+        Replace nodes with http nodes in cluster, keeping connection pools of known nodes
+
+        :return: list of node urls
+        """
+        response = self._urlopen('GET', '/_nodes/http', None, {})
+        urls = []
+        for node_data in json.loads(response.data).get('nodes', {}).itervalues():
+            http_data = node_data.get('http', {})
+            address = http_data.get('publish_address') or node_data.get('http_address')
+            if not address:
+                continue
+            # ES 1.x addresses are like inet[/10.0.0.1:9200] or inet[host/10.0.0.1:9200]
+            match = re.search(r'([^/\[\]]+:\d+)\]?$', address)
+            if match:
+                urls.append(u'http://{}'.format(match.group(1)))
+        if urls:
+            with self._lock:
+                nodes = dict((node.url, node) for node in self.nodes)
+                self.nodes = [nodes.get(url) or self._create_node(url) for url in urls]
+                self._sniffed = time.time()
+            logger.debug(u'NodePool :: sniffed nodes: {}'.format(urls))
+        return urls
+
+    def _urlopen(self, method, url, body, headers):
+        """
+        Send request to a node, retrying in other nodes
+
+        :return: urllib3 response
+        """
+        retry = 0
+        while True:
+            node = self.get_node()
+            try:
+                response = node.pool.urlopen(method, url, body=body, headers=headers, timeout=self.timeout,
+                                             retries=False)
+            except (IOError, urllib3.exceptions.HTTPError) as e:
+                self.mark_dead(node)
+                if retry >= self.max_retries:
+                    logger.error(u'NodePool :: bailing out after {} failed retries'.format(self.max_retries))
+                    raise NoServerAvailable(e)
+                retry += 1
+                continue
+            self.mark_live(node)
+            return response
+
+    def execute(self, request):
+        """
+        Execute pyes request and return response
+
+        :param request: pyes RestRequest
+        :return: pyes RestResponse
+        """
+        if self.sniff_interval and time.time() - self._sniffed > self.sniff_interval:
+            try:
+                self.sniff()
+            except NoServerAvailable:
+                self._sniffed = time.time()
+        url = request.uri
+        if request.parameters:
+            url += '?' + urlencode(request.parameters)
+        headers = dict(self.headers, **(request.headers or {}))
+        response = self._urlopen(Method._VALUES_TO_NAMES[request.method], url, request.body, headers)
+        return RestResponse(status=response.status, body=response.data, headers=response.headers)
+
+
+def get_node_pool(urls, **kwargs):
+    """
+    Node pool for urls and options, shared between threads. Django creates a database connection per
+    thread, all of them use same keep-alive connections and node state.
+
+    :param urls: list of node urls
+    :param kwargs: NodePool options
+    :return: NodePool
+    """
+    key = (tuple(urls), tuple(sorted(kwargs.items())))
+    with _NODE_POOLS_LOCK:
+        if key not in _NODE_POOLS:
+            _NODE_POOLS[key] = NodePool(urls, **kwargs)
+        return _NODE_POOLS[key]
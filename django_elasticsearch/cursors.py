@@ -0,0 +1,91 @@
+# python
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class CursorCache(object):
+    """
+    search_after cursors by query: sort values of last document seen at a position of query results.
+    Queries are kept in LRU order, cursors expire after ttl seconds since positions move as index changes.
+    """
+
+    def __init__(self, max_queries=1000, ttl=300.0):
+        self.max_queries = max_queries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # query key -> {position: (sort values, time)}
+        self._queries = OrderedDict()
+
+    def get_nearest(self, key, position):
+        """
+        Cursor nearest before or at position
+
+        :param key: query key, like indices, doc type and request body with sort
+        :param position: position in query results
+        :return: (position, sort values), (0, None) when no cursor is cached
+        """
+        now = time.time()
+        with self._lock:
+            cursors = self._queries.pop(key, None)
+            if cursors is None:
+                return 0, None
+            self._queries[key] = cursors
+            best = 0, None
+            for cursor_position, (sort_values, created) in cursors.items():
+                if now - created > self.ttl:
+                    del cursors[cursor_position]
+                elif best[0] < cursor_position <= position:
+                    best = cursor_position, sort_values
+            return best
+
+    def set(self, key, position, sort_values):
+        """
+        Cache sort values of document before position
+        """
+        with self._lock:
+            cursors = self._queries.pop(key, None) or {}
+            cursors[position] = (sort_values, time.time())
+            self._queries[key] = cursors
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+
+
+class KeepAlive(threading.Thread):
+    """
+    Calls func every interval seconds until stopped, keeping search contexts alive while consumers are
+    slow to ask for next page
+    """
+
+    def __init__(self, interval, func, *args):
+        super(KeepAlive, self).__init__(name='django_elasticsearch.KeepAlive')
+        self.daemon = True
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.func(*self.args)
+            except Exception:
+                logger.exception(u'KeepAlive :: could not keep context alive')
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_CURSOR_CACHE = CursorCache()
+
+
+def get_cursor_cache():
+    """
+    Cursor cache shared by all threads, paginators walk pages in different requests
+    """
+    return _CURSOR_CACHE
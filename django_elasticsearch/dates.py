@@ -0,0 +1,148 @@
+# python
+import re
+from datetime import datetime, date, time
+
+# django
+from django.utils import timezone
+try:
+    from django.utils.timezone import get_fixed_timezone
+except ImportError:
+    from django.utils.tzinfo import FixedOffset as get_fixed_timezone
+
+__author__ = 'jorgealegre'
+
+# ISO 8601 as stored: 2015-01-17T10:20:30.123456+01:00, with optional time, fraction and offset
+_DATETIME_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)'
+                          r'(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6})\d*)?)?)?'
+                          r'(Z|[+-]\d\d:?\d\d)?$')
+_TIME_RE = re.compile(r'(\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6})\d*)?)?(Z|[+-]\d\d:?\d\d)?$')
+
+# time zones by offset minutes
+_TIMEZONES = {0: timezone.utc}
+
+
+def _get_timezone(offset):
+    """
+    Fixed offset time zone for offset like Z, +01:00 or -0530
+    """
+    if offset == 'Z':
+        return timezone.utc
+    minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+    if offset[0] == '-':
+        minutes = -minutes
+    if minutes not in _TIMEZONES:
+        _TIMEZONES[minutes] = get_fixed_timezone(minutes)
+    return _TIMEZONES[minutes]
+
+
+def _encode_offset(offset):
+    minutes = offset.days * 1440 + offset.seconds // 60
+    sign = '-' if minutes < 0 else '+'
+    minutes = abs(minutes)
+    return '%s%02d:%02d' % (sign, minutes // 60, minutes % 60)
+
+
+def encode_datetime(value):
+    """
+    ISO 8601 for datetime, with microseconds and UTC offset when they are informed
+
+    :param value: datetime
+    :return: string like 2015-01-17T10:20:30.123456+00:00
+    """
+    result = '%04d-%02d-%02dT%02d:%02d:%02d' % (value.year, value.month, value.day,
+                                               value.hour, value.minute, value.second)
+    if value.microsecond:
+        result += '.%06d' % value.microsecond
+    if value.tzinfo is not None:
+        offset = value.utcoffset()
+        if offset is not None:
+            result += _encode_offset(offset)
+    return result
+
+
+def encode_date(value):
+    """
+    ISO 8601 for date, or date of datetime
+
+    :param value: date
+    :return: string like 2015-01-17
+    """
+    return '%04d-%02d-%02d' % (value.year, value.month, value.day)
+
+
+def encode_time(value):
+    """
+    ISO 8601 for time, with microseconds and UTC offset when they are informed
+
+    :param value: time
+    :return: string like 10:20:30.123456
+    """
+    result = '%02d:%02d:%02d' % (value.hour, value.minute, value.second)
+    if value.microsecond:
+        result += '.%06d' % value.microsecond
+    if value.tzinfo is not None:
+        offset = value.utcoffset()
+        if offset is not None:
+            result += _encode_offset(offset)
+    return result
+
+
+def decode_datetime(value, use_tz=False):
+    """
+    Datetime for ISO 8601 string. With use_tz, datetimes without offset are UTC, otherwise datetimes with
+    offset are converted to naive in default time zone, as Django expects for USE_TZ setting.
+
+    :param value: ISO 8601 string
+    :param use_tz: Return aware datetimes
+    :return: datetime
+    :raises ValueError when value is not ISO 8601
+    """
+    if isinstance(value, datetime):
+        result = value
+    else:
+        match = _DATETIME_RE.match(value)
+        if match is None:
+            raise ValueError(u'Invalid ISO 8601 datetime "{}"'.format(value))
+        year, month, day, hour, minute, second, fraction, offset = match.groups()
+        result = datetime(int(year), int(month), int(day),
+                          int(hour or 0), int(minute or 0), int(second or 0),
+                          int(fraction.ljust(6, '0')) if fraction else 0,
+                          _get_timezone(offset) if offset else None)
+    if use_tz and result.tzinfo is None:
+        return result.replace(tzinfo=timezone.utc)
+    if not use_tz and result.tzinfo is not None:
+        return timezone.make_naive(result, timezone.get_default_timezone())
+    return result
+
+
+def decode_date(value):
+    """
+    Date for ISO 8601 string, time is ignored
+
+    :param value: ISO 8601 string
+    :return: date
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def decode_time(value):
+    """
+    Time for ISO 8601 time string
+
+    :param value: ISO 8601 string
+    :return: time
+    :raises ValueError when value is not ISO 8601
+    """
+    if isinstance(value, time):
+        return value
+    # times were stored with date part, like 1900-01-01T10:20:30
+    match = _TIME_RE.match(value.split('T', 1)[-1])
+    if match is None:
+        raise ValueError(u'Invalid ISO 8601 time "{}"'.format(value))
+    hour, minute, second, fraction, offset = match.groups()
+    return time(int(hour), int(minute), int(second or 0), int(fraction.ljust(6, '0')) if fraction else 0,
+                _get_timezone(offset) if offset else None)
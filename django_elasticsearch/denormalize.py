@@ -0,0 +1,104 @@
+# python
+import logging
+import threading
+
+# django
+from django.core.signals import request_started, request_finished
+from django.db import connections, router
+from django.db.models import get_models
+from django.db.models.signals import post_save
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+# refreshes kept before flush inside a request
+REFRESH_BATCH_SIZE = 500
+
+_local = threading.local()
+# related model -> [(model, field, field_names)]
+_RELATIONS = None
+_RELATIONS_LOCK = threading.Lock()
+
+
+def get_denormalized_relations(related_model):
+    """
+    Models embedding fields of related model with denormalize option
+
+    :param related_model: Model class
+    :return: list of (model, related field, embedded field names)
+    """
+    global _RELATIONS
+    if _RELATIONS is None:
+        with _RELATIONS_LOCK:
+            if _RELATIONS is None:
+                relations = {}
+                for model in get_models():
+                    for field_name, field_names in (getattr(model._meta, 'denormalize', None) or {}).iteritems():
+                        field = model._meta.get_field(field_name)
+                        relations.setdefault(field.rel.to._meta.concrete_model, []).append(
+                            (model, field, tuple(field_names)))
+                _RELATIONS = relations
+    return _RELATIONS.get(related_model._meta.concrete_model, [])
+
+
+def _get_pending():
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        # (model, field, field_names) -> {related pk: instance}
+        pending = _local.pending = {}
+    return pending
+
+
+def queue_refresh(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Queue refresh of embedded copies for saved related object. Refreshes are sent in batches when request
+    finishes, and right away outside requests.
+
+    Saves are not told apart by created: the backend writes updates as inserts, so every save of a document
+    reports created.
+    """
+    relations = get_denormalized_relations(sender)
+    if not relations:
+        return
+    pending = _get_pending()
+    count = 0
+    for model, field, field_names in relations:
+        if update_fields is not None and not set(update_fields) & set(field_names):
+            continue
+        instances = pending.setdefault((model, field, field_names), {})
+        instances[unicode(instance.pk)] = instance
+        count += len(instances)
+    if not getattr(_local, 'in_request', False) or count >= REFRESH_BATCH_SIZE:
+        flush_refreshes()
+
+
+def flush_refreshes(**kwargs):
+    """
+    Send queued refreshes, one update by query for each model and embedded relation
+    """
+    pending = _get_pending()
+    _local.pending = {}
+    for (model, field, field_names), instances in pending.iteritems():
+        connection = connections[router.db_for_write(model)]
+        snapshots = dict((pk, connection.ops.get_denormalized_snapshot(instance, field_names))
+                         for pk, instance in instances.iteritems())
+        connection.ops.update_denormalized(model, field, snapshots)
+
+
+def _request_started(**kwargs):
+    _local.in_request = True
+
+
+def _request_finished(**kwargs):
+    _local.in_request = False
+    flush_refreshes()
+
+
+def connect_signals():
+    """
+    Connect refresh of embedded copies to saves, once
+    """
+    post_save.connect(queue_refresh, dispatch_uid='django_elasticsearch.denormalize')
+    request_started.connect(_request_started, dispatch_uid='django_elasticsearch.denormalize')
+    request_finished.connect(_request_finished, dispatch_uid='django_elasticsearch.denormalize')
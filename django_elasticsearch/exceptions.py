@@ -3,3 +3,7 @@ __author__ = 'jorgealegre'
 
 class RebuildIndexException(Exception):
     pass
+
+
+class DateChunkException(Exception):
+    pass
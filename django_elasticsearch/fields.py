@@ -1,5 +1,7 @@
 # python
 import logging
+import hashlib
+import json
 
 # django
 from collections import OrderedDict
@@ -244,6 +246,7 @@ class DocumentObjectField(ObjectField):
         self.numeric_detection = numeric_detection
         self.dynamic_date_formats = dynamic_date_formats
         self._meta = DotDict(_meta or {})
+        self._fingerprint = None
 
     def get_meta(self, subtype=None):
         """
@@ -292,22 +295,45 @@ class DocumentObjectField(ObjectField):
             del result['type']
         return result
 
-    def save(self):
+    def add_property(self, prop):
+        self._fingerprint = None
+        return super(DocumentObjectField, self).add_property(prop)
+
+    def fingerprint(self):
+        """
+        Canonical hash for mapping, computed once unless properties are added
+
+        :return: sha1 hex digest of mapping with sorted keys
+        """
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha1(json.dumps(self.as_dict(), sort_keys=True)).hexdigest()
+        return self._fingerprint
+
+    def save(self, force=False, raise_exception=False, connection=None):
         """
-        Save mapping, registering into .django_engine internal index
+        Save mapping, registering into .django_engine internal index. Mappings with same fingerprint as
+        last registered for index and doc type are not sent.
 
-        :return:
+        :param force: Send mapping even if unchanged
+        :param raise_exception: Raise errors, like merge conflicts, instead of logging them
+        :param connection: Django connection registering mapping, default connection of current thread
+        :return: True when mapping was sent
         """
         if self.connection is None:
             raise RuntimeError(u"No connection available")
         try:
-            connection = connections[DEFAULT_DB_ALIAS]
+            connection = connection or connections[DEFAULT_DB_ALIAS]
             es_connection = self.connection
+            fingerprint = self.fingerprint()
+            if not force and connection.ops.get_mapping_fingerprint(self.index_name, self.name) == fingerprint:
+                logger.debug(u'Mapping for doc_type:"{}" index:"{}" unchanged'.format(self.name, self.index_name))
+                return False
             mappings_old = connection.ops.get_mappings(self.index_name, self.name)
             es_connection.indices.put_mapping(doc_type=self.name,
                                               mapping=self,
                                               indices=self.index_name)
-            connection.ops.register_mapping_update(self.index_name, self, mappings_old)
+            connection.ops.register_mapping_update(self.index_name, self, mappings_old, fingerprint=fingerprint)
+            return True
 
         except Exception:
             # reindex
@@ -320,6 +346,9 @@ class DocumentObjectField(ObjectField):
             import traceback
             logger.error(traceback.format_exc())
             logger.info(u'Could not update mappings for doc_type:"{}"'.format(self.name))
+            if raise_exception:
+                raise
+            return False
 
     def __repr__(self):
         return "<DocumentObjectField:%s>" % self.name
@@ -0,0 +1,96 @@
+# python
+import logging
+import threading
+
+# django
+from django.core.signals import request_started, request_finished
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class IdentityMap(object):
+    """
+    Documents loaded by primary key in current request, by model and primary key. Related objects for
+    select_related and prefetch_related are requested once per request.
+    """
+
+    # entities kept in one scope, like a long request, before map is cleared
+    MAX_SIZE = 10000
+
+    def __init__(self):
+        self._entities = {}
+
+    def _get_key(self, model, pk):
+        return model._meta.concrete_model, unicode(pk)
+
+    def get(self, model, pk):
+        return self._entities.get(self._get_key(model, pk))
+
+    def add(self, model, pk, entity):
+        if len(self._entities) >= self.MAX_SIZE:
+            self._entities.clear()
+        self._entities[self._get_key(model, pk)] = entity
+
+    def discard(self, model, pk):
+        self._entities.pop(self._get_key(model, pk), None)
+
+    def discard_model(self, model):
+        concrete_model = model._meta.concrete_model
+        for key in [key for key in self._entities if key[0] is concrete_model]:
+            del self._entities[key]
+
+    def clear(self):
+        self._entities.clear()
+
+
+class NullIdentityMap(IdentityMap):
+    """
+    Identity map outside scopes, keeps nothing
+    """
+
+    def add(self, model, pk, entity):
+        pass
+
+
+_NULL_IDENTITY_MAP = NullIdentityMap()
+
+
+def get_identity_map():
+    """
+    Identity map for current thread scope, like current request. Outside scopes, like management
+    commands and worker threads, documents are not kept.
+    """
+    return getattr(_local, 'identity_map', None) or _NULL_IDENTITY_MAP
+
+
+class identity_scope(object):
+    """
+    Keep documents loaded inside block in an identity map, like during a request:
+
+        with identity_scope():
+            ...
+    """
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'identity_map', None)
+        _local.identity_map = IdentityMap()
+        return _local.identity_map
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.identity_map = self._previous
+
+
+def _request_started(**kwargs):
+    _local.identity_map = IdentityMap()
+
+
+def _request_finished(**kwargs):
+    _local.identity_map = None
+
+
+request_started.connect(_request_started, dispatch_uid='django_elasticsearch.identity')
+request_finished.connect(_request_finished, dispatch_uid='django_elasticsearch.identity')
@@ -0,0 +1,53 @@
+# python
+import logging
+from optparse import make_option
+import sys
+
+# django
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.management.base import BaseCommand
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    args = ''
+    help = 'Incremental reindex of model indices, copying documents updated since last run'
+    can_import_settings = True
+
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+                    action='append',
+                    dest='indices',
+                    default=[],
+                    help='Model index alias, like "mytable__by_user". All model indices when not informed'),
+        make_option('--source',
+                    action='store',
+                    dest='source',
+                    default='',
+                    help='Source index, global index by default'),
+    )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        indices = options.get('indices') or []
+        if not indices:
+            for app_name, app_models in connection.introspection.models.iteritems():
+                for model in app_models:
+                    for model_index in getattr(model._meta, 'indices', None) or []:
+                        indices.append(u'{}__{}'.format(model._meta.db_table, model_index.keys()[0]))
+        has_errors = False
+        for alias in indices:
+            try:
+                count = connection.ops.delta_reindex(alias, source_index=options.get('source') or None)
+                self.stdout.write(u'index "{}" updated with {} documents'.format(alias, count))
+            except Exception:
+                import traceback
+                logger.error(traceback.format_exc())
+                self.stderr.write(u'Could not reindex "{}"'.format(alias))
+                has_errors = True
+        if has_errors:
+            sys.exit(1)
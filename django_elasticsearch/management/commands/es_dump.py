@@ -0,0 +1,129 @@
+# python
+import logging
+from optparse import make_option
+from multiprocessing.pool import ThreadPool
+import gzip
+import json
+import os
+import sys
+
+# django
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.management.base import BaseCommand
+
+# djes
+from django_elasticsearch import WRITE_QUEUE
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    args = ''
+    help = 'Dump index into NDJSON shards, one per scroll slice, written in parallel'
+    can_import_settings = True
+
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+                    action='store',
+                    dest='index',
+                    default='',
+                    help='Index or alias to dump, global index by default'),
+        make_option('--doc_type',
+                    action='store',
+                    dest='doc_type',
+                    default='',
+                    help='Doc type'),
+        make_option('--output',
+                    action='store',
+                    dest='output',
+                    default='.',
+                    help='Output directory'),
+        make_option('--slices',
+                    action='store',
+                    type='int',
+                    dest='slices',
+                    default=4,
+                    help='Number of scroll slices, each written to its own shard in parallel'),
+        make_option('--size',
+                    action='store',
+                    type='int',
+                    dest='size',
+                    default=1000,
+                    help='Documents per scroll page'),
+        make_option('--compress_level',
+                    action='store',
+                    type='int',
+                    dest='compress_level',
+                    default=6,
+                    help='gzip compression level, 0 writes plain NDJSON'),
+    )
+
+    def _dump_slice(self, slice_id):
+        """
+        Dump scroll slice into shard. Lines have bulk format without _index, so shards can be loaded into
+        any index.
+
+        :param slice_id: slice number
+        :return: (shard path, documents written)
+        """
+        connection = connections[DEFAULT_DB_ALIAS]
+        body = {
+            'query': {
+                'bool': {
+                    'must_not': {'type': {'value': WRITE_QUEUE}}
+                }
+            },
+            'sort': ['_doc'],
+            'size': self.size,
+        }
+        if self.slices > 1:
+            body['slice'] = {'id': slice_id, 'max': self.slices}
+        file_name = u'{}-{:04d}.ndjson'.format(self.index.strip('.'), slice_id)
+        path = os.path.join(self.output, file_name)
+        if self.compress_level:
+            path += '.gz'
+            shard = gzip.open(path, 'wb', self.compress_level)
+        else:
+            shard = open(path, 'wb')
+        count = 0
+        try:
+            for hits in connection.ops.scroll(self.index, body, doc_type=self.doc_type or None):
+                lines = []
+                for hit in hits:
+                    meta = {
+                        '_type': hit['_type'],
+                        '_id': hit['_id'],
+                    }
+                    if '_routing' in hit:
+                        meta['_routing'] = hit['_routing']
+                    lines.append(json.dumps({'index': meta}))
+                    lines.append(json.dumps(hit['_source']))
+                shard.write('\n'.join(lines) + '\n')
+                count += len(hits)
+                logger.debug(u'es_dump :: slice: {} documents: {}'.format(slice_id, count))
+        finally:
+            shard.close()
+        return path, count
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        self.index = options.get('index') or connection.default_indices[0]
+        self.doc_type = options.get('doc_type', '')
+        self.output = options.get('output', '.')
+        self.slices = max(options.get('slices', 1), 1)
+        self.size = options.get('size', 1000)
+        self.compress_level = options.get('compress_level', 6)
+        if not os.path.isdir(self.output):
+            self.stderr.write(u'output directory "{}" does not exist.'.format(self.output))
+            sys.exit(1)
+        pool = ThreadPool(self.slices)
+        try:
+            results = pool.map(self._dump_slice, range(self.slices))
+        finally:
+            pool.close()
+            pool.join()
+        for path, count in results:
+            self.stdout.write(u'{} documents written to "{}"'.format(count, path))
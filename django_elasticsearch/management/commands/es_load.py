@@ -0,0 +1,187 @@
+# python
+import logging
+from optparse import make_option
+import Queue
+import glob
+import gzip
+import mmap
+import os
+import sys
+import threading
+import traceback
+
+# django
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.management.base import BaseCommand
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    args = '<shard shard ...>'
+    help = 'Load NDJSON shards made by es_dump into index with concurrent bulk writers'
+    can_import_settings = True
+
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+                    action='store',
+                    dest='index',
+                    default='',
+                    help='Index or alias to load into, global index by default'),
+        make_option('--input',
+                    action='store',
+                    dest='input',
+                    default='',
+                    help='Directory with shards, when shards are not informed as arguments'),
+        make_option('--workers',
+                    action='store',
+                    type='int',
+                    dest='workers',
+                    default=4,
+                    help='Number of concurrent bulk writers, and of shard readers'),
+        make_option('--bulk_size',
+                    action='store',
+                    type='int',
+                    dest='bulk_size',
+                    default=1000,
+                    help='Documents per bulk request'),
+        make_option('--bulk_bytes',
+                    action='store',
+                    type='int',
+                    dest='bulk_bytes',
+                    default=10 * 1024 * 1024,
+                    help='Maximum bytes per bulk request'),
+    )
+
+    def _read_lines(self, path):
+        """
+        Iterate shard lines. Plain shards are memory-mapped, compressed shards are streamed.
+
+        :param path: shard path
+        :return: generator of lines
+        """
+        if path.endswith('.gz'):
+            shard = gzip.open(path, 'rb')
+            try:
+                for line in shard:
+                    yield line
+            finally:
+                shard.close()
+            return
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, 'rb') as shard:
+            mapped = mmap.mmap(shard.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                line = mapped.readline()
+                while line:
+                    yield line
+                    line = mapped.readline()
+            finally:
+                mapped.close()
+
+    def _read_shard(self, path):
+        """
+        Read shard into bulk chunks. Lines are sent as they are: sources are never decoded, and actions
+        have no _index, so the bulk request index applies.
+
+        :param path: shard path
+        :return:
+        """
+        lines = []
+        size = 0
+        for line in self._read_lines(path):
+            if not line.strip():
+                continue
+            lines.append(line if line.endswith('\n') else line + '\n')
+            size += len(line)
+            # action and source lines for each document
+            if len(lines) % 2 == 0 and (len(lines) >= self.bulk_size * 2 or size >= self.bulk_bytes):
+                self.chunks.put(''.join(lines))
+                lines = []
+                size = 0
+        if lines:
+            self.chunks.put(''.join(lines))
+
+    def _read_shards(self):
+        """
+        Shard reader, reads shards until queue is empty. Shards that can not be read, like corrupt
+        compressed ones, count as one error.
+        """
+        while True:
+            try:
+                path = self.shards.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self._read_shard(path)
+            except Exception:
+                logger.error(traceback.format_exc())
+                self.stderr.write(u'Could not read shard "{}"'.format(path))
+                with self.lock:
+                    self.errors += 1
+
+    def _write_chunks(self):
+        """
+        Bulk writer, sends chunks until it gets None
+        """
+        connection = connections[DEFAULT_DB_ALIAS]
+        es_connection = connection.connection
+        path = u'/{}/_bulk'.format(self.index)
+        while True:
+            chunk = self.chunks.get()
+            try:
+                if chunk is None:
+                    return
+                result = es_connection._send_request('POST', path, chunk)
+                items = result.get('items', [])
+                errors = 0
+                if result.get('errors'):
+                    errors = len([item for item in items if item.values()[0].get('status', 200) >= 300])
+                with self.lock:
+                    self.loaded += len(items) - errors
+                    self.errors += errors
+            except Exception:
+                logger.error(traceback.format_exc())
+                with self.lock:
+                    self.errors += chunk.count('\n') / 2
+            finally:
+                self.chunks.task_done()
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        self.index = options.get('index') or connection.default_indices[0]
+        self.bulk_size = options.get('bulk_size', 1000)
+        self.bulk_bytes = options.get('bulk_bytes', 10 * 1024 * 1024)
+        workers = max(options.get('workers', 1), 1)
+        paths = list(args)
+        if not paths and options.get('input'):
+            paths = sorted(glob.glob(os.path.join(options['input'], '*.ndjson')) +
+                           glob.glob(os.path.join(options['input'], '*.ndjson.gz')))
+        if not paths:
+            self.stderr.write(u'shards or input directory must be informed.')
+            sys.exit(1)
+        self.chunks = Queue.Queue(maxsize=workers * 2)
+        self.lock = threading.Lock()
+        self.loaded = 0
+        self.errors = 0
+        self.shards = Queue.Queue()
+        for path in paths:
+            self.shards.put(path)
+        writers = [threading.Thread(target=self._write_chunks) for _ in range(workers)]
+        readers = [threading.Thread(target=self._read_shards) for _ in range(min(workers, len(paths)))]
+        for thread in writers + readers:
+            thread.daemon = True
+            thread.start()
+        for thread in readers:
+            thread.join()
+        for _ in writers:
+            self.chunks.put(None)
+        for thread in writers:
+            thread.join()
+        self.stdout.write(u'{} documents loaded into "{}", {} errors'.format(self.loaded, self.index, self.errors))
+        if self.errors:
+            sys.exit(1)
@@ -1,5 +1,9 @@
 # python
 import logging
+from optparse import make_option
+from multiprocessing.pool import ThreadPool
+import sys
+import traceback
 
 # django
 from django.conf import settings
@@ -21,17 +25,217 @@ logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
 
+    option_list = BaseCommand.option_list + (
+        make_option('--workers',
+                    action='store',
+                    type='int',
+                    dest='workers',
+                    default=1,
+                    help='Number of models migrated in parallel'),
+        make_option('--plan',
+                    action='store_true',
+                    dest='plan',
+                    default=False,
+                    help='Show mapping changes and estimated rebuild cost without writing anything'),
+        make_option('--no_rebuild',
+                    action='store_true',
+                    dest='no_rebuild',
+                    default=False,
+                    help='Do not rebuild indices with incompatible mappings'),
+    )
+
+    def _get_connection(self):
+        """
+        Connection for current thread. Worker threads use their own connection, sharing mapping fingerprints
+        loaded by main thread.
+        """
+        connection = connections[DEFAULT_DB_ALIAS]
+        connection.ops.use_mapping_fingerprints(self.fingerprints)
+        return connection
+
+    def _plan_model(self, job):
+        """
+        Compare model mappings with mappings at ElasticSearch for global index and model indices.
+
+        :param job: (app_name, model)
+        :return: (app_name, model, plans) where plans are (alias, doc_type, changes, status) and status is
+                 "create", "chunks" or "update"
+        """
+        app_name, model = job
+        connection = self._get_connection()
+        es_connection = connection.connection
+        plans = []
+        index_names = [(self.global_index_name, {})]
+        for model_index in getattr(model._meta, 'indices', None) or []:
+            model_index_name = model_index.keys()[0]
+            index_names.append((u'{}__{}'.format(model._meta.db_table, model_index_name),
+                                model_index[model_index_name]))
+        for index_name, index_data in index_names:
+            mapping = model_to_mapping(model, es_connection, index_name)
+            if not connection.ops.has_alias(index_name):
+                plans.append((index_name, mapping.name, [], 'chunks' if index_data.get('date_chunks')
+                              else 'create'))
+                continue
+            mapping_server = connection.ops.get_mappings(index_name, mapping.name).get(mapping.name, {})
+            changes = connection.ops.diff_mapping(mapping.as_dict(), mapping_server)
+            plans.append((index_name, mapping.name, changes, 'chunks' if index_data.get('date_chunks')
+                          else 'update'))
+        return app_name, model, plans
+
+    def _plan(self, jobs):
+        """
+        Write migration plan: indices created, mapping changes per doc type, and for indices that need to
+        be rebuilt, documents, size and estimated rebuild time.
+        """
+        rebuilds = set()
+        creates = set()
+        for app_name, model, plans in self._map(self._plan_model, jobs):
+            for alias, doc_type, changes, status in plans:
+                if status == 'create':
+                    if alias not in creates:
+                        creates.add(alias)
+                        self.stdout.write(u'index "{}" will be created'.format(alias))
+                    continue
+                if not changes:
+                    continue
+                self.stdout.write(u'{}.{}: mapping "{}" on index "{}"'.format(
+                    app_name, model.__name__, doc_type, alias))
+                for path, change, detail in changes:
+                    self.stdout.write(u'    {:8} {} ({})'.format(change, path, detail))
+                if status == 'chunks':
+                    # rebuild not supported for date chunks, changes apply to chunks created after migrate
+                    self.stdout.write(u'    changes apply to date chunks created after migrate')
+                elif any(change == 'reindex' for path, change, detail in changes):
+                    rebuilds.add(alias)
+        for alias in sorted(rebuilds):
+            estimate = self.connection.ops.estimate_rebuild(alias)
+            self.stdout.write(u'index "{}" needs rebuild: {} documents, {:.1f} MB, about {:.0f} seconds'.format(
+                alias, estimate['docs'], estimate['size'] / 1048576.0, estimate['seconds']))
+        if not rebuilds:
+            self.stdout.write(u'No index needs rebuild')
+
+    def _migrate_model(self, job):
+        """
+        Create model indices and save model mappings for global index and model indices.
+
+        :param job: (app_name, model)
+        :return: (app_name, model, messages, errors, rebuilds) where rebuilds are aliases with
+                 incompatible mappings
+        """
+        app_name, model = job
+        connection = self._get_connection()
+        es_connection = connection.connection
+        messages = []
+        errors = []
+        rebuilds = []
+        mapping = model_to_mapping(model, es_connection, self.global_index_name)
+        try:
+            mapping.save(raise_exception=True, connection=connection)
+            messages.append(u'Mapping for model {}.{} updated'.format(app_name, model.__name__))
+        except Exception:
+            logger.error(traceback.format_exc())
+            rebuilds.append((self.global_index_name, mapping))
+        for model_index in getattr(model._meta, 'indices', None) or []:
+            model_index_name = model_index.keys()[0]
+            index_name = u'{}__{}'.format(model._meta.db_table, model_index_name)
+            logger.debug(u'model index name: {}'.format(index_name))
+            index_data = model_index[model_index_name]
+            logger.debug(u'index_data: {}'.format(index_data))
+            mapping = model_to_mapping(model, es_connection, index_name)
+            if index_data.get('date_chunks'):
+                # date chunk indices are created on write from template, with read alias for all chunks
+                try:
+                    if connection.ops.put_index_template(index_name, index_name + '-*',
+                                                         get_settings_by_meta(index_data), [mapping],
+                                                         aliases=[index_name]):
+                        messages.append(u'index template "{}" updated'.format(index_name))
+                    if connection.ops.has_alias(index_name):
+                        mapping.save(raise_exception=True, connection=connection)
+                except Exception:
+                    errors.append(u'Could not update date chunked index "{}": {}'.format(
+                        index_name, traceback.format_exc()))
+                continue
+            try:
+                if self.use_templates:
+                    # indices for model index are created with its settings and mapping from template
+                    if connection.ops.put_index_template(index_name, index_name + '-*',
+                                                         get_settings_by_meta(index_data), [mapping]):
+                        messages.append(u'index template "{}" updated'.format(index_name))
+                if not connection.ops.has_alias(index_name):
+                    index_physical, alias = connection.ops.create_index(
+                        index_name,
+                        index_settings=get_settings_by_meta(index_data),
+                        use_template=self.use_templates)
+                    messages.append(u'index "{}" created with physical name "{}"'.format(alias, index_physical))
+            except IndexAlreadyExistsException:
+                pass
+            except ElasticSearchException:
+                errors.append(u'Could not create index "{}": {}'.format(index_name, traceback.format_exc()))
+                continue
+            try:
+                mapping.save(raise_exception=True, connection=connection)
+                messages.append(u'Mapping for model {}.{} updated'.format(app_name, index_name))
+            except Exception:
+                logger.error(traceback.format_exc())
+                rebuilds.append((index_name, mapping))
+        return app_name, model, messages, errors, rebuilds
+
+    def _rebuild_index(self, job):
+        """
+        Rebuild index with incompatible mappings and save mappings into rebuilt index
+
+        :param job: (alias, mappings)
+        :return: (alias, error)
+        """
+        alias, mappings = job
+        connection = self._get_connection()
+        try:
+            connection.ops.rebuild_index(alias)
+            for mapping in mappings:
+                mapping.save(force=True, raise_exception=True, connection=connection)
+        except Exception:
+            return alias, traceback.format_exc()
+        return alias, None
+
+    def _map(self, func, jobs):
+        """
+        Run jobs in thread pool with workers threads, or serially for one worker
+        """
+        if self.workers <= 1 or len(jobs) <= 1:
+            return map(func, jobs)
+        pool = ThreadPool(min(self.workers, len(jobs)))
+        try:
+            return pool.map(func, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
     def handle(self, *args, **options):
         engine = settings.DATABASES.get(DEFAULT_DB_ALIAS, {}).get('ENGINE', '')
         global_index_name = settings.DATABASES.get(DEFAULT_DB_ALIAS, {}).get('NAME', '')
+        self.workers = options.get('workers', 1)
+        plan = options.get('plan', False)
+        no_rebuild = options.get('no_rebuild', False)
         options = settings.DATABASES.get(DEFAULT_DB_ALIAS, {}).get('OPTIONS', {})
         connection = connections[DEFAULT_DB_ALIAS]
-        es_connection = connection.connection
+        self.connection = connection
+        self.global_index_name = global_index_name
+        self.use_templates = options.get('INDEX_TEMPLATES', False)
 
         # Call regular migrate if engine is different from ours
         if engine != ENGINE:
             return super(Command, self).handle(**options)
         else:
+            logger.debug(u'models: {}'.format(connection.introspection.models))
+            jobs = []
+            for app_name, app_models in connection.introspection.models.iteritems():
+                for model in app_models:
+                    jobs.append((app_name, model))
+            # mapping fingerprints are loaded once and shared by worker connections
+            self.fingerprints = connection.ops.get_mapping_fingerprints()
+            if plan:
+                self._plan(jobs)
+                return
             # project global index
             has_alias = connection.ops.has_alias(global_index_name)
             if not has_alias:
@@ -40,50 +244,39 @@ class Command(BaseCommand):
                                                                           skip_register=True)
                     self.stdout.write(u'index "{}" created with physical name "{}"'.format(alias, index_name_final))
                     connection.ops.build_django_engine_structure()
+                    connection.ops.build_write_queue_mapping(global_index_name)
                     # register create index for global
                     connection.ops.register_index_operation(index_name_final, OPERATION_CREATE_INDEX,
                                                             connection.ops.build_es_settings_from_django(options))
                 except IndexAlreadyExistsException:
                     pass
                 except ElasticSearchException:
-                    import traceback
                     logger.error(traceback.format_exc())
 
-            logger.debug(u'models: {}'.format(connection.introspection.models))
-            for app_name, app_models in connection.introspection.models.iteritems():
-                for model in app_models:
-                    mapping = model_to_mapping(model, es_connection, global_index_name)
-                    try:
-                        mapping.save()
-                        self.stdout.write(u'Mapping for model {}.{} updated'.format(app_name, model.__name__))
-                    except Exception as e:
-                        import traceback
-                        logger.error(traceback.format_exc())
-                        self.stderr.write(u'Could not update mapping, rebuilding global index...')
-                        connection.ops.rebuild_index(global_index_name)
-                        mapping.save()
-                    if not hasattr(model._meta, 'indices'):
+            # indices with incompatible mappings, rebuilt once each after all models are migrated
+            rebuilds = {}
+            has_errors = False
+            for app_name, model, messages, errors, model_rebuilds in self._map(self._migrate_model, jobs):
+                for message in messages:
+                    self.stdout.write(message)
+                for error in errors:
+                    has_errors = True
+                    self.stderr.write(u'{}.{}: {}'.format(app_name, model.__name__, error))
+                for alias, mapping in model_rebuilds:
+                    if no_rebuild:
+                        has_errors = True
+                        self.stderr.write(u'Could not update mapping for model {}.{}, index "{}" needs rebuild'
+                                          .format(app_name, model.__name__, alias))
                         continue
-                    for model_index in model._meta.indices:
-                        model_index_name = model_index.keys()[0]
-                        index_name = u'{}__{}'.format(model._meta.db_table, model_index_name)
-                        logger.debug(u'model index name: {}'.format(index_name))
-                        index_data = model_index[model_index_name]
-                        logger.debug(u'index_data: {}'.format(index_data))
-                        try:
-                            index_physical, alias = connection.ops.create_index(index_name,
-                                                                                get_settings_by_meta(index_data))
-                            self.stdout.write(u'index "{}" created with physical name "{}"'.format(alias,
-                                                                                                   index_physical))
-                        except IndexAlreadyExistsException:
-                            pass
-                        mapping = model_to_mapping(model, es_connection, index_name)
-                        try:
-                            mapping.save()
-                            self.stdout.write(u'Mapping for model {}.{} updated'
-                                              .format(app_name, index_name))
-                        except Exception as e:
-                            self.stderr.write(u'Could not update mapping, rebuilding index "{}" ...'
-                                              .format(index_name))
-                            connection.ops.rebuild_index(index_name)
-                            mapping.save()
+                    self.stderr.write(u'Could not update mapping for model {}.{}, rebuilding index "{}" ...'
+                                      .format(app_name, model.__name__, alias))
+                    rebuilds.setdefault(alias, []).append(mapping)
+            for alias, error in self._map(self._rebuild_index, rebuilds.items()):
+                if error:
+                    has_errors = True
+                    self.stderr.write(u'Could not rebuild index "{}": {}'.format(alias, error))
+                else:
+                    self.stdout.write(u'index "{}" rebuilt'.format(alias))
+            if has_errors:
+                self.stderr.write(u'migrate finished with errors')
+                sys.exit(1)
@@ -0,0 +1,55 @@
+# python
+import logging
+from optparse import make_option
+import sys
+
+# django
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.management.base import BaseCommand
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    args = ''
+    help = 'Delete date chunk indices older than model index retention'
+    can_import_settings = True
+
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+                    action='append',
+                    dest='indices',
+                    default=[],
+                    help='Model index alias, like "mytable__by_day". All date chunked indices when not informed'),
+        make_option('--retention',
+                    action='store',
+                    type='int',
+                    dest='retention',
+                    default=None,
+                    help='Chunks to keep, days or months, model index "retention" by default'),
+    )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        indices = options.get('indices') or []
+        if not indices:
+            for app_name, app_models in connection.introspection.models.iteritems():
+                for model in app_models:
+                    for model_index in getattr(model._meta, 'indices', None) or []:
+                        if model_index.values()[0].get('date_chunks'):
+                            indices.append(u'{}__{}'.format(model._meta.db_table, model_index.keys()[0]))
+        has_errors = False
+        for alias in indices:
+            model, index_data = connection.ops.get_model_index(alias)
+            retention = options.get('retention') or index_data.get('retention')
+            if not index_data.get('date_chunks') or not retention:
+                self.stderr.write(u'index "{}" has no date chunks or retention'.format(alias))
+                has_errors = True
+                continue
+            for index_name in connection.ops.purge_date_chunks(alias, retention):
+                self.stdout.write(u'index "{}" deleted'.format(index_name))
+        if has_errors:
+            sys.exit(1)
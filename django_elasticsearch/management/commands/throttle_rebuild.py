@@ -0,0 +1,54 @@
+# python
+import logging
+from optparse import make_option
+import sys
+
+# django
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.management.base import BaseCommand
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    args = ''
+    help = 'Set rebuild and reindex limits for index, running rebuilds apply them in a few seconds'
+    can_import_settings = True
+
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+                    action='store',
+                    dest='index',
+                    default='',
+                    help='Index alias'),
+        make_option('--docs_per_sec',
+                    action='store',
+                    type='float',
+                    dest='docs_per_sec',
+                    default=None,
+                    help='Documents per second, no limit when not informed'),
+        make_option('--bytes_per_sec',
+                    action='store',
+                    type='float',
+                    dest='bytes_per_sec',
+                    default=None,
+                    help='Bytes per second, no limit when not informed'),
+    )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        index_name = options.get('index', '')
+        if index_name == '':
+            self.stderr.write(u'index must be informed.')
+            sys.exit(1)
+        connection.ops.set_throttle(index_name,
+                                    docs_per_sec=options.get('docs_per_sec'),
+                                    bytes_per_sec=options.get('bytes_per_sec'))
+        self.stdout.write(u'index "{}" limits: docs_per_sec: {} bytes_per_sec: {}'.format(
+            index_name,
+            options.get('docs_per_sec'),
+            options.get('bytes_per_sec'),
+        ))
@@ -1,17 +1,17 @@
 # python
 import logging
+import copy
+import json
 
 # pyes
 from pyes import mappings
 from abc import ABCMeta, abstractmethod
-import sys
 from . import DjangoElasticEngineException
 from django.utils.translation import ugettext_lazy as _
 
 # django
 
 # djes
-from . import ENGINE
 import fields
 
 __author__ = 'jorgealegre'
@@ -20,43 +20,133 @@ __author__ = 'jorgealegre'
 logger = logging.getLogger(__name__)
 
 
+# field type name -> FieldMapping class, filled when FieldMapping classes are defined
+FIELD_MAPPINGS = {}
+# (model, options) -> mapping without index, see model_to_mapping
+_MAPPING_CACHE = {}
+# field class -> FieldMapping class or None for pyes fields
+_FIELD_CLASS_CACHE = {}
+
+
+def register_field_mapping(field_type, mapping_class):
+    """
+    Register mapping class for field type, so third party apps can support their fields or override
+    default mappings
+
+    :param field_type: Field class or field class name
+    :param mapping_class: FieldMapping class
+    :return:
+    """
+    if not isinstance(field_type, basestring):
+        field_type = field_type.__name__
+    FIELD_MAPPINGS[field_type] = mapping_class
+    clear_mapping_cache()
+
+
+def clear_mapping_cache():
+    """
+    Clear memoized mappings and field resolution
+    """
+    _MAPPING_CACHE.clear()
+    _FIELD_CLASS_CACHE.clear()
+
+
+def get_field_mapping_class(field):
+    """
+    Resolve FieldMapping class for field: registered class for field type, then pyes fields, then registered
+    classes for field parent classes.
+
+    :param field: Django model field
+    :return: FieldMapping class, None for pyes fields
+    :raises DjangoElasticEngineException when field type is not supported
+    """
+    field_class = type(field)
+    try:
+        return _FIELD_CLASS_CACHE[field_class]
+    except KeyError:
+        pass
+    field_type = field_class.__name__
+    if field_type in FIELD_MAPPINGS:
+        mapping_class = FIELD_MAPPINGS[field_type]
+    elif hasattr(mappings, field_type):
+        # ElasticSearch fields from pyes
+        mapping_class = None
+    else:
+        for parent_class in field_class.__mro__[1:]:
+            if parent_class.__name__ in FIELD_MAPPINGS:
+                mapping_class = FIELD_MAPPINGS[parent_class.__name__]
+                break
+        else:
+            raise DjangoElasticEngineException(_(u'Field type {} not supported'.format(field_type)))
+    _FIELD_CLASS_CACHE[field_class] = mapping_class
+    return mapping_class
+
+
 def model_to_mapping(model, connection, index_name, **kwargs):
     """
     This receives a model and generates the mapping
 
+    Mappings are generated once for model and options, then only connection and index are bound to a
+    deep copy, so callers can change their mapping without changing the cached one.
+
     :return:
     """
     meta = model._meta
-    logger.debug(u'meta: {} fields: {}'.format(meta, meta.fields + meta.many_to_many))
-    mapping = fields.DocumentObjectField(
-        name=kwargs.get('name', model._meta.db_table),
-        connection=connection,
-        index_name=index_name,
-    )
-    if '_routing' in kwargs:
-        mapping['_routing'] = kwargs['_routing']
-    for field in meta.fields + meta.many_to_many:
-        field_type = type(field).__name__
-        if hasattr(sys.modules[ENGINE + '.mapping'], '{}Mapping'.format(field_type)):
+    key = (model, json.dumps(kwargs, sort_keys=True))
+    mapping = _MAPPING_CACHE.get(key)
+    if mapping is None:
+        logger.debug(u'meta: {} fields: {}'.format(meta, meta.fields + meta.many_to_many))
+        mapping = fields.DocumentObjectField(
+            name=kwargs.get('name', model._meta.db_table),
+        )
+        if '_routing' in kwargs:
+            mapping._routing = kwargs['_routing']
+        for field in meta.fields + meta.many_to_many:
+            mapping_class = get_field_mapping_class(field)
+            if mapping_class is None:
+                mapping.add_property(field)
+                continue
             # django model field type
-            field_mapping = getattr(sys.modules[ENGINE + '.mapping'], '{}Mapping'
-                                    .format(field_type)).get(field)
+            field_mapping = mapping_class.get(field)
             if field_mapping:
                 mapping.add_property(field_mapping)
-        elif hasattr(mappings, field_type):
-            # ElasticSearch fields from pyes
-            mapping.add_property(field)
-        else:
-            raise DjangoElasticEngineException(_(u'Field type {} not supported'.format(field_type)))
-    logger.info(u'model_to_mapping :: model: {} index_name: {}'.format(
+        # related objects embedded as objects, with mapping for their fields
+        for field_name, related_field_names in (getattr(meta, 'denormalize', None) or {}).iteritems():
+            field = meta.get_field(field_name)
+            properties = {}
+            for related_field_name in related_field_names:
+                related_field = field.rel.to._meta.get_field(related_field_name)
+                mapping_class = get_field_mapping_class(related_field)
+                field_mapping = related_field if mapping_class is None else mapping_class.get(related_field)
+                if field_mapping:
+                    properties[related_field.column] = field_mapping
+            mapping.add_property(fields.ObjectField(name=field.name, properties=properties))
+        # fingerprint is kept by copies
+        mapping.fingerprint()
+        _MAPPING_CACHE[key] = mapping
+    mapping = copy.deepcopy(mapping)
+    mapping.connection = connection
+    mapping.index_name = index_name
+    logger.debug(u'model_to_mapping :: model: {} index_name: {}'.format(
         model._meta.db_table,
         index_name
     ))
     return mapping
 
 
+class FieldMappingMeta(ABCMeta):
+    """
+    Registers FieldMapping classes named {FieldType}Mapping for field type
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(FieldMappingMeta, cls).__init__(name, bases, attrs)
+        if name != 'FieldMapping' and name.endswith('Mapping'):
+            register_field_mapping(name[:-len('Mapping')], cls)
+
+
 class FieldMapping(object):
-    __metaclass__ = ABCMeta
+    __metaclass__ = FieldMappingMeta
 
     @classmethod
     @abstractmethod
@@ -86,6 +176,21 @@ class AutoFieldMapping(FieldMapping):
                                   index='not_analyzed')
 
 
+class ForeignKeyMapping(FieldMapping):
+
+    @classmethod
+    def get(cls, field, **kwargs):
+        """
+        Mapping for ForeignKey and OneToOneField, primary key of related object at field column
+
+        :param field:
+        :param kwargs:
+        :return:
+        """
+        return fields.StringField(name=field.column,
+                                  index='not_analyzed')
+
+
 class IntegerFieldMapping(FieldMapping):
 
     @classmethod
@@ -214,7 +319,7 @@ class DateTimeFieldMapping(FieldMapping):
         :return:
         """
         return mappings.DateField(name=field.name,
-                                  format='%Y-%m-%dT%H:%M:%S',
+                                  format='date_optional_time',
                                   **kwargs)
 
 
@@ -228,7 +333,7 @@ class DateFieldMapping(FieldMapping):
         :return:
         """
         return mappings.DateField(name=field.name,
-                                  format='%Y-%m-%d',
+                                  format='date',
                                   **kwargs)
 
 
@@ -6,6 +6,9 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
 
+# djes
+from django_elasticsearch.query import Manager
+
 __author__ = 'jorgealegre'
 
 
@@ -37,6 +40,22 @@ class BaseModel(models.Model):
 
     Some cases we would want model forced into a model index, disallow from db default index
 
+    Model indices can be split into date chunks, one physical index per day or month for date field,
+    all of them read through the model index alias. Older chunks are deleted as whole indices:
+    'by_day': {
+        'date_chunks': DATE_CHUNKS_PER_DAY,
+        'date_field': 'created_on',
+        'retention': 30,
+        'number_of_replicas': 1,
+        'number_of_shards': 1,
+    }
+
+    Fields of related objects can be embedded into document, so queries filter on them without joins,
+    like customer__country. Embedded copies are refreshed when related objects are saved:
+    denormalize = {
+        'customer': ('name', 'country'),
+    }
+
     created_by:
     {
         'id': id,
@@ -46,6 +65,8 @@ class BaseModel(models.Model):
 
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+
+    objects = Manager()
     # created_by = models.ForeignKey(User, null=True, blank=True)
     # updated_by = models.ForeignKey(User, null=True, blank=True)
 
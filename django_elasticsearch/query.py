@@ -0,0 +1,35 @@
+# python
+import logging
+
+# django
+from django.db.models import query, manager
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class QuerySet(query.QuerySet):
+
+    def iterator(self, consistent=False):
+        """
+        An iterator over the results from applying this QuerySet to the database.
+
+        With consistent, results come from a scroll context, a snapshot of index taken when iteration
+        starts, so documents written while iterating are not seen twice or missed. Context is kept alive
+        until iteration ends, see DatabaseOperations.scroll_snapshot.
+
+        :param consistent: Iterate over snapshot of index
+        :return: iterator of model instances
+        """
+        if not consistent:
+            return super(QuerySet, self).iterator()
+        clone = self._clone()
+        clone.query.consistent = True
+        return super(QuerySet, clone).iterator()
+
+
+class Manager(manager.Manager):
+
+    def get_queryset(self):
+        return QuerySet(self.model, using=self._db)
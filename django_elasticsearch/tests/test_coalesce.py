@@ -0,0 +1,92 @@
+# python
+import threading
+import time
+import unittest
+
+# djes
+from django_elasticsearch.coalesce import SingleFlight, get_single_flight
+
+__author__ = 'jorgealegre'
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def _run_followers(self, single_flight, key, func, count):
+        """
+        Start count threads calling single flight for key while leader call is blocked in func
+
+        :return: (threads, results) with results filled by threads, exceptions included
+        """
+        results = []
+
+        def call():
+            try:
+                results.append(single_flight.do(key, func))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_concurrent_calls_share_result(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def request():
+            calls.append(1)
+            release.wait(5)
+            return {'hits': len(calls)}
+
+        threads, results = self._run_followers(single_flight, 'key', request, 5)
+        # followers wait for leader
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'hits': 1}] * 5)
+
+    def test_error_propagated_to_followers_and_not_shared_after(self):
+        single_flight = SingleFlight(window=60.0)
+        release = threading.Event()
+
+        def request():
+            release.wait(5)
+            raise ValueError('request failed')
+
+        threads, results = self._run_followers(single_flight, 'key', request, 3)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        # failed flight is dropped even while window is open
+        self.assertEqual(single_flight.do('key', lambda: 'ok'), 'ok')
+
+    def test_sequential_calls_without_window(self):
+        single_flight = SingleFlight()
+        calls = []
+        for _ in range(3):
+            single_flight.do('key', calls.append, 1)
+        self.assertEqual(len(calls), 3)
+
+    def test_window_shares_finished_result(self):
+        single_flight = SingleFlight(window=60.0)
+        calls = []
+
+        def request():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(single_flight.do('key', request), 1)
+        self.assertEqual(single_flight.do('key', request), 1)
+        self.assertEqual(single_flight.do('other', request), 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_get_single_flight(self):
+        self.assertIs(get_single_flight('test_coalesce'), get_single_flight('test_coalesce'))
+        self.assertIsNot(get_single_flight('test_coalesce'), get_single_flight('test_coalesce_other'))
@@ -0,0 +1,161 @@
+# python
+import json
+import unittest
+
+# pyes
+from pyes.exceptions import NoServerAvailable
+
+# djes
+from django_elasticsearch import connection
+from django_elasticsearch.connection import NodePool, SELECTOR_LEAST_LOADED
+
+__author__ = 'jorgealegre'
+
+
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class FakeResponse(object):
+
+    def __init__(self, data='{}'):
+        self.status = 200
+        self.data = data
+        self.headers = {}
+
+
+class FakePool(object):
+    """
+    urllib3 pool for node, failing with IOError while down
+    """
+
+    def __init__(self, down=False, data='{}'):
+        self.down = down
+        self.data = data
+        self.requests = []
+
+    def urlopen(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        if self.down:
+            raise IOError('connection refused')
+        return FakeResponse(self.data)
+
+
+class NodePoolTestCase(unittest.TestCase):
+
+    URLS = ['http://node1:9200', 'http://node2:9200', 'http://node3:9200']
+
+    def setUp(self):
+        self.clock = FakeTime()
+        self._time = connection.time
+        connection.time = self.clock
+
+    def tearDown(self):
+        connection.time = self._time
+
+    def _get_pool(self, **kwargs):
+        pool = NodePool(self.URLS, **kwargs)
+        for node in pool.nodes:
+            node.pool = FakePool()
+        return pool
+
+    def test_invalid_selector(self):
+        self.assertRaises(ValueError, NodePool, self.URLS, selector='random')
+
+    def test_round_robin(self):
+        pool = self._get_pool()
+        urls = []
+        for _ in range(6):
+            node = pool.get_node()
+            urls.append(node.url)
+            pool.mark_live(node)
+        self.assertEqual(sorted(urls[:3]), self.URLS)
+        self.assertEqual(urls[:3], urls[3:])
+
+    def test_least_loaded(self):
+        pool = self._get_pool(selector=SELECTOR_LEAST_LOADED)
+        nodes = [pool.get_node() for _ in range(3)]
+        self.assertEqual(sorted(node.url for node in nodes), self.URLS)
+        pool.mark_live(nodes[1])
+        self.assertIs(pool.get_node(), nodes[1])
+
+    def test_dead_timeout_doubles(self):
+        pool = self._get_pool(dead_timeout=10)
+        node = pool.nodes[0]
+        pool.mark_dead(node)
+        self.assertTrue(node.is_dead)
+        self.assertEqual(node.dead_until, 10)
+        pool.mark_dead(node)
+        self.assertEqual(node.dead_until, 20)
+        pool.mark_dead(node)
+        self.assertEqual(node.dead_until, 40)
+        for _ in range(20):
+            pool.mark_dead(node)
+        self.assertEqual(node.dead_until, NodePool.MAX_DEAD_TIMEOUT)
+        pool.mark_live(node)
+        self.assertFalse(node.is_dead)
+        self.assertEqual(node.failures, 0)
+
+    def test_dead_node_skipped_until_resurrected(self):
+        pool = self._get_pool(dead_timeout=10)
+        dead = pool.nodes[0]
+        pool.mark_dead(dead)
+        for _ in range(4):
+            node = pool.get_node()
+            self.assertIsNot(node, dead)
+            pool.mark_live(node)
+        self.clock.now = 10
+        nodes = []
+        for _ in range(3):
+            nodes.append(pool.get_node())
+            pool.mark_live(nodes[-1])
+        self.assertFalse(dead.is_dead)
+        self.assertIn(dead, nodes)
+
+    def test_all_dead_tries_first_to_resurrect(self):
+        pool = self._get_pool(dead_timeout=10)
+        pool.mark_dead(pool.nodes[0])
+        pool.mark_dead(pool.nodes[0])
+        pool.mark_dead(pool.nodes[1])
+        self.clock.now = 1
+        pool.mark_dead(pool.nodes[2])
+        self.assertIs(pool.get_node(), pool.nodes[1])
+
+    def test_retry_on_other_node(self):
+        pool = self._get_pool()
+        down = pool.nodes[1]
+        down.pool.down = True
+        response = pool._urlopen('GET', '/_cluster/health', None, {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(down.pool.requests), 1)
+        self.assertTrue(down.is_dead)
+        self.assertEqual(sum(len(node.pool.requests) for node in pool.nodes), 2)
+
+    def test_no_server_available_after_max_retries(self):
+        pool = self._get_pool(max_retries=2)
+        for node in pool.nodes:
+            node.pool.down = True
+        self.assertRaises(NoServerAvailable, pool._urlopen, 'GET', '/', None, {})
+        self.assertEqual(sum(len(node.pool.requests) for node in pool.nodes), 3)
+        self.assertTrue(all(node.is_dead for node in pool.nodes))
+
+    def test_sniff(self):
+        pool = self._get_pool()
+        known = pool.nodes[0]
+        known.pool.data = json.dumps({'nodes': {
+            'a': {'http': {'publish_address': '10.0.0.1:9200'}},
+            'b': {'http_address': 'inet[/10.0.0.2:9200]'},
+            'c': {},
+        }})
+        for node in pool.nodes[1:]:
+            node.pool.data = known.pool.data
+        known.url = 'http://10.0.0.1:9200'
+        self.assertEqual(sorted(pool.sniff()), ['http://10.0.0.1:9200', 'http://10.0.0.2:9200'])
+        self.assertEqual(sorted(node.url for node in pool.nodes), ['http://10.0.0.1:9200', 'http://10.0.0.2:9200'])
+        # connection pool of known node kept
+        self.assertIn(known, pool.nodes)
@@ -0,0 +1,72 @@
+# python
+import unittest
+
+# djes
+from django_elasticsearch import cursors
+from django_elasticsearch.cursors import CursorCache
+
+__author__ = 'jorgealegre'
+
+
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class CursorCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeTime()
+        self._time = cursors.time
+        cursors.time = self.clock
+
+    def tearDown(self):
+        cursors.time = self._time
+
+    def test_empty(self):
+        cache = CursorCache()
+        self.assertEqual(cache.get_nearest('query', 5000), (0, None))
+
+    def test_nearest_before_or_at_position(self):
+        cache = CursorCache()
+        cache.set('query', 1000, ['a'])
+        cache.set('query', 2000, ['b'])
+        cache.set('query', 3000, ['c'])
+        self.assertEqual(cache.get_nearest('query', 999), (0, None))
+        self.assertEqual(cache.get_nearest('query', 1000), (1000, ['a']))
+        self.assertEqual(cache.get_nearest('query', 2500), (2000, ['b']))
+        self.assertEqual(cache.get_nearest('query', 10000), (3000, ['c']))
+        self.assertEqual(cache.get_nearest('other', 10000), (0, None))
+
+    def test_cursors_expire(self):
+        cache = CursorCache(ttl=10.0)
+        cache.set('query', 1000, ['a'])
+        self.clock.now = 5.0
+        cache.set('query', 2000, ['b'])
+        self.clock.now = 12.0
+        # cursor at 1000 expired, cursor at 2000 is still valid
+        self.assertEqual(cache.get_nearest('query', 1500), (0, None))
+        self.assertEqual(cache.get_nearest('query', 2500), (2000, ['b']))
+        self.clock.now = 16.0
+        self.assertEqual(cache.get_nearest('query', 2500), (0, None))
+
+    def test_least_recently_used_queries_dropped(self):
+        cache = CursorCache(max_queries=2)
+        cache.set('first', 1000, ['a'])
+        cache.set('second', 1000, ['b'])
+        # first query is used, second is least recently used
+        cache.get_nearest('first', 1000)
+        cache.set('third', 1000, ['c'])
+        self.assertEqual(cache.get_nearest('first', 1000), (1000, ['a']))
+        self.assertEqual(cache.get_nearest('second', 1000), (0, None))
+        self.assertEqual(cache.get_nearest('third', 1000), (1000, ['c']))
+
+    def test_set_replaces_cursor(self):
+        cache = CursorCache()
+        cache.set('query', 1000, ['a'])
+        cache.set('query', 1000, ['b'])
+        self.assertEqual(cache.get_nearest('query', 1000), (1000, ['b']))
@@ -0,0 +1,92 @@
+# python
+from datetime import datetime, date, time, timedelta
+import unittest
+
+# django
+from django.utils import timezone
+
+# djes
+from django_elasticsearch.dates import encode_datetime, encode_date, encode_time, decode_datetime, \
+    decode_date, decode_time, _get_timezone
+
+__author__ = 'jorgealegre'
+
+
+class DatesTestCase(unittest.TestCase):
+
+    def test_datetime_round_trip(self):
+        for value in (datetime(2015, 1, 17, 10, 20, 30),
+                      datetime(2015, 1, 17, 10, 20, 30, 123456),
+                      datetime(1, 1, 1, 0, 0, 0)):
+            self.assertEqual(decode_datetime(encode_datetime(value)), value)
+
+    def test_encode_datetime(self):
+        self.assertEqual(encode_datetime(datetime(2015, 1, 17, 10, 20, 30)), '2015-01-17T10:20:30')
+        self.assertEqual(encode_datetime(datetime(2015, 1, 17, 10, 20, 30, 1200)),
+                         '2015-01-17T10:20:30.001200')
+        self.assertEqual(encode_datetime(datetime(2015, 1, 17, 10, 20, 30, tzinfo=timezone.utc)),
+                         '2015-01-17T10:20:30+00:00')
+        self.assertEqual(encode_datetime(datetime(2015, 1, 17, 10, 20, 30, tzinfo=_get_timezone('-05:30'))),
+                         '2015-01-17T10:20:30-05:30')
+
+    def test_aware_datetime_round_trip(self):
+        value = datetime(2015, 1, 17, 10, 20, 30, 500, tzinfo=_get_timezone('+01:00'))
+        result = decode_datetime(encode_datetime(value), use_tz=True)
+        self.assertEqual(result, value)
+        self.assertEqual(result.utcoffset(), timedelta(hours=1))
+
+    def test_decode_datetime_time_zones(self):
+        # naive values are UTC with use_tz
+        self.assertEqual(decode_datetime('2015-01-17T10:20:30', use_tz=True),
+                         datetime(2015, 1, 17, 10, 20, 30, tzinfo=timezone.utc))
+        self.assertEqual(decode_datetime('2015-01-17T10:20:30Z', use_tz=True),
+                         datetime(2015, 1, 17, 10, 20, 30, tzinfo=timezone.utc))
+        # aware values are naive in default time zone without use_tz
+        value = datetime(2015, 1, 17, 10, 20, 30, tzinfo=timezone.utc)
+        self.assertEqual(decode_datetime('2015-01-17T11:20:30+0100'),
+                         timezone.make_naive(value, timezone.get_default_timezone()))
+
+    def test_decode_datetime_formats(self):
+        self.assertEqual(decode_datetime('2015-01-17'), datetime(2015, 1, 17))
+        self.assertEqual(decode_datetime('2015-01-17 10:20'), datetime(2015, 1, 17, 10, 20))
+        # fraction is truncated to microseconds
+        self.assertEqual(decode_datetime('2015-01-17T10:20:30.1234567'),
+                         datetime(2015, 1, 17, 10, 20, 30, 123456))
+        self.assertEqual(decode_datetime('2015-01-17T10:20:30.5'), datetime(2015, 1, 17, 10, 20, 30, 500000))
+        value = datetime(2015, 1, 17)
+        self.assertIs(decode_datetime(value), value)
+
+    def test_decode_datetime_invalid(self):
+        self.assertRaises(ValueError, decode_datetime, '17/01/2015')
+        self.assertRaises(ValueError, decode_datetime, '2015-01-17T10:20:30 garbage')
+
+    def test_date_round_trip(self):
+        value = date(2015, 1, 17)
+        self.assertEqual(encode_date(value), '2015-01-17')
+        self.assertEqual(decode_date(encode_date(value)), value)
+        self.assertEqual(encode_date(datetime(2015, 1, 17, 10, 20)), '2015-01-17')
+        self.assertEqual(decode_date('2015-01-17T10:20:30'), value)
+        self.assertEqual(decode_date(datetime(2015, 1, 17, 10, 20)), value)
+
+    def test_time_round_trip(self):
+        for value in (time(10, 20, 30), time(0, 0), time(23, 59, 59, 999999)):
+            self.assertEqual(decode_time(encode_time(value)), value)
+        self.assertEqual(encode_time(time(10, 20, 30, 1200)), '10:20:30.001200')
+        value = time(10, 20, 30, tzinfo=_get_timezone('+02:00'))
+        self.assertEqual(encode_time(value), '10:20:30+02:00')
+        self.assertEqual(decode_time(encode_time(value)), value)
+
+    def test_decode_time_legacy_date_prefix(self):
+        # times were stored with date part before ISO codec
+        self.assertEqual(decode_time('1900-01-01T10:20:30'), time(10, 20, 30))
+        self.assertEqual(decode_time('1900-01-01T10:20:30.000001'), time(10, 20, 30, 1))
+        self.assertEqual(decode_time('1900-01-01T10:20'), time(10, 20))
+
+    def test_decode_time_invalid(self):
+        self.assertRaises(ValueError, decode_time, '10h20')
+
+    def test_get_timezone_cached(self):
+        self.assertIs(_get_timezone('+01:00'), _get_timezone('+0100'))
+        self.assertIs(_get_timezone('Z'), timezone.utc)
+        self.assertIs(_get_timezone('+00:00'), timezone.utc)
+        self.assertEqual(_get_timezone('-05:30').utcoffset(None), -timedelta(hours=5, minutes=30))
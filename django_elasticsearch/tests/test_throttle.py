@@ -0,0 +1,139 @@
+# python
+from datetime import datetime
+import unittest
+
+# djes
+from django_elasticsearch import throttle
+from django_elasticsearch.throttle import TokenBucket, Throttle
+
+__author__ = 'jorgealegre'
+
+
+class FakeTime(object):
+    """
+    Clock for throttle module, sleeping moves clock forward
+    """
+
+    def __init__(self):
+        # epoch start keeps float sums exact
+        self.now = 0.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeESConnection(object):
+
+    def __init__(self):
+        self.sources = None
+        self.requests = []
+
+    def _send_request(self, method, path, body=None, params=None):
+        self.requests.append((method, path))
+        if self.sources is None:
+            return {'found': False}
+        return {'found': True, '_source': self.sources}
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.connection = FakeESConnection()
+
+
+class ClockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeTime()
+        self._time = throttle.time
+        throttle.time = self.clock
+
+    def tearDown(self):
+        throttle.time = self._time
+
+
+class TokenBucketTestCase(ClockTestCase):
+
+    def test_no_limit(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.consume(1000000), 0.0)
+        bucket.set_rate(0)
+        self.assertEqual(bucket.consume(1000000), 0.0)
+        self.assertEqual(self.clock.slept, [])
+
+    def test_rate(self):
+        bucket = TokenBucket(100)
+        self.assertAlmostEqual(bucket.consume(50), 0.5)
+        self.assertAlmostEqual(bucket.consume(100), 1.0)
+        # tokens refill while idle, up to capacity
+        self.clock.now += 10
+        self.assertEqual(bucket.consume(100), 0.0)
+
+    def test_request_bigger_than_capacity_leaves_debt(self):
+        bucket = TokenBucket(100)
+        self.assertAlmostEqual(bucket.consume(300), 1.0)
+        # 200 tokens of debt are paid before next request
+        self.assertAlmostEqual(bucket.consume(100), 3.0)
+
+    def test_waits_at_most_one_second_per_sleep(self):
+        bucket = TokenBucket(10, capacity=50)
+        self.assertAlmostEqual(bucket.consume(50), 5.0)
+        self.assertTrue(all(seconds <= 1.0 for seconds in self.clock.slept))
+
+    def test_set_rate(self):
+        bucket = TokenBucket(1000)
+        bucket.set_rate(10)
+        self.assertEqual(bucket.capacity, 10.0)
+        self.assertAlmostEqual(bucket.consume(10), 1.0)
+        bucket.set_rate(None)
+        self.assertIsNone(bucket.rate)
+        self.assertEqual(bucket.consume(1000), 0.0)
+
+
+class ThrottleTestCase(ClockTestCase):
+
+    def setUp(self):
+        super(ThrottleTestCase, self).setUp()
+        self.connection = FakeConnection()
+
+    def _updated_on(self, seconds):
+        return datetime.fromtimestamp(int(self.clock.now + seconds)).strftime("%Y-%m-%dT%H:%M:%S")
+
+    def test_initial_limits_kept_until_poll_interval(self):
+        self.connection.connection.sources = {'docs_per_sec': None, 'bytes_per_sec': None,
+                                              'updated_on': self._updated_on(1)}
+        limits = Throttle(self.connection, 'alias', docs_per_sec=100)
+        limits.wait(10, 100)
+        self.assertEqual(self.connection.connection.requests, [])
+        self.assertEqual(limits.docs.rate, 100.0)
+
+    def test_poll_applies_limits_set_after_start(self):
+        limits = Throttle(self.connection, 'alias', docs_per_sec=100)
+        self.connection.connection.sources = {'docs_per_sec': 10, 'bytes_per_sec': 1000,
+                                              'updated_on': self._updated_on(1)}
+        self.clock.now += Throttle.POLL_INTERVAL
+        limits.wait(1, 1)
+        self.assertEqual(self.connection.connection.requests, [('GET', '/.django_engine/throttle/alias')])
+        self.assertEqual(limits.docs.rate, 10.0)
+        self.assertEqual(limits.bytes.rate, 1000.0)
+
+    def test_poll_ignores_limits_of_earlier_runs(self):
+        self.connection.connection.sources = {'docs_per_sec': None, 'bytes_per_sec': None,
+                                              'updated_on': self._updated_on(-3600)}
+        limits = Throttle(self.connection, 'alias', docs_per_sec=100, bytes_per_sec=1000)
+        self.clock.now += Throttle.POLL_INTERVAL
+        limits.wait(1, 1)
+        self.assertEqual(len(self.connection.connection.requests), 1)
+        self.assertEqual(limits.docs.rate, 100.0)
+        self.assertEqual(limits.bytes.rate, 1000.0)
+
+    def test_poll_without_limits(self):
+        limits = Throttle(self.connection, 'alias', docs_per_sec=100)
+        self.clock.now += Throttle.POLL_INTERVAL
+        limits.wait(1, 1)
+        self.assertEqual(limits.docs.rate, 100.0)
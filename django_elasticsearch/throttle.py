@@ -0,0 +1,231 @@
+# python
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# pyes
+from pyes.exceptions import IndexMissingException, ElasticSearchException
+
+# djes
+from . import INTERNAL_INDEX, THROTTLE
+
+__author__ = 'jorgealegre'
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limit. Rate can be changed while consumers wait. Rate None or 0 means no limit.
+    """
+
+    def __init__(self, rate=None, capacity=None):
+        self._lock = threading.Lock()
+        self.rate = None
+        self.capacity = None
+        self._tokens = 0.0
+        self._updated = time.time()
+        self._capacity = capacity
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """
+        Set tokens per second, bucket holds one second of tokens unless capacity was informed
+
+        :param rate: tokens per second
+        :return:
+        """
+        with self._lock:
+            self.rate = float(rate) if rate else None
+            self.capacity = self._capacity or self.rate
+            if self.rate is not None:
+                self._tokens = min(self._tokens, self.capacity)
+
+    def consume(self, tokens):
+        """
+        Take tokens from bucket, sleeping until they are available. Requests bigger than bucket capacity
+        leave bucket in debt, so average rate is kept.
+
+        :param tokens: tokens to take
+        :return: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                if self.rate is None:
+                    self._updated = now
+                    return waited
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= min(tokens, self.capacity):
+                    self._tokens -= tokens
+                    return waited
+                wait = (min(tokens, self.capacity) - self._tokens) / self.rate
+            # wait at most one second so rate changes apply soon
+            wait = min(wait, 1.0)
+            time.sleep(wait)
+            waited += wait
+
+
+class Throttle(object):
+    """
+    Documents per second and bytes per second limits for alias rebuilds. Limits are polled from internal
+    index, so they can be changed with DatabaseOperations.set_throttle while rebuild runs. Limits set
+    before throttle was created, like for an earlier rebuild, are ignored.
+    """
+
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, connection, alias, docs_per_sec=None, bytes_per_sec=None):
+        self.connection = connection
+        self.alias = alias
+        self.docs = TokenBucket(docs_per_sec)
+        self.bytes = TokenBucket(bytes_per_sec)
+        self._polled = time.time()
+        # set_throttle stores updated_on with seconds, as local time
+        self._started_on = datetime.fromtimestamp(int(self._polled)).strftime("%Y-%m-%dT%H:%M:%S")
+
+    def _poll(self):
+        """
+        Get limits for alias from internal index
+        """
+        self._polled = time.time()
+        es_connection = self.connection.connection
+        try:
+            result = es_connection._send_request('GET', u'/{}/{}/{}'.format(INTERNAL_INDEX, THROTTLE, self.alias))
+        except (IndexMissingException, ElasticSearchException):
+            return
+        if not result.get('found') or result['_source'].get('updated_on', '') < self._started_on:
+            return
+        source = result['_source']
+        if source.get('docs_per_sec') != self.docs.rate or source.get('bytes_per_sec') != self.bytes.rate:
+            logger.info(u'Throttle :: alias: {} docs_per_sec: {} bytes_per_sec: {}'.format(
+                self.alias,
+                source.get('docs_per_sec'),
+                source.get('bytes_per_sec'),
+            ))
+        self.docs.set_rate(source.get('docs_per_sec'))
+        self.bytes.set_rate(source.get('bytes_per_sec'))
+
+    def wait(self, docs, size):
+        """
+        Wait until docs and size bytes can be sent
+
+        :param docs: number of documents
+        :param size: bytes
+        :return: seconds waited
+        """
+        if time.time() - self._polled >= self.POLL_INTERVAL:
+            self._poll()
+        return self.docs.consume(docs) + self.bytes.consume(size)
+
+
+class ReindexStats(object):
+    """
+    Progress for rebuilds and reindex: documents copied, rate, ETA and bulk latency percentiles
+    """
+
+    LOG_INTERVAL = 10.0
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self, alias, total=None):
+        self.alias = alias
+        self.total = total
+        self.docs = 0
+        self.bytes = 0
+        self.throttled = 0.0
+        self.started = time.time()
+        self.finished = None
+        self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self._logged = self.started
+        self._lock = threading.Lock()
+
+    def add_bulk(self, docs, size, latency, throttled=0.0):
+        """
+        Add bulk request
+
+        :param docs: documents sent
+        :param size: bytes sent
+        :param latency: bulk request seconds
+        :param throttled: seconds waited for throttle
+        :return:
+        """
+        with self._lock:
+            self.docs += docs
+            self.bytes += size
+            self.throttled += throttled
+            self._latencies.append(latency)
+        if time.time() - self._logged >= self.LOG_INTERVAL:
+            self._logged = time.time()
+            self.log()
+
+    def finish(self):
+        self.finished = time.time()
+        self.log()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rate(self):
+        """
+        Documents per second
+        """
+        if not self.elapsed:
+            return 0.0
+        return self.docs / self.elapsed
+
+    @property
+    def eta(self):
+        """
+        Seconds to finish, None when total is not known
+        """
+        if self.total is None or not self.rate:
+            return None
+        return max(self.total - self.docs, 0) / self.rate
+
+    def percentiles(self, points=(50, 90, 99)):
+        """
+        Bulk latency percentiles in seconds for last LATENCY_SAMPLES bulk requests
+
+        :param points: percentiles
+        :return: dictionary percentile -> seconds
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return dict((point, None) for point in points)
+        return dict((point, latencies[min(len(latencies) - 1, int(len(latencies) * point / 100.0))])
+                    for point in points)
+
+    def as_dict(self):
+        return {
+            'alias': self.alias,
+            'docs': self.docs,
+            'total': self.total,
+            'bytes': self.bytes,
+            'rate': self.rate,
+            'eta': self.eta,
+            'elapsed': self.elapsed,
+            'throttled': self.throttled,
+            'latency': self.percentiles(),
+        }
+
+    def log(self):
+        latency = self.percentiles()
+        logger.info(u'ReindexStats :: alias: {} docs: {}/{} rate: {:.1f} docs/s eta: {} '
+                    u'latency p50: {} p90: {} p99: {} throttled: {:.1f}s'.format(
+                        self.alias,
+                        self.docs,
+                        self.total if self.total is not None else '?',
+                        self.rate,
+                        u'{:.0f}s'.format(self.eta) if self.eta is not None else '?',
+                        latency[50],
+                        latency[90],
+                        latency[99],
+                        self.throttled,
+                    ))